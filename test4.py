@@ -1,10 +1,21 @@
 using System;
+using System.Collections.Concurrent;
 using System.Collections.Generic;
 using System.Data;
 using System.Data.Common;
 using System.Data.SqlClient;
+using System.Diagnostics;
 using System.Dynamic;
+using System.Globalization;
+using System.IO;
+using System.IO.Compression;
+using System.IO.MemoryMappedFiles;
 using System.Linq;
+using System.Linq.Expressions;
+using System.Reflection;
+using System.Runtime.CompilerServices;
+using System.Threading;
+using System.Threading.Channels;
 using System.Threading.Tasks;
 using NLog;
 using Portal.Api.Models;
@@ -20,368 +31,789 @@ namespace Portal.Api.Helpers
     {
         private static Logger Logger = LogManager.GetCurrentClassLogger();
 
-        public static IEnumerable<dynamic> ExecuteStoredProcedureWithResultSet(string DatabaseConnectionString, string StoredProcedure, List<SqlParameter> SqlParams)
+        private static readonly TimeSpan ReferenceDataTtl = TimeSpan.FromMinutes(30);
+        private static readonly TimeSpan DashReferenceDataTtl = TimeSpan.FromMinutes(5);
+
+        public static readonly ReferenceDataCache ReferenceData = new ReferenceDataCache(256, 200000);
+
+        private static readonly TimeSpan HistoryRefreshInterval = TimeSpan.FromMinutes(5);
+
+        public static readonly HistoryCache<FactorReturn> FactorReturnHistory = new HistoryCache<FactorReturn>(
+            x => "usmeds_fac_ret", x => Convert.ToDateTime(x.Timestamp).Date, 1, 2000000, HistoryRefreshInterval);
+        public static readonly HistoryCache<FactorLoading> FactorLoadingHistory = new HistoryCache<FactorLoading>(
+            x => x.BarraId + "|" + x.FactorName, x => Convert.ToDateTime(x.BusDate).Date, 100000, 10000000, HistoryRefreshInterval);
+        public static readonly HistoryCache<RiskReturn> SpecificReturnHistory = new HistoryCache<RiskReturn>(
+            x => x.BarraId, x => Convert.ToDateTime(x.BusDate).Date, 5000, 5000000, HistoryRefreshInterval);
+
+        private static readonly object BarraSnapshotLock = new object();
+        private static BarraSnapshot CurrentBarraSnapshot;
+        private static DateTime BarraSnapshotCheckedAt;
+
+        public static string BarraSnapshotDirectory { get; set; }
+
+        private static readonly AsyncLocal<ReplayDataSource> Replay = new AsyncLocal<ReplayDataSource>();
+
+        public static readonly ReplicaRouter Replicas = new ReplicaRouter();
+
+        public static IEnumerable<dynamic> ExecuteStoredProcedureWithResultSet(string DatabaseConnectionString, string StoredProcedure, List<SqlParameter> SqlParams,
+            DatabaseScope Scope = null, CancellationToken cancellationToken = default)
         {
-            using (var connection = new SqlConnection(DatabaseConnectionString))
+            using (var timer = QueryStatistics.Start(StoredProcedure))
+            using (var lease = OpenSqlConnection(DatabaseConnectionString, Scope, true))
             {
-                connection.Open();
+                timer.Opened();
 
-                var command = connection.CreateCommand();
-                command.CommandTimeout = Startup.SqlTimeout; 
-                command.CommandType = CommandType.StoredProcedure;
-                command.CommandText = StoredProcedure;
+                var command = lease.CreateCommand(CommandType.StoredProcedure, StoredProcedure, cancellationToken: cancellationToken);
+                AddParameters(command, SqlParams);
 
-                if (SqlParams != null)
+                using (var dataReader = ExecuteReader(command))
                 {
-                    foreach (SqlParameter param in SqlParams)
+                    foreach (var item in ReadRows(dataReader, timer))
                     {
-                        command.Parameters.Add(param);
+                        yield return item;
                     }
                 }
 
-                using (var dataReader = command.ExecuteReader())
-                {
-                    var fields = new List<String>();
+                timer.Complete();
+            }
+        }
+
+        public static IEnumerable<T> ExecuteStoredProcedureWithResultSet<T>(string DatabaseConnectionString, string StoredProcedure, List<SqlParameter> SqlParams,
+            IDictionary<string, string> ColumnMap = null, Action<DbDataReader, T> RowCallback = null, DatabaseScope Scope = null,
+            CancellationToken cancellationToken = default) where T : new()
+        {
+            using (var timer = QueryStatistics.Start(StoredProcedure))
+            using (var lease = OpenSqlConnection(DatabaseConnectionString, Scope, true))
+            {
+                timer.Opened();
+
+                var command = lease.CreateCommand(CommandType.StoredProcedure, StoredProcedure, cancellationToken: cancellationToken);
+                AddParameters(command, SqlParams);
 
-                    for (var i = 0; i < dataReader.FieldCount; i++)
+                using (var dataReader = ExecuteReader(command))
+                {
+                    foreach (T item in ReadRows(StoredProcedure, dataReader, ColumnMap, RowCallback, timer))
                     {
-                        fields.Add(dataReader.GetName(i));
+                        yield return item;
                     }
+                }
 
-                    while (dataReader.Read())
-                    {
-                        var item = new ExpandoObject() as IDictionary<String, Object>;                        
+                timer.Complete();
+            }
+        }
 
-                        for (var i = 0; i < fields.Count; i++)
-                        {
-                            item.Add(fields[i], dataReader[fields[i]]);
-                        }
+        public static IEnumerable<dynamic> ExecuteInlineQueryWithResultSet(string DatabaseConnectionString, string Query,
+            DatabaseScope Scope = null, CancellationToken cancellationToken = default, List<SqlParameter> SqlParams = null)
+        {
+            using (var timer = QueryStatistics.Start(QueryStatistics.Fingerprint(Query)))
+            using (var lease = OpenSqlConnection(DatabaseConnectionString, Scope, true))
+            {
+                timer.Opened();
+
+                var command = lease.CreateCommand(CommandType.Text, Query, cancellationToken: cancellationToken);
+                AddParameters(command, SqlParams);
 
+                using (var dataReader = ExecuteReader(command))
+                {
+                    foreach (var item in ReadRows(dataReader, timer))
+                    {
                         yield return item;
                     }
                 }
+
+                timer.Complete();
             }
         }
 
-        public static IEnumerable<dynamic> ExecuteInlineQueryWithResultSet(string DatabaseConnectionString, string Query)
+        private static ConnectionLease OpenSqlConnection(string DatabaseConnectionString, DatabaseScope Scope, bool ReadOnly = false)
         {
-            using (var connection = new SqlConnection(DatabaseConnectionString))
+            if (Replay.Value != null)
             {
-                connection.Open();
-
-                var command = connection.CreateCommand();
-                command.CommandTimeout = Startup.SqlTimeout;
-                command.CommandType = CommandType.Text;
-                command.CommandText = Query;
+                return new ConnectionLease(new SqlConnection(), null, true);
+            }
 
-                using (var dataReader = command.ExecuteReader())
+            if (Scope != null)
+            {
+                if (!ReadOnly)
                 {
-                    var fields = new List<String>();
+                    Replicas.Route(DatabaseConnectionString, false);
+                }
 
-                    for (var i = 0; i < dataReader.FieldCount; i++)
-                    {
-                        fields.Add(dataReader.GetName(i));
-                    }
+                return Scope.Lease<SqlConnection>(DatabaseConnectionString);
+            }
 
-                    while (dataReader.Read())
-                    {
-                        var item = new ExpandoObject() as IDictionary<String, Object>;
+            string target = Replicas.Route(DatabaseConnectionString, ReadOnly);
 
-                        for (var i = 0; i < fields.Count; i++)
-                        {
-                            item.Add(fields[i], dataReader[fields[i]]);
-                        }
+            if (target != DatabaseConnectionString)
+            {
+                var replica = new SqlConnection(target);
+                Stopwatch stopwatch = Stopwatch.StartNew();
 
-                        yield return item;
-                    }
+                try
+                {
+                    replica.Open();
+                    Replicas.ReportSuccess(target, stopwatch.Elapsed);
+
+                    return new ConnectionLease(replica, null, true);
+                }
+                catch (SqlException ex)
+                {
+                    replica.Dispose();
+                    Replicas.ReportFailure(target);
+                    Logger.Warn(ex, "Read replica unavailable, reading from primary");
                 }
             }
+
+            var connection = new SqlConnection(DatabaseConnectionString);
+            connection.Open();
+
+            return new ConnectionLease(connection, null, true);
         }
 
-        public static async Task<IEnumerable<dynamic>> ExecuteInlineQueryAsyncWithResultSet(DbConnection conn, string query)
+        private static async Task<ConnectionLease> OpenSqlConnectionAsync(string DatabaseConnectionString, DatabaseScope Scope, CancellationToken cancellationToken,
+            bool ReadOnly = false)
         {
-            List<dynamic> results = new List<dynamic>();
-            var command = conn.CreateCommand();
-            command.CommandTimeout = Startup.SqlTimeout;
-            command.CommandType = CommandType.Text;
-            command.CommandText = query;
-
-            using (var dataReader = await command.ExecuteReaderAsync())
+            if (Replay.Value != null)
             {
-                var fields = new List<string>();
+                return new ConnectionLease(new SqlConnection(), null, true);
+            }
 
-                for (var i = 0; i < dataReader.FieldCount; i++)
+            if (Scope != null)
+            {
+                if (!ReadOnly)
                 {
-                    fields.Add(dataReader.GetName(i));
+                    Replicas.Route(DatabaseConnectionString, false);
                 }
 
-                while (dataReader.Read())
-                {
-                    var item = new ExpandoObject() as IDictionary<string, object>;
+                return Scope.Lease<SqlConnection>(DatabaseConnectionString);
+            }
 
-                    for (var i = 0; i < fields.Count; i++)
-                    {
-                        item.Add(fields[i], dataReader[fields[i]]);
-                    }
+            string target = Replicas.Route(DatabaseConnectionString, ReadOnly);
 
-                    results.Add(item);
+            if (target != DatabaseConnectionString)
+            {
+                var replica = new SqlConnection(target);
+                Stopwatch stopwatch = Stopwatch.StartNew();
+
+                try
+                {
+                    await replica.OpenAsync(cancellationToken);
+                    Replicas.ReportSuccess(target, stopwatch.Elapsed);
+
+                    return new ConnectionLease(replica, null, true);
+                }
+                catch (SqlException ex)
+                {
+                    replica.Dispose();
+                    Replicas.ReportFailure(target);
+                    Logger.Warn(ex, "Read replica unavailable, reading from primary");
                 }
-                return results;
             }
+
+            var connection = new SqlConnection(DatabaseConnectionString);
+            await connection.OpenAsync(cancellationToken);
+
+            return new ConnectionLease(connection, null, true);
         }
 
-        public static async Task<IEnumerable<dynamic>> ExecuteInlineQueryAsyncWithResultSet(string DatabaseConnectionString, string Query, List<SqlParameter> SqlParams = null)
+        private static async Task<ConnectionLease> OpenPostgresConnectionAsync(string DatabaseConnectionString, DatabaseScope Scope, CancellationToken cancellationToken)
         {
-            List<dynamic> results = new List<dynamic>();
-            using (var connection = new SqlConnection(DatabaseConnectionString))
+            if (Replay.Value != null)
             {
-                connection.Open();
+                return new ConnectionLease(new Npgsql.NpgsqlConnection(), null, true);
+            }
 
-                var command = connection.CreateCommand();
-                command.CommandTimeout = Startup.SqlTimeout;
-                command.CommandType = CommandType.Text;
-                command.CommandText = Query;
+            if (Scope != null)
+            {
+                return Scope.Lease<Npgsql.NpgsqlConnection>(DatabaseConnectionString);
+            }
 
-                if (SqlParams != null)
-                {
-                    foreach (SqlParameter param in SqlParams)
-                    {
-                        command.Parameters.Add(param);
-                    }
-                }
+            var connection = new Npgsql.NpgsqlConnection(DatabaseConnectionString);
+            await connection.OpenAsync(cancellationToken);
 
-                using (var dataReader = await command.ExecuteReaderAsync())
-                {
-                    var fields = new List<String>();
+            return new ConnectionLease(connection, null, true);
+        }
 
-                    for (var i = 0; i < dataReader.FieldCount; i++)
-                    {
-                        fields.Add(dataReader.GetName(i));
-                    }
+        private static ConnectionLease OpenPostgresConnection(string DatabaseConnectionString, DatabaseScope Scope)
+        {
+            if (Replay.Value != null)
+            {
+                return new ConnectionLease(new Npgsql.NpgsqlConnection(), null, true);
+            }
 
-                    while (dataReader.Read())
-                    {
-                        var item = new ExpandoObject() as IDictionary<String, Object>;
+            if (Scope != null)
+            {
+                return Scope.Lease<Npgsql.NpgsqlConnection>(DatabaseConnectionString);
+            }
 
-                        for (var i = 0; i < fields.Count; i++)
-                        {
-                            item.Add(fields[i], dataReader[fields[i]]);
-                        }
+            var connection = new Npgsql.NpgsqlConnection(DatabaseConnectionString);
+            connection.Open();
 
-                        results.Add(item);
-                    }
+            return new ConnectionLease(connection, null, true);
+        }
 
-                    return results;
-                }
+        private static DbDataReader ExecuteReader(DbCommand command, bool Prepare = false)
+        {
+            ReplayDataSource replay = Replay.Value;
+
+            if (replay != null)
+            {
+                return replay.CreateReader(command.CommandText);
+            }
+
+            if (Prepare)
+            {
+                command.Prepare();
             }
+
+            return command.ExecuteReader();
         }
 
-        public static async Task<object> ExecuteInlineQueryAsyncReturnValue(DbConnection conn, string query, List<SqlParameter> SqlParams = null)
+        private static async Task<DbDataReader> ExecuteReaderAsync(DbCommand command, CancellationToken cancellationToken)
         {
-            var command = conn.CreateCommand();
-            command.CommandTimeout = Startup.SqlTimeout;
-            command.CommandType = CommandType.Text;
-            command.CommandText = query;
+            ReplayDataSource replay = Replay.Value;
+
+            if (replay != null)
+            {
+                return replay.CreateReader(command.CommandText);
+            }
+
+            return await command.ExecuteReaderAsync(cancellationToken);
+        }
+
+        public static IDisposable UseReplay(ReplayDataSource Source)
+        {
+            var previous = Replay.Value;
+            Replay.Value = Source;
+
+            return new ReplayRestore(previous);
+        }
+
+        private sealed class ReplayRestore : IDisposable
+        {
+            private readonly ReplayDataSource Previous;
+
+            public ReplayRestore(ReplayDataSource Previous)
+            {
+                this.Previous = Previous;
+            }
 
+            public void Dispose()
+            {
+                Replay.Value = Previous;
+            }
+        }
+
+        public static List<QueryStatisticsSnapshot> GetQueryStatistics()
+        {
+            return QueryStatistics.GetSnapshot();
+        }
+
+        public static void LogQueryStatistics()
+        {
+            foreach (QueryStatisticsSnapshot stat in QueryStatistics.GetSnapshot())
+            {
+                Logger.Info($"{stat.Key}: calls={stat.Calls} incomplete={stat.Incomplete} " +
+                    $"open p50/p99={stat.Open.P50:N1}/{stat.Open.P99:N1}ms " +
+                    $"firstRow p50/p99={stat.FirstRow.P50:N1}/{stat.FirstRow.P99:N1}ms " +
+                    $"total p50/p99={stat.Total.P50:N1}/{stat.Total.P99:N1}ms " +
+                    $"mapping mean={stat.Mapping.Mean:N1}ms rows p50/max={stat.Rows.P50:N0}/{stat.Rows.Max:N0}");
+            }
+        }
+
+        private static void AddParameters(DbCommand command, IEnumerable<DbParameter> SqlParams)
+        {
             if (SqlParams != null)
             {
-                foreach (SqlParameter param in SqlParams)
+                foreach (DbParameter param in SqlParams)
                 {
                     command.Parameters.Add(param);
                 }
             }
+        }
+
+        internal static IEnumerable<dynamic> ReadRows(DbDataReader dataReader, QueryTimer Timer = null)
+        {
+            var fields = new List<String>();
 
+            for (var i = 0; i < dataReader.FieldCount; i++)
+            {
+                fields.Add(dataReader.GetName(i));
+            }
 
-            using (var dataReader = await command.ExecuteReaderAsync())
+            while (dataReader.Read())
             {
-                var fields = new List<string>();
+                var item = new ExpandoObject() as IDictionary<String, Object>;
 
-                for (var i = 0; i < dataReader.FieldCount; i++)
+                for (var i = 0; i < fields.Count; i++)
                 {
-                    fields.Add(dataReader.GetName(i));
+                    item.Add(fields[i], dataReader.GetValue(i));
                 }
 
-                return command.ExecuteScalar();
+                Timer?.Row();
+                yield return item;
+                Timer?.Resumed();
             }
         }
 
-        public static object ExecuteInlineQueryWithReturnValue(
-            string DatabaseConnectionString, string Query, List<SqlParameter> SqlParams = null)
+        internal static IEnumerable<T> ReadRows<T>(string Source, DbDataReader dataReader,
+            IDictionary<string, string> ColumnMap, Action<DbDataReader, T> RowCallback, QueryTimer Timer = null) where T : new()
         {
-            object ReturnValue;
+            Func<DbDataReader, T> materialize = RowMaterializer.GetMaterializer<T>(Source, dataReader, ColumnMap);
 
-            using (var connection = new SqlConnection(DatabaseConnectionString))
+            while (dataReader.Read())
             {
-                connection.Open();
-
-                var command = connection.CreateCommand();
-                command.CommandTimeout = Startup.SqlTimeout;
-                command.CommandType = CommandType.Text;
-                command.CommandText = Query;
+                T item = materialize(dataReader);
 
-                if (SqlParams != null)
+                if (RowCallback != null)
                 {
-                    foreach (SqlParameter param in SqlParams)
-                    {
-                        command.Parameters.Add(param);
-                    }
+                    RowCallback(dataReader, item);
                 }
 
-                ReturnValue = command.ExecuteScalar();
+                Timer?.Row();
+                yield return item;
+                Timer?.Resumed();
             }
+        }
 
-            return ReturnValue;
+        public static async Task<IEnumerable<dynamic>> ExecuteInlineQueryAsyncWithResultSet(DbConnection conn, string query,
+            CancellationToken cancellationToken = default)
+        {
+            List<dynamic> results = new List<dynamic>();
+            var command = conn.CreateCommand();
+            command.CommandTimeout = QueryDeadline.CommandTimeout(Startup.SqlTimeout);
+            command.CommandType = CommandType.Text;
+            command.CommandText = query;
+
+            using (QueryDeadline.Register(command, cancellationToken))
+            using (var dataReader = await command.ExecuteReaderAsync(cancellationToken))
+            {
+                await foreach (var item in ReadRowsAsync(dataReader, null, cancellationToken))
+                {
+                    results.Add(item);
+                }
+                return results;
+            }
         }
 
-        public static int? ExecuteStoredProcedureWithReturnValue(string DatabaseConnectionString, string StoredProcedure, List<SqlParameter> SqlParams)
+        public static async Task<IEnumerable<dynamic>> ExecuteInlineQueryAsyncWithResultSet(string DatabaseConnectionString, string Query, List<SqlParameter> SqlParams = null,
+            CancellationToken cancellationToken = default)
         {
-            int? ReturnValue = null;
+            List<dynamic> results = new List<dynamic>();
+            using (var timer = QueryStatistics.Start(QueryStatistics.Fingerprint(Query)))
+            using (var lease = await OpenSqlConnectionAsync(DatabaseConnectionString, null, cancellationToken, true))
+            {
+                timer.Opened();
+
+                var command = lease.CreateCommand(CommandType.Text, Query, cancellationToken: cancellationToken);
+                AddParameters(command, SqlParams);
+
+                using (var dataReader = await ExecuteReaderAsync(command, cancellationToken))
+                {
+                    await foreach (var item in ReadRowsAsync(dataReader, timer, cancellationToken))
+                    {
+                        results.Add(item);
+                    }
 
-            using (SqlConnection connection = new SqlConnection(DatabaseConnectionString))
+                    timer.Complete();
+                    return results;
+                }
+            }
+        }
+
+        public static async IAsyncEnumerable<dynamic> ExecuteStoredProcedureWithResultSetAsync(string DatabaseConnectionString, string StoredProcedure, List<SqlParameter> SqlParams,
+            [EnumeratorCancellation] CancellationToken cancellationToken = default)
+        {
+            using (var timer = QueryStatistics.Start(StoredProcedure))
+            using (var lease = await OpenSqlConnectionAsync(DatabaseConnectionString, null, cancellationToken, true))
             {
-                connection.Open();
+                timer.Opened();
 
-                var command = connection.CreateCommand();
-                command.CommandType = CommandType.StoredProcedure;
-                command.CommandTimeout = Startup.SqlTimeout;
-                command.CommandText = StoredProcedure;
+                var command = lease.CreateCommand(CommandType.StoredProcedure, StoredProcedure, cancellationToken: cancellationToken);
+                AddParameters(command, SqlParams);
 
-                if (SqlParams != null)
+                using (var dataReader = await ExecuteReaderAsync(command, cancellationToken))
                 {
-                    foreach (SqlParameter param in SqlParams)
+                    await foreach (var item in ReadRowsAsync(dataReader, timer, cancellationToken))
                     {
-                        command.Parameters.Add(param);
+                        yield return item;
                     }
                 }
 
-                ReturnValue = (int)command.ExecuteScalar();
+                timer.Complete();
             }
-
-            return ReturnValue;
         }
 
-        public static object ExecuteStoredProcedureWithReturnValueO(string DatabaseConnectionString, string StoredProcedure, List<SqlParameter> SqlParams)
+        public static async IAsyncEnumerable<T> ExecuteStoredProcedureWithResultSetAsync<T>(string DatabaseConnectionString, string StoredProcedure, List<SqlParameter> SqlParams,
+            IDictionary<string, string> ColumnMap = null, Action<DbDataReader, T> RowCallback = null,
+            [EnumeratorCancellation] CancellationToken cancellationToken = default) where T : new()
         {
-            object ReturnValue = null;
-
-            using (SqlConnection connection = new SqlConnection(DatabaseConnectionString))
+            using (var timer = QueryStatistics.Start(StoredProcedure))
+            using (var lease = await OpenSqlConnectionAsync(DatabaseConnectionString, null, cancellationToken, true))
             {
-                connection.Open();
+                timer.Opened();
 
-                var command = connection.CreateCommand();
-                command.CommandType = CommandType.StoredProcedure;
-                command.CommandTimeout = Startup.SqlTimeout;
-                command.CommandText = StoredProcedure;
+                var command = lease.CreateCommand(CommandType.StoredProcedure, StoredProcedure, cancellationToken: cancellationToken);
+                AddParameters(command, SqlParams);
 
-                if (SqlParams != null)
+                using (var dataReader = await ExecuteReaderAsync(command, cancellationToken))
                 {
-                    foreach (SqlParameter param in SqlParams)
+                    await foreach (T item in ReadRowsAsync(StoredProcedure, dataReader, ColumnMap, RowCallback, timer, cancellationToken))
                     {
-                        command.Parameters.Add(param);
+                        yield return item;
                     }
                 }
 
-                ReturnValue = command.ExecuteScalar();
+                timer.Complete();
             }
-
-            return ReturnValue;
         }
 
-        public static int? ExecuteStoredProcedure(string DatabaseConnectionString, string StoredProcedure, List<SqlParameter> SqlParams)
+        public static async IAsyncEnumerable<dynamic> ExecuteInlineQueryWithResultSetAsync(string DatabaseConnectionString, string Query, List<SqlParameter> SqlParams = null,
+            [EnumeratorCancellation] CancellationToken cancellationToken = default)
         {
-            int? ReturnValue = null;
-
-            using (SqlConnection connection = new SqlConnection(DatabaseConnectionString))
+            using (var timer = QueryStatistics.Start(QueryStatistics.Fingerprint(Query)))
+            using (var lease = await OpenSqlConnectionAsync(DatabaseConnectionString, null, cancellationToken, true))
             {
-                connection.Open();
+                timer.Opened();
 
-                var command = connection.CreateCommand();
-                command.CommandType = CommandType.StoredProcedure;
-                command.CommandTimeout = Startup.SqlTimeout;
-                command.CommandText = StoredProcedure;
+                var command = lease.CreateCommand(CommandType.Text, Query, cancellationToken: cancellationToken);
+                AddParameters(command, SqlParams);
 
-                if (SqlParams != null)
+                using (var dataReader = await ExecuteReaderAsync(command, cancellationToken))
                 {
-                    foreach (SqlParameter param in SqlParams)
+                    await foreach (var item in ReadRowsAsync(dataReader, timer, cancellationToken))
                     {
-                        command.Parameters.Add(param);
+                        yield return item;
                     }
                 }
 
-                ReturnValue = command.ExecuteNonQuery();
+                timer.Complete();
             }
-
-            return ReturnValue;
         }
 
-        public static IEnumerable<ExpectedValueIdeaRecommendation> GetExpectedValueIdeaRecommendations()
+        internal static async IAsyncEnumerable<dynamic> ReadRowsAsync(DbDataReader dataReader, QueryTimer Timer = null, [EnumeratorCancellation] CancellationToken cancellationToken = default)
         {
-            List<ExpectedValueIdeaRecommendation> ReturnValue = new List<ExpectedValueIdeaRecommendation>();
+            var fields = new List<String>();
 
-            IEnumerable<dynamic> reader = ExecuteStoredProcedureWithResultSet
-                    (Startup.HoloceneDatabaseConnectionString,
-                    "research.GetExpectedValueIdeaRecommendations", null);
+            for (var i = 0; i < dataReader.FieldCount; i++)
+            {
+                fields.Add(dataReader.GetName(i));
+            }
 
-            foreach (dynamic row in reader)
+            while (await dataReader.ReadAsync(cancellationToken))
             {
-                var rec = new ExpectedValueIdeaRecommendation
+                var item = new ExpandoObject() as IDictionary<String, Object>;
+
+                for (var i = 0; i < fields.Count; i++)
                 {
-                    ExpectedValueIdeaRecommendationId = row.ExpectedValueIdeaRecommendationId,
-                    Code = row.Code,
-                    Desc = row.Desc
-                };
+                    item.Add(fields[i], dataReader.GetValue(i));
+                }
 
-                ReturnValue.Add(rec);
+                Timer?.Row();
+                yield return item;
+                Timer?.Resumed();
             }
-
-            return ReturnValue.AsEnumerable();
         }
 
-        public static IEnumerable<EarningsPreviewReference> GetEarningsPreviewReference()
+        internal static async IAsyncEnumerable<T> ReadRowsAsync<T>(string Source, DbDataReader dataReader,
+            IDictionary<string, string> ColumnMap, Action<DbDataReader, T> RowCallback, QueryTimer Timer,
+            [EnumeratorCancellation] CancellationToken cancellationToken = default) where T : new()
         {
-            List<EarningsPreviewReference> ReturnValue = new List<EarningsPreviewReference>();
-
-            IEnumerable<dynamic> reader = ExecuteStoredProcedureWithResultSet(
-                    Startup.HoloceneDatabaseConnectionString,
-                    "research.GetEarningsPreviewReference", null);
+            Func<DbDataReader, T> materialize = RowMaterializer.GetMaterializer<T>(Source, dataReader, ColumnMap);
 
-            foreach (dynamic row in reader)
+            while (await dataReader.ReadAsync(cancellationToken))
             {
-                var earningsPreview = new EarningsPreviewReference
+                T item = materialize(dataReader);
+
+                if (RowCallback != null)
                 {
-                    EarningsPreviewReferenceId = row.EarningsPreviewReferenceId,
-                    RefGroup = row.RefGroup,
-                    RefName = row.RefName,
-                    RefValue = row.RefValue
-                };
+                    RowCallback(dataReader, item);
+                }
 
-                ReturnValue.Add(earningsPreview);
+                Timer?.Row();
+                yield return item;
+                Timer?.Resumed();
             }
-
-            return ReturnValue.AsEnumerable();
         }
 
-
-        public static IEnumerable<EarningsPreview_Old> GetEarningsPreview(string Symbol, string Username)
+        public static async Task<object> ExecuteInlineQueryAsyncReturnValue(DbConnection conn, string query, List<SqlParameter> SqlParams = null,
+            CancellationToken cancellationToken = default)
         {
-            List<EarningsPreview_Old> ReturnValue = new List<EarningsPreview_Old>();
+            var command = conn.CreateCommand();
+            command.CommandTimeout = QueryDeadline.CommandTimeout(Startup.SqlTimeout);
+            command.CommandType = CommandType.Text;
+            command.CommandText = query;
 
-            List<SqlParameter> parameters = new List<SqlParameter>();
+            AddParameters(command, SqlParams);
 
-            if (!string.IsNullOrEmpty(Symbol))
+            using (QueryDeadline.Register(command, cancellationToken))
             {
-                parameters.Add(new SqlParameter("@Symbol", Symbol));
+                return await command.ExecuteScalarAsync(cancellationToken);
             }
-            parameters.Add(new SqlParameter("@Username", Username));
+        }
 
-            IEnumerable<dynamic> reader = ExecuteStoredProcedureWithResultSet(Startup.HoloceneDatabaseConnectionString, "research.GetEarningsPreview", parameters);
+        public static async Task<object> ExecuteScalarAsync(string DatabaseConnectionString, CommandType CommandType, string CommandText,
+            List<SqlParameter> SqlParams = null, DatabaseScope Scope = null, CancellationToken cancellationToken = default, bool ReadOnly = false)
+        {
+            object ReturnValue;
 
-            foreach (dynamic row in reader)
+            using (var timer = QueryStatistics.Start(CommandType == CommandType.StoredProcedure ? CommandText : QueryStatistics.Fingerprint(CommandText)))
+            using (var lease = await OpenSqlConnectionAsync(DatabaseConnectionString, Scope, cancellationToken, ReadOnly))
             {
-                var earningsPreview = new EarningsPreview_Old
-                {
-                    EarningsPreviewId = row.EarningsPreviewId,
-                    Symbol = row.Symbol,
+                timer.Opened();
+
+                var command = lease.CreateCommand(CommandType, CommandText, cancellationToken: cancellationToken);
+                AddParameters(command, SqlParams);
+
+                ReturnValue = await command.ExecuteScalarAsync(cancellationToken);
+                timer.Complete();
+            }
+
+            return ReturnValue;
+        }
+
+        public static async Task<int> ExecuteNonQueryAsync(string DatabaseConnectionString, CommandType CommandType, string CommandText,
+            List<SqlParameter> SqlParams = null, DatabaseScope Scope = null, CancellationToken cancellationToken = default)
+        {
+            int ReturnValue;
+
+            using (var timer = QueryStatistics.Start(CommandType == CommandType.StoredProcedure ? CommandText : QueryStatistics.Fingerprint(CommandText)))
+            using (var lease = await OpenSqlConnectionAsync(DatabaseConnectionString, Scope, cancellationToken))
+            {
+                timer.Opened();
+
+                var command = lease.CreateCommand(CommandType, CommandText, cancellationToken: cancellationToken);
+                AddParameters(command, SqlParams);
+
+                ReturnValue = await command.ExecuteNonQueryAsync(cancellationToken);
+                timer.Complete();
+            }
+
+            return ReturnValue;
+        }
+
+        public static object ExecuteInlineQueryWithReturnValue(
+            string DatabaseConnectionString, string Query, List<SqlParameter> SqlParams = null, DatabaseScope Scope = null,
+            CancellationToken cancellationToken = default, bool ReadOnly = false)
+        {
+            object ReturnValue;
+
+            using (var timer = QueryStatistics.Start(QueryStatistics.Fingerprint(Query)))
+            using (var lease = OpenSqlConnection(DatabaseConnectionString, Scope, ReadOnly))
+            {
+                timer.Opened();
+
+                var command = lease.CreateCommand(CommandType.Text, Query, cancellationToken: cancellationToken);
+                AddParameters(command, SqlParams);
+
+                ReturnValue = command.ExecuteScalar();
+                timer.Complete();
+            }
+
+            return ReturnValue;
+        }
+
+        public static int? ExecuteStoredProcedureWithReturnValue(string DatabaseConnectionString, string StoredProcedure, List<SqlParameter> SqlParams,
+            DatabaseScope Scope = null, CancellationToken cancellationToken = default)
+        {
+            int? ReturnValue = null;
+
+            using (var timer = QueryStatistics.Start(StoredProcedure))
+            using (var lease = OpenSqlConnection(DatabaseConnectionString, Scope))
+            {
+                timer.Opened();
+
+                var command = lease.CreateCommand(CommandType.StoredProcedure, StoredProcedure, cancellationToken: cancellationToken);
+                AddParameters(command, SqlParams);
+
+                ReturnValue = (int)command.ExecuteScalar();
+                timer.Complete();
+            }
+
+            return ReturnValue;
+        }
+
+        public static object ExecuteStoredProcedureWithReturnValueO(string DatabaseConnectionString, string StoredProcedure, List<SqlParameter> SqlParams,
+            DatabaseScope Scope = null, CancellationToken cancellationToken = default)
+        {
+            object ReturnValue = null;
+
+            using (var timer = QueryStatistics.Start(StoredProcedure))
+            using (var lease = OpenSqlConnection(DatabaseConnectionString, Scope))
+            {
+                timer.Opened();
+
+                var command = lease.CreateCommand(CommandType.StoredProcedure, StoredProcedure, cancellationToken: cancellationToken);
+                AddParameters(command, SqlParams);
+
+                ReturnValue = command.ExecuteScalar();
+                timer.Complete();
+            }
+
+            return ReturnValue;
+        }
+
+        public static int? ExecuteStoredProcedure(string DatabaseConnectionString, string StoredProcedure, List<SqlParameter> SqlParams,
+            DatabaseScope Scope = null, CancellationToken cancellationToken = default)
+        {
+            int? ReturnValue = null;
+
+            using (var timer = QueryStatistics.Start(StoredProcedure))
+            using (var lease = OpenSqlConnection(DatabaseConnectionString, Scope))
+            {
+                timer.Opened();
+
+                var command = lease.CreateCommand(CommandType.StoredProcedure, StoredProcedure, cancellationToken: cancellationToken);
+                AddParameters(command, SqlParams);
+
+                ReturnValue = command.ExecuteNonQuery();
+                timer.Complete();
+            }
+
+            return ReturnValue;
+        }
+
+        private static void AppendStoredProcedureCall(System.Text.StringBuilder Sql, SqlCommand command, string StoredProcedure,
+            List<SqlParameter> SqlParams, string Suffix, IDictionary<string, string> Bindings = null)
+        {
+            string separator = " ";
+
+            Sql.Append("exec ").Append(StoredProcedure);
+
+            foreach (SqlParameter param in SqlParams)
+            {
+                string name = param.ParameterName;
+                string value;
+
+                if (Bindings == null || !Bindings.TryGetValue(name, out value))
+                {
+                    if (param.Value == null)
+                    {
+                        continue;
+                    }
+
+                    value = name + Suffix;
+                    param.ParameterName = value;
+                    param.Direction = ParameterDirection.Input;
+                    command.Parameters.Add(param);
+                }
+
+                Sql.Append(separator).Append(name).Append(" = ").Append(value);
+                separator = ", ";
+            }
+
+            Sql.AppendLine(";");
+        }
+
+        // Fails the batch (and so rolls it back) unless the preceding INSERT ... EXEC captured exactly one id.
+        private static void AppendCaptureCheck(System.Text.StringBuilder Sql, string StoredProcedure)
+        {
+            Sql.Append("if @@rowcount <> 1 throw 50000, '").Append(StoredProcedure).AppendLine(" did not return exactly one id', 1;");
+        }
+
+        private static string BuildBatch(string Declarations, string Statements, string Results, bool Transactional)
+        {
+            var sql = new System.Text.StringBuilder();
+
+            sql.AppendLine("set nocount on;");
+            sql.AppendLine("set xact_abort on;");
+            sql.Append(Declarations);
+
+            if (Transactional)
+            {
+                sql.AppendLine("begin try");
+                sql.AppendLine("begin transaction;");
+                sql.Append(Statements);
+                sql.AppendLine("commit transaction;");
+                sql.AppendLine("end try");
+                sql.AppendLine("begin catch");
+                sql.AppendLine("if @@trancount > 0 rollback transaction;");
+                sql.AppendLine("throw;");
+                sql.AppendLine("end catch");
+            }
+            else
+            {
+                sql.Append(Statements);
+            }
+
+            sql.Append(Results);
+
+            return sql.ToString();
+        }
+
+        public static IEnumerable<ExpectedValueIdeaRecommendation> GetExpectedValueIdeaRecommendations()
+        {
+            List<ExpectedValueIdeaRecommendation> ReturnValue = new List<ExpectedValueIdeaRecommendation>();
+
+            IEnumerable<dynamic> reader = ExecuteStoredProcedureWithResultSet
+                    (Startup.HoloceneDatabaseConnectionString,
+                    "research.GetExpectedValueIdeaRecommendations", null);
+
+            foreach (dynamic row in reader)
+            {
+                var rec = new ExpectedValueIdeaRecommendation
+                {
+                    ExpectedValueIdeaRecommendationId = row.ExpectedValueIdeaRecommendationId,
+                    Code = row.Code,
+                    Desc = row.Desc
+                };
+
+                ReturnValue.Add(rec);
+            }
+
+            return ReturnValue.AsEnumerable();
+        }
+
+        public static IEnumerable<EarningsPreviewReference> GetEarningsPreviewReference()
+        {
+            return new List<EarningsPreviewReference>(ReferenceData.GetOrAdd("research.GetEarningsPreviewReference", ReferenceDataTtl, LoadEarningsPreviewReference)).AsEnumerable();
+        }
+
+        private static List<EarningsPreviewReference> LoadEarningsPreviewReference()
+        {
+            List<EarningsPreviewReference> ReturnValue = new List<EarningsPreviewReference>();
+
+            IEnumerable<dynamic> reader = ExecuteStoredProcedureWithResultSet(
+                    Startup.HoloceneDatabaseConnectionString,
+                    "research.GetEarningsPreviewReference", null);
+
+            foreach (dynamic row in reader)
+            {
+                var earningsPreview = new EarningsPreviewReference
+                {
+                    EarningsPreviewReferenceId = row.EarningsPreviewReferenceId,
+                    RefGroup = row.RefGroup,
+                    RefName = row.RefName,
+                    RefValue = row.RefValue
+                };
+
+                ReturnValue.Add(earningsPreview);
+            }
+
+            return ReturnValue;
+        }
+
+
+        public static IEnumerable<EarningsPreview_Old> GetEarningsPreview(string Symbol, string Username)
+        {
+            List<EarningsPreview_Old> ReturnValue = new List<EarningsPreview_Old>();
+
+            List<SqlParameter> parameters = new List<SqlParameter>();
+
+            if (!string.IsNullOrEmpty(Symbol))
+            {
+                parameters.Add(new SqlParameter("@Symbol", Symbol));
+            }
+            parameters.Add(new SqlParameter("@Username", Username));
+
+            IEnumerable<dynamic> reader = ExecuteStoredProcedureWithResultSet(Startup.HoloceneDatabaseConnectionString, "research.GetEarningsPreview", parameters);
+
+            foreach (dynamic row in reader)
+            {
+                var earningsPreview = new EarningsPreview_Old
+                {
+                    EarningsPreviewId = row.EarningsPreviewId,
+                    Symbol = row.Symbol,
                     FullBloombergCode = row.FullBloombergCode,
                     SecurityDesc = row.SecurityDesc,
                     ShortName = row.ShortName,
@@ -605,6 +1037,7 @@ namespace Portal.Api.Helpers
                 };
 
             ExecuteStoredProcedureWithReturnValue(Startup.HoloceneDatabaseConnectionString, "research.CreateIdea", parameters);
+            InvalidateEVDashboard();
 
             return ReturnValue;
         }
@@ -624,6 +1057,7 @@ namespace Portal.Api.Helpers
                 };
 
             ExecuteStoredProcedureWithReturnValue(Startup.HoloceneDatabaseConnectionString, "research.UpdateIdea", parameters);
+            InvalidateEVDashboard();
 
             return ReturnValue;
         }
@@ -657,6 +1091,10 @@ namespace Portal.Api.Helpers
             ExecuteStoredProcedure
                 (Startup.HoloceneDatabaseConnectionString, "research.InsertIdeaAbstract", parameters);
 
+            ReferenceData.Invalidate("research.GetIdeaAbstractLongTermViews");
+            ReferenceData.Invalidate("research.GetIdeaAbstractShortTermViews");
+            InvalidateEVDashboard();
+
             return true;
         }
 
@@ -680,6 +1118,7 @@ namespace Portal.Api.Helpers
                 };
 
             ExecuteStoredProcedure(Startup.HoloceneDatabaseConnectionString, "research.SubmitEarningsThesis", parameters);
+            InvalidateEVDashboard();
             return true;
         }
 
@@ -764,6 +1203,11 @@ namespace Portal.Api.Helpers
         }
 
         public static IEnumerable<IdeaStatus> GetIdeaStatuses()
+        {
+            return new List<IdeaStatus>(ReferenceData.GetOrAdd("research.GetIdeaStatuses", ReferenceDataTtl, LoadIdeaStatuses)).AsEnumerable();
+        }
+
+        private static List<IdeaStatus> LoadIdeaStatuses()
         {
             List<IdeaStatus> ReturnValue = new List<IdeaStatus>();
 
@@ -780,15 +1224,47 @@ namespace Portal.Api.Helpers
                 ReturnValue.Add(status);
             }
 
-            return ReturnValue.AsEnumerable();
+            return ReturnValue;
         }
 
+        private static readonly TimeSpan DashboardSnapshotTtl = TimeSpan.FromMinutes(1);
+
+        public static bool RestrictDashboardsToAnalyst { get; set; } = false;
+
         public static IEnumerable<ExpectedValueDashboard> GetExpectedValueDashboard(string Username)
         {
-            List<ExpectedValueDashboard> ReturnValue = new List<ExpectedValueDashboard>();
+            List<ExpectedValueDashboard> snapshot = ReferenceData.GetOrAdd("research.GetExpectedValueDashboardAll", DashboardSnapshotTtl,
+                () => LoadExpectedValueDashboard());
 
-            List<SqlParameter> parameters = new List<SqlParameter>() {
-                    new SqlParameter() {ParameterName = "@Username", SqlDbType = SqlDbType.NVarChar, Value = Username } };
+            return FilterDashboard(snapshot, Username, x => (object)x.AnalystId).AsEnumerable();
+        }
+
+        private static List<T> FilterDashboard<T>(List<T> Snapshot, string Username, Func<T, object> AnalystIdOf)
+        {
+            User user;
+
+            if (!RestrictDashboardsToAnalyst || AnalystIdOf == null || string.IsNullOrEmpty(Username)
+                || !GetUserLookup().TryGetValue(Username, out user) || user.IsAnalyst != true)
+            {
+                return new List<T>(Snapshot);
+            }
+
+            string userId = Convert.ToString((object)user.UserId, CultureInfo.InvariantCulture);
+
+            return Snapshot.Where(x => Convert.ToString(AnalystIdOf(x), CultureInfo.InvariantCulture) == userId).ToList();
+        }
+
+        private static Dictionary<string, User> GetUserLookup()
+        {
+            return ReferenceData.GetOrAdd("app.GetUsers", ReferenceDataTtl,
+                () => GetUsers().Where(x => x.Username != null)
+                    .GroupBy(x => x.Username, StringComparer.OrdinalIgnoreCase)
+                    .ToDictionary(g => g.Key, g => g.First(), StringComparer.OrdinalIgnoreCase));
+        }
+
+        private static List<ExpectedValueDashboard> LoadExpectedValueDashboard()
+        {
+            List<ExpectedValueDashboard> ReturnValue = new List<ExpectedValueDashboard>();
 
             IEnumerable<dynamic> reader = ExecuteStoredProcedureWithResultSet(Startup.HoloceneDatabaseConnectionString, "research.GetExpectedValueDashboardAll", null);
 
@@ -841,114 +1317,165 @@ namespace Portal.Api.Helpers
                 ReturnValue.Add(dash);
             }
 
-            return ReturnValue.AsEnumerable();
+            return ReturnValue;
         }
 
-        public static IEnumerable<EVDashboard> GetEVDashboard()
+        private static readonly Dictionary<string, string> EVDashboardColumnMap = new Dictionary<string, string>(StringComparer.OrdinalIgnoreCase)
         {
-            List<EVDashboard> ReturnValue = new List<EVDashboard>();
-
-            IEnumerable<dynamic> reader = DatabaseHelper
-                    .ExecuteStoredProcedureWithResultSet(Startup.HoloceneDatabaseConnectionString,
-                    "research.GetEVDashboard", null);
-
-            foreach (dynamic row in reader)
-            {
-                var dash = new EVDashboard
-                {
-                    SecurityId = row.SecurityId,
-                    AnalystId = row.AnalystId,
-                    ExpectedValueId = row.ExpectedValueId,
-                    Desk = row.Desk,
-                    Sector = row.Sector,
-                    PositionBlock = row.PositionBlock,
-                    Side = row.Side,
-                    AnalystCode = row.AnalystCode,
-                    Analyst = row.Analyst,
-                    Symbol = row.Symbol,
-                    FullBloombergCode = row.FullBloombergCode,
-                    IdeaRecommendationCode = row.IdeaRecommendationCode,
-                    IdeaRecommendationDesc = row.IdeaRecommendationDesc,
-                    Exposure = Convert.ToDecimal(row.Exposure),
-                    DTD = Convert.ToDecimal(row.DTD),
-                    IdioPnl = Convert.ToDecimal(row.IdioPnl),
-                    PortfolioLastModified = (row.PortfolioLastModified is System.DBNull ? null : row.PortfolioLastModified),
-                    EVLastModified = (row.EVLastModified is System.DBNull ? null : row.EVLastModified),
-                    EVBusDate = (row.EVBusDate is System.DBNull ? null : row.EVBusDate),
-                    EV = Convert.ToDecimal(row.EV),
-                    ER = Convert.ToDecimal(row.ER),
-                    EVDaysSinceLastUpdate = row.EVDaysSinceLastUpdate,
-                    IdeaDaysSinceLastUpdate = row.IdeaDaysSinceLastUpdate,
-                    EVHorizon = row.EVHorizon,
-                    IsLatestByDesk = Convert.ToBoolean(row.IsLatestByDesk),
-                    RealizedAlpha = Convert.ToDecimal(row.RealizedAlpha),
-                    ProjectedAlpha = Convert.ToDecimal(row.ProjectedAlpha),
-
-                    BarraId = row.BarraId,
-                    IsMissingBarraData = Convert.ToBoolean(row.IsMissingBarraData),
-                    IsMissingBarraDataForRealizedAlpha = Convert.ToBoolean(row.IsMissingBarraDataForRealizedAlpha),
-
-                    IsMissingEVFromDesk = Convert.ToBoolean(row.IsMissingEVFromDesk),
-                    EarningsThesisDaysOld = row.EarningsThesisDaysOld,
-                    EarningsThesisId = row.EarningsThesisId,
-                    EarningsThesisFilename = row.EarningsThesisFilename,
-
-                    ResearchEventDate = (row.ResearchEventDate is System.DBNull ? null : row.ResearchEventDate),
-                    ResearchEventAnalyst = row.ResearchEventAnalyst,
-                    ResearchEventDaysSinceLastUpdate = row.ResearchEventDaysSinceLastUpdate,
-                    ResearchEventId = row.ResearchEventId,
-
-                    pBlowout = row.pBlowout,
-                    pUpside = row.pUpside,
-                    pBase = row.pBase,
-                    pDownside = row.pDownside,
-                    pDisaster = row.pDisaster,
-                    pbBlowout = row.pbBlowout,
-                    pbUpside = row.pbUpside,
-                    pbBase = row.pbBase,
-                    pbDownside = row.pbDownside,
-                    pbDisaster = row.pbDisaster,
+            { "StressValueCode", "StressScore" },
+            { "StressValueTooltip", "StressScoreTooltip" },
+            { "AlertDesc", null }
+        };
 
-                    IdeaAbstractShortTermViewCode = row.IdeaAbstractShortTermViewCode,
-                    IdeaAbstractShortTermViewDesc = row.IdeaAbstractShortTermViewDesc,
-                    IdeaAbstractLongTermViewCode = row.IdeaAbstractLongTermViewCode,
-                    IdeaAbstractLongTermViewDesc = row.IdeaAbstractLongTermViewDesc,
+        private static void CompleteEVDashboard(DbDataReader dataReader, EVDashboard dash)
+        {
+            string alertDesc = dataReader["AlertDesc"] as string;
 
-                    StressScore = (row.StressValueCode is System.DBNull ? string.Empty : row.StressValueCode),
-                    StressScoreTooltip = (row.StressValueTooltip is System.DBNull ? string.Empty : row.StressValueTooltip),
+            dash.StressScore = dash.StressScore ?? string.Empty;
+            dash.StressScoreTooltip = dash.StressScoreTooltip ?? string.Empty;
+            dash.RedditzScore = new List<decimal?>();
+            dash.AlertDesc = string.IsNullOrEmpty(alertDesc) ? null : new List<string>(alertDesc.Split("&")).Select(x => x.Trim());
+        }
 
-                    ARKWeight = (row.ARKWeight is System.DBNull ? null : Convert.ToDecimal(row.ARKWeight)),
+        private static readonly TimeSpan EVDashboardRefreshInterval = TimeSpan.FromSeconds(15);
+        private static readonly TimeSpan EVDashboardMaxAge = TimeSpan.FromMinutes(5);
 
-                    RedditPopularity = (row.RedditPopularity is System.DBNull ? null : Convert.ToDecimal(row.RedditPopularity)),
-                    RedditzScore = new List<decimal?>(),
+        public static readonly VersionedSnapshot<EVDashboard> EVDashboardSnapshot = new VersionedSnapshot<EVDashboard>(
+            x => x.Desk + "|" + x.PositionBlock + "|" + x.Side + "|" + x.Symbol + "|" + x.AnalystId, 20000);
 
-                    DollarTurnover = (row.DollarTurnover is System.DBNull ? null : Convert.ToDecimal(row.DollarTurnover)),
-                    SI_DaysToCover = (row.SI_DaysToCover is System.DBNull ? null : Convert.ToDecimal(row.SI_DaysToCover)),
-                    SI_Util = (row.SI_Util is System.DBNull ? null : Convert.ToDecimal(row.SI_Util)),
-                    SI_PctFloat = (row.SI_PctFloat is System.DBNull ? null : Convert.ToDecimal(row.SI_PctFloat)),
-                    SocialActivityzScoreUniversal = (row.SocialActivityzScoreUniversal is System.DBNull ? null : Convert.ToDecimal(row.SocialActivityzScoreUniversal)),
-                    SocialActivityzScoreTrend = (row.SocialActivityzScoreTrend is System.DBNull ? null : Convert.ToDecimal(row.SocialActivityzScoreTrend)),
-                    OptionsOpenInterest = (row.OptionsOpenInterest is System.DBNull ? null : Convert.ToDecimal(row.OptionsOpenInterest)),
-                    LimitUtil = (row.LimitUtil is System.DBNull ? null : Convert.ToDecimal(row.LimitUtil)),
-                    AlertDesc = row.AlertDesc is System.DBNull || string.IsNullOrEmpty(row.AlertDesc) ? null : new List<string>(((string)row.AlertDesc).Split("&")).Select(x => x.Trim()),
-                    MktCap = (row.MktCap is System.DBNull ? null : Convert.ToDecimal(row.MktCap)),
-                    ThesisId = row.ThesisId,
-                    ThesisCreatedOn = row.ThesisCreatedOn is DBNull ? null : row.ThesisCreatedOn,
-                    ThesisText = row.ThesisText
-                };
+        private static readonly object EVDashboardLock = new object();
+        private static int EVDashboardRefreshing;
+        private static int EVDashboardStale;
+        private static DateTime EVDashboardCheckedAt;
+        private static DateTime EVDashboardLoadedAt;
+        private static string EVDashboardChangeToken;
 
-                ReturnValue.Add(dash);
-            }
+        public static IEnumerable<EVDashboard> GetEVDashboard()
+        {
+            return GetEVDashboardSnapshot().GetRows().AsEnumerable();
+        }
 
-            return ReturnValue.AsEnumerable();
+        public static SnapshotDelta<EVDashboard> GetEVDashboardChanges(string Epoch, long SinceVersion)
+        {
+            return GetEVDashboardSnapshot().GetChanges(Epoch, SinceVersion);
         }
 
-        public static IEnumerable<PnlCompare> GetPnlCompare2(string Timestamp1, string Timestamp2, string Desk)
+        public static void InvalidateEVDashboard()
         {
-            List<PnlCompare> ReturnValue = new List<PnlCompare>();
+            Interlocked.Exchange(ref EVDashboardStale, 1);
+        }
 
-            List<SqlParameter> parameters = new List<SqlParameter>();
-            DateTime dateValue = DateTime.MinValue;
+        private static VersionedSnapshot<EVDashboard> GetEVDashboardSnapshot()
+        {
+            if (EVDashboardSnapshot.Version == 0 || Volatile.Read(ref EVDashboardStale) == 1)
+            {
+                lock (EVDashboardLock)
+                {
+                    if (Interlocked.Exchange(ref EVDashboardStale, 0) == 1 || EVDashboardSnapshot.Version == 0)
+                    {
+                        try
+                        {
+                            RefreshEVDashboard(true);
+                        }
+                        catch (Exception ex)
+                        {
+                            if (EVDashboardSnapshot.Version == 0)
+                            {
+                                throw;
+                            }
+
+                            Logger.Error(ex);
+                        }
+                    }
+                }
+            }
+            else if (DateTime.UtcNow - EVDashboardCheckedAt > EVDashboardRefreshInterval
+                && Interlocked.CompareExchange(ref EVDashboardRefreshing, 1, 0) == 0)
+            {
+                Task.Run(() =>
+                {
+                    try
+                    {
+                        lock (EVDashboardLock)
+                        {
+                            RefreshEVDashboard(false);
+                        }
+                    }
+                    catch (Exception ex)
+                    {
+                        Logger.Error(ex);
+                    }
+                    finally
+                    {
+                        EVDashboardCheckedAt = DateTime.UtcNow;
+                        Interlocked.Exchange(ref EVDashboardRefreshing, 0);
+                    }
+                });
+            }
+
+            return EVDashboardSnapshot;
+        }
+
+        private static void RefreshEVDashboard(bool Force)
+        {
+            string token = Convert.ToString(ExecuteInlineQueryWithReturnValue(Startup.HoloceneDatabaseConnectionString,
+                "select isnull(convert(varchar(30), (select max(ModifiedOn) from research.ExpectedValue (nolock)), 126), '') + '|' + " +
+                "isnull(convert(varchar(30), (select max(PortfolioTimestamp) from core.IntradayPositionTimeSeries (nolock)), 126), '')", ReadOnly: true));
+
+            EVDashboardCheckedAt = DateTime.UtcNow;
+
+            if (!Force && token == EVDashboardChangeToken && DateTime.UtcNow - EVDashboardLoadedAt < EVDashboardMaxAge)
+            {
+                return;
+            }
+
+            EVDashboardSnapshot.Apply(LoadEVDashboard());
+            EVDashboardChangeToken = token;
+            EVDashboardLoadedAt = DateTime.UtcNow;
+        }
+
+        internal static List<EVDashboard> LoadEVDashboard()
+        {
+            return ExecuteStoredProcedureWithResultSet<EVDashboard>(
+                    Startup.HoloceneDatabaseConnectionString,
+                    "research.GetEVDashboard", null, EVDashboardColumnMap, CompleteEVDashboard).ToList();
+        }
+
+        public static IAsyncEnumerable<EVDashboard> GetEVDashboardAsync(CancellationToken cancellationToken = default)
+        {
+            return ExecuteStoredProcedureWithResultSetAsync<EVDashboard>(
+                    Startup.HoloceneDatabaseConnectionString,
+                    "research.GetEVDashboard", null, EVDashboardColumnMap, CompleteEVDashboard, cancellationToken);
+        }
+
+        public static bool UsePnlSnapshots { get; set; } = true;
+
+        // Per procedure: true once composed snapshots reproduced the procedure's own comparison, false if they did not.
+        private static readonly ConcurrentDictionary<string, bool> PnlSnapshotContracts = new ConcurrentDictionary<string, bool>();
+
+        private static readonly TimeSpan PnlSnapshotTtl = TimeSpan.FromHours(4);
+
+        public static readonly ReferenceDataCache PnlSnapshots = new ReferenceDataCache(128, 2000000);
+
+        public static IEnumerable<PnlCompare> GetPnlCompare2(string Timestamp1, string Timestamp2, string Desk)
+        {
+            DateTime start, end;
+
+            if (UsePnlSnapshots && DateTime.TryParse(Timestamp1, out start) && DateTime.TryParse(Timestamp2, out end))
+            {
+                return ComparePnlSnapshots("core.GetPnlCompare2", "@Desk", Desk, start, end,
+                    () => ReadPnlCompare2(Timestamp1, Timestamp2, Desk).ToList()).AsEnumerable();
+            }
+
+            List<PnlCompare> ReturnValue = ReadPnlCompare2(Timestamp1, Timestamp2, Desk).ToList();
+
+            return ReturnValue.AsEnumerable();
+        }
+
+        private static IEnumerable<PnlCompare> ReadPnlCompare2(string Timestamp1, string Timestamp2, string Desk)
+        {
+            List<SqlParameter> parameters = new List<SqlParameter>();
+            DateTime dateValue = DateTime.MinValue;
             if (!string.IsNullOrEmpty(Timestamp1) && DateTime.TryParse(Timestamp1, out dateValue))
                 parameters.Add(new SqlParameter("@StartTimestamp", dateValue));
             dateValue = DateTime.MinValue;
@@ -956,35 +1483,28 @@ namespace Portal.Api.Helpers
                 parameters.Add(new SqlParameter("@EndTimestamp", dateValue));
             parameters.Add(new SqlParameter("@Desk", Desk));
 
-            IEnumerable<dynamic> reader = ExecuteStoredProcedureWithResultSet(
+            return ExecuteStoredProcedureWithResultSet<PnlCompare>(
                 Startup.HoloceneDatabaseConnectionString,
                 "core.GetPnlCompare2", parameters);
+        }
 
-            foreach (dynamic row in reader)
+        public static IEnumerable<PnlCompare> GetPnlCompare(string Timestamp1, string Timestamp2, string PnlType)
+        {
+            DateTime start, end;
+
+            if (UsePnlSnapshots && DateTime.TryParse(Timestamp1, out start) && DateTime.TryParse(Timestamp2, out end))
             {
-                var dash = new PnlCompare
-                {
-                    Timestamp1 = (row.Timestamp1 is System.DBNull ? null : row.Timestamp1),
-                    Timestamp2 = (row.Timestamp2 is System.DBNull ? null : row.Timestamp2),
-                    EntityType = row.EntityType,
-                    Entity = row.Entity,
-                    DTD1 = Convert.ToDecimal(row.DTD1),
-                    DTD2 = Convert.ToDecimal(row.DTD2),
-                    DeltaDTD = Convert.ToDecimal(row.DeltaDTD),
-                    Idio1 = Convert.ToDecimal(row.Idio1),
-                    Idio2 = Convert.ToDecimal(row.Idio2),
-                    DeltaIdio = Convert.ToDecimal(row.DeltaIdio)
-                };
-                ReturnValue.Add(dash);
+                return ComparePnlSnapshots("core.GetPnlCompare", "@PnlType", PnlType, start, end,
+                    () => ReadPnlCompare(Timestamp1, Timestamp2, PnlType).ToList()).AsEnumerable();
             }
 
+            List<PnlCompare> ReturnValue = ReadPnlCompare(Timestamp1, Timestamp2, PnlType).ToList();
+
             return ReturnValue.AsEnumerable();
         }
 
-        public static IEnumerable<PnlCompare> GetPnlCompare(string Timestamp1, string Timestamp2, string PnlType)
+        private static IEnumerable<PnlCompare> ReadPnlCompare(string Timestamp1, string Timestamp2, string PnlType)
         {
-            List<PnlCompare> ReturnValue = new List<PnlCompare>();
-
             List<SqlParameter> parameters = new List<SqlParameter>();
             DateTime dateValue = DateTime.MinValue;
             if (!string.IsNullOrEmpty(Timestamp1) && DateTime.TryParse(Timestamp1, out dateValue))
@@ -994,40 +1514,107 @@ namespace Portal.Api.Helpers
                 parameters.Add(new SqlParameter("@EndTimestamp", dateValue));
             parameters.Add(new SqlParameter("@PnlType", PnlType));
 
-            IEnumerable<dynamic> reader = ExecuteStoredProcedureWithResultSet(Startup.HoloceneDatabaseConnectionString, "core.GetPnlCompare", parameters);
+            return ExecuteStoredProcedureWithResultSet<PnlCompare>(Startup.HoloceneDatabaseConnectionString, "core.GetPnlCompare", parameters);
+        }
 
-            foreach (dynamic row in reader)
+        // The snapshot path relies on the procedure returning per-position levels in the *2 columns when both timestamps
+        // are equal. The first comparison per procedure is served from SQL and checked against the composed snapshots;
+        // only if they match row for row is the snapshot path used from then on, otherwise the procedure keeps serving.
+        private static List<PnlCompare> ComparePnlSnapshots(string StoredProcedure, string FilterName, string FilterValue,
+            DateTime Start, DateTime End, Func<List<PnlCompare>> Load)
+        {
+            List<PnlCompare> ReturnValue;
+            bool verified;
+
+            if (PnlSnapshotContracts.TryGetValue(StoredProcedure, out verified))
             {
-                var dash = new PnlCompare
+                if (!verified)
                 {
-                    Timestamp1 = (row.Timestamp1 is System.DBNull ? null : row.Timestamp1),
-                    Timestamp2 = (row.Timestamp2 is System.DBNull ? null : row.Timestamp2),
-                    Desk = row.Desk,
-                    Sector = row.Sector,
-                    PositionBlock = row.PositionBlock,
-                    Symbol = row.Symbol,
-                    UnderlyingSymbol = row.UnderlyingSymbol,
-                    DTD1 = row.DTD1,
-                    MTD1 = row.MTD1,
-                    YTD1 = row.YTD1,
-                    DTD2 = row.DTD2,
-                    MTD2 = row.MTD2,
-                    YTD2 = row.YTD2,
-                    DeltaDTD = row.DeltaDTD,
-                    DeltaMTD = row.DeltaMTD,
-                    DeltaYTD = row.DeltaYTD,
-                    IsDelta = row.IsDelta
-                };
-                ReturnValue.Add(dash);
+                    return Load();
+                }
+
+                try
+                {
+                    return PnlSnapshot.Compare(
+                        GetPnlSnapshot(StoredProcedure, FilterName, FilterValue, Start),
+                        GetPnlSnapshot(StoredProcedure, FilterName, FilterValue, End));
+                }
+                catch (InvalidDataException ex)
+                {
+                    Logger.Warn(ex, $"{StoredProcedure} snapshots disabled");
+                    PnlSnapshotContracts[StoredProcedure] = false;
+
+                    return Load();
+                }
             }
 
-            return ReturnValue.AsEnumerable();
+            ReturnValue = Load();
+
+            try
+            {
+                verified = PnlSnapshot.SameRows(ReturnValue, PnlSnapshot.Compare(
+                    GetPnlSnapshot(StoredProcedure, FilterName, FilterValue, Start),
+                    GetPnlSnapshot(StoredProcedure, FilterName, FilterValue, End)));
+
+                if (!verified)
+                {
+                    Logger.Warn($"{StoredProcedure} snapshots do not reproduce the procedure's comparison; snapshots disabled");
+                }
+            }
+            catch (InvalidDataException ex)
+            {
+                Logger.Warn(ex, $"{StoredProcedure} snapshots disabled");
+                verified = false;
+            }
+
+            PnlSnapshotContracts.TryAdd(StoredProcedure, verified);
+
+            return ReturnValue;
+        }
+
+        public static PnlSnapshot GetPnlSnapshot(string StoredProcedure, string FilterName, string FilterValue, DateTime PortfolioTimestamp)
+        {
+            DateTime? latest = GetIntradayStore().LastTimestamp;
+            TimeSpan ttl = latest == null || PortfolioTimestamp >= latest.Value ? IntradayPollInterval : PnlSnapshotTtl;
+
+            return PnlSnapshots.GetOrAdd($"{StoredProcedure}|{FilterValue}|{PortfolioTimestamp:o}", ttl,
+                () => LoadPnlSnapshot(StoredProcedure, FilterName, FilterValue, PortfolioTimestamp), x => x.Count);
+        }
+
+        private static PnlSnapshot LoadPnlSnapshot(string StoredProcedure, string FilterName, string FilterValue, DateTime PortfolioTimestamp)
+        {
+            List<SqlParameter> parameters = new List<SqlParameter>
+            {
+                new SqlParameter("@StartTimestamp", PortfolioTimestamp),
+                new SqlParameter("@EndTimestamp", PortfolioTimestamp),
+                new SqlParameter(FilterName, FilterValue)
+            };
+
+            return new PnlSnapshot(PortfolioTimestamp,
+                ExecuteStoredProcedureWithResultSet<PnlCompare>(Startup.HoloceneDatabaseConnectionString, StoredProcedure, parameters).ToList());
+        }
+
+        public static ColumnarResult GetPnlCompareColumnar(string Timestamp1, string Timestamp2, string PnlType)
+        {
+            return ColumnarResult.From(UsePnlSnapshots
+                ? GetPnlCompare(Timestamp1, Timestamp2, PnlType)
+                : ReadPnlCompare(Timestamp1, Timestamp2, PnlType));
+        }
+
+        public static ColumnarResult GetPositionTimeSeriesColumnar(string Symbol, string Desk, string Sector, string PositionBlock, string Side)
+        {
+            return ColumnarResult.From(ReadPositionTimeSeries(Symbol, Desk, Sector, PositionBlock, Side));
         }
 
         public static IEnumerable<Position> GetPositionTimeSeries(string Symbol,string Desk,string Sector,string PositionBlock,string Side)
         {
-            List<Position> ReturnValue = new List<Position>();
+            List<Position> ReturnValue = ReadPositionTimeSeries(Symbol, Desk, Sector, PositionBlock, Side).ToList();
+
+            return ReturnValue.AsEnumerable();
+        }
 
+        private static IEnumerable<Position> ReadPositionTimeSeries(string Symbol, string Desk, string Sector, string PositionBlock, string Side)
+        {
             List<SqlParameter> parameters = new List<SqlParameter>();
             if (!string.IsNullOrEmpty(Symbol))
                 parameters.Add(new SqlParameter("@Symbol", Symbol));
@@ -1059,23 +1646,93 @@ namespace Portal.Api.Helpers
                     MTD = row.MTD,
                     YTD = row.YTD
                 };
-                ReturnValue.Add(dash);
+                yield return dash;
             }
-
-            return ReturnValue.AsEnumerable();
         }
 
+        private static readonly TimeSpan IntradayPollInterval = TimeSpan.FromSeconds(10);
+
+        public static readonly IntradayTimeSeriesStore IntradayStore = new IntradayTimeSeriesStore();
+
+        private static readonly object IntradayPollLock = new object();
+        private static DateTime IntradayPolledAt;
+        private static SqlDbType? IntradayTimestampType;
+
         public static IEnumerable<Position> GetIntradayPositionTimeSeries(string Symbol)
         {
-            List<Position> ReturnValue = new List<Position>();
+            return GetIntradayStore().GetSeries(Symbol).AsEnumerable();
+        }
 
-            List<SqlParameter> parameters = new List<SqlParameter>();
-            if (!string.IsNullOrEmpty(Symbol))
-                parameters.Add(new SqlParameter("@Symbol", Symbol));
+        public static IEnumerable<Position> GetIntradayDeskRollup(string Desk = null)
+        {
+            return GetIntradayStore().GetDeskRollup(Desk).AsEnumerable();
+        }
 
-            IEnumerable<dynamic> reader = DatabaseHelper
-                .ExecuteStoredProcedureWithResultSet(Startup.HoloceneDatabaseConnectionString,
-                "core.GetIntradayPositionTimeSeries", parameters);
+        private static IntradayTimeSeriesStore GetIntradayStore()
+        {
+            if (DateTime.UtcNow - IntradayPolledAt < IntradayPollInterval)
+            {
+                return IntradayStore;
+            }
+
+            bool wait = !IntradayStore.LastTimestamp.HasValue;
+            bool locked = false;
+
+            try
+            {
+                if (wait)
+                {
+                    Monitor.Enter(IntradayPollLock, ref locked);
+                }
+                else
+                {
+                    Monitor.TryEnter(IntradayPollLock, ref locked);
+                }
+
+                if (locked && DateTime.UtcNow - IntradayPolledAt >= IntradayPollInterval)
+                {
+                    PollIntradayPositions();
+                    IntradayPolledAt = DateTime.UtcNow;
+                }
+            }
+            catch (Exception ex) when (!wait)
+            {
+                IntradayPolledAt = DateTime.UtcNow;
+                Logger.Error(ex);
+            }
+            finally
+            {
+                if (locked)
+                {
+                    Monitor.Exit(IntradayPollLock);
+                }
+            }
+
+            return IntradayStore;
+        }
+
+        private static void PollIntradayPositions()
+        {
+            List<Position> rows = new List<Position>();
+            DateTime? since = IntradayStore.LastTimestamp;
+
+            List<SqlParameter> parameters = null;
+
+            // The first poll reads only the latest day; later polls re-read from the last snapshot so a partially
+            // written one is replaced.
+            string RawSql = "select PortfolioTimestamp,Desk,Symbol,DTD,IdioPnl from core.IntradayPositionTimeSeries (nolock) where PortfolioTimestamp >= " +
+                (since.HasValue ? "@Since" : "(select cast(max(PortfolioTimestamp) as date) from core.IntradayPositionTimeSeries (nolock))") +
+                " order by PortfolioTimestamp";
+
+            if (since.HasValue)
+            {
+                // Bound with the column's own type, so a datetime value read back into .NET compares equal to itself.
+                parameters = new List<SqlParameter>() {
+                    new SqlParameter() {ParameterName = "@Since", SqlDbType = GetIntradayTimestampType(), Value = since.Value }};
+            }
+
+            IEnumerable<dynamic> reader = ExecuteInlineQueryWithResultSet(Startup.HoloceneDatabaseConnectionString, RawSql,
+                SqlParams: parameters);
 
             foreach (dynamic row in reader)
             {
@@ -1084,13 +1741,41 @@ namespace Portal.Api.Helpers
                     PortfolioTimestamp = row.PortfolioTimestamp,
                     Desk = row.Desk,
                     Symbol = row.Symbol,
-                    DTD = Convert.ToDecimal(row.DTD),
-                    IdioPnl = Convert.ToDecimal(row.IdioPnl)
+                    DTD = row.DTD is System.DBNull ? 0m : Convert.ToDecimal(row.DTD),
+                    IdioPnl = row.IdioPnl is System.DBNull ? 0m : Convert.ToDecimal(row.IdioPnl)
                 };
-                ReturnValue.Add(dash);
+                rows.Add(dash);
             }
 
-            return ReturnValue.AsEnumerable();
+            IntradayStore.Ingest(rows);
+        }
+
+        private static SqlDbType GetIntradayTimestampType()
+        {
+            if (!IntradayTimestampType.HasValue)
+            {
+                object type = ExecuteInlineQueryWithReturnValue(Startup.HoloceneDatabaseConnectionString,
+                    "select DATA_TYPE from INFORMATION_SCHEMA.COLUMNS where TABLE_SCHEMA = 'core'" +
+                    " and TABLE_NAME = 'IntradayPositionTimeSeries' and COLUMN_NAME = 'PortfolioTimestamp'", ReadOnly: true);
+
+                switch (type as string)
+                {
+                    case "datetime":
+                        IntradayTimestampType = SqlDbType.DateTime;
+                        break;
+                    case "smalldatetime":
+                        IntradayTimestampType = SqlDbType.SmallDateTime;
+                        break;
+                    case "datetimeoffset":
+                        IntradayTimestampType = SqlDbType.DateTimeOffset;
+                        break;
+                    default:
+                        IntradayTimestampType = SqlDbType.DateTime2;
+                        break;
+                }
+            }
+
+            return IntradayTimestampType.Value;
         }
 
         public static IEnumerable<string> GetEntitiesByEntityType(string EntityType)
@@ -1187,6 +1872,14 @@ namespace Portal.Api.Helpers
         }
 
         public static IEnumerable<PortfolioConstructionDashboard> GetPortfolioConstructionDashboard(string Username)
+        {
+            List<PortfolioConstructionDashboard> snapshot = ReferenceData.GetOrAdd("research.GetPortfolioConstructionDashboard", DashboardSnapshotTtl,
+                () => LoadPortfolioConstructionDashboard());
+
+            return FilterDashboard(snapshot, Username, x => (object)x.AnalystId).AsEnumerable();
+        }
+
+        private static List<PortfolioConstructionDashboard> LoadPortfolioConstructionDashboard()
         {
             List<PortfolioConstructionDashboard> ReturnValue = new List<PortfolioConstructionDashboard>();
 
@@ -1236,10 +1929,18 @@ namespace Portal.Api.Helpers
                 ReturnValue.Add(dash);
             }
 
-            return ReturnValue.AsEnumerable();
+            return ReturnValue;
         }
 
         public static IEnumerable<PivotDashboard> GetPivotDashboard(string Username)
+        {
+            List<PivotDashboard> snapshot = ReferenceData.GetOrAdd("core.GetPivotDashboard", DashboardSnapshotTtl,
+                () => LoadPivotDashboard());
+
+            return FilterDashboard<PivotDashboard>(snapshot, Username, null).AsEnumerable();
+        }
+
+        private static List<PivotDashboard> LoadPivotDashboard()
         {
             List<PivotDashboard> ReturnValue = new List<PivotDashboard>();
 
@@ -1270,7 +1971,7 @@ namespace Portal.Api.Helpers
                 ReturnValue.Add(dash);
             }
 
-            return ReturnValue.AsEnumerable();
+            return ReturnValue;
         }
 
         public static IEnumerable<PerformanceDashboardSummary> GetPerformanceDashboardSummary(string EntityType, string Entity)
@@ -1397,7 +2098,17 @@ namespace Portal.Api.Helpers
             return ReturnValue.AsEnumerable();
         }
 
+        public static TimeSpan SingleFlightReuseWindow { get; set; } = TimeSpan.Zero;
+
+        public static readonly SingleFlight Coalescer = new SingleFlight();
+
         public static IEnumerable<PerformanceDashboardIntraday> GetPerformanceDashboardSummaryIntraday()
+        {
+            return new List<PerformanceDashboardIntraday>(Coalescer.Run("risk.GetPerformanceDashboardSluggingRatioIntraday",
+                SingleFlightReuseWindow, LoadPerformanceDashboardSummaryIntraday)).AsEnumerable();
+        }
+
+        private static List<PerformanceDashboardIntraday> LoadPerformanceDashboardSummaryIntraday()
         {
             List<PerformanceDashboardIntraday> ReturnValue = new List<PerformanceDashboardIntraday>();
 
@@ -1441,17 +2152,25 @@ namespace Portal.Api.Helpers
                 ReturnValue.Add(dash);
             }
 
-            return ReturnValue.AsEnumerable();
+            return ReturnValue;
         }
 
         public static IEnumerable<PerformanceDashboardIntradayTopPosition> 
             GetPerformanceDashboardSummaryIntradayTopPositions(string EntityType, string Entity)
         {
-            List<PerformanceDashboardIntradayTopPosition> ReturnValue = new List<PerformanceDashboardIntradayTopPosition>();
-
             List<SqlParameter> parameters = new List<SqlParameter>();
             parameters.Add(new SqlParameter("@EntityType", EntityType));
             parameters.Add(new SqlParameter("@Entity", Entity));
+
+            return new List<PerformanceDashboardIntradayTopPosition>(Coalescer.Run(
+                SingleFlight.Key("risk.GetPerformanceDashboardTopPositionsIntraday", parameters),
+                SingleFlightReuseWindow, () => LoadPerformanceDashboardSummaryIntradayTopPositions(parameters))).AsEnumerable();
+        }
+
+        private static List<PerformanceDashboardIntradayTopPosition> LoadPerformanceDashboardSummaryIntradayTopPositions(List<SqlParameter> parameters)
+        {
+            List<PerformanceDashboardIntradayTopPosition> ReturnValue = new List<PerformanceDashboardIntradayTopPosition>();
+
             IEnumerable<dynamic> reader = ExecuteStoredProcedureWithResultSet(
                 Startup.HoloceneDatabaseConnectionString,
                 "risk.GetPerformanceDashboardTopPositionsIntraday", parameters);
@@ -1471,46 +2190,176 @@ namespace Portal.Api.Helpers
                 ReturnValue.Add(dash);
             }
 
-            return ReturnValue.AsEnumerable();
+            return ReturnValue;
         }
 
-        public static IEnumerable<PerformanceDashboard> GetPerformanceDashboard()
+        private static readonly TimeSpan IntradayFeedIdleTimeout = TimeSpan.FromMinutes(1);
+
+        public static readonly ChangeFeed<PerformanceDashboardIntraday> IntradaySummaryFeed = new ChangeFeed<PerformanceDashboardIntraday>(
+            x => x.PnlType + "|" + x.EntityType + "|" + x.Entity + "|" + x.PortfolioTimestamp, 20000, StartIntradayFeed);
+
+        private static readonly ConcurrentDictionary<string, ChangeFeed<PerformanceDashboardIntradayTopPosition>> IntradayTopPositionFeeds =
+            new ConcurrentDictionary<string, ChangeFeed<PerformanceDashboardIntradayTopPosition>>();
+
+        private static int IntradayFeedRunning;
+
+        public static IAsyncEnumerable<SnapshotDelta<PerformanceDashboardIntraday>> SubscribePerformanceDashboardSummaryIntraday(
+            string Epoch = null, long SinceVersion = 0, CancellationToken cancellationToken = default)
         {
-            List<PerformanceDashboard> ReturnValue = new List<PerformanceDashboard>();
+            return IntradaySummaryFeed.Subscribe(Epoch, SinceVersion, cancellationToken);
+        }
 
-            IEnumerable<dynamic> reader = ExecuteStoredProcedureWithResultSet(
-                    Startup.HoloceneDatabaseConnectionString,
-                    "risk.GetPerformanceDashboard", null);
+        public static async IAsyncEnumerable<SnapshotDelta<PerformanceDashboardIntradayTopPosition>> SubscribePerformanceDashboardSummaryIntradayTopPositions(
+            string EntityType, string Entity, string Epoch = null, long SinceVersion = 0,
+            [EnumeratorCancellation] CancellationToken cancellationToken = default)
+        {
+            string key = EntityType + "|" + Entity;
 
-            foreach (dynamic row in reader)
+            while (!cancellationToken.IsCancellationRequested)
             {
-                var dash = new PerformanceDashboard
+                var feed = IntradayTopPositionFeeds.GetOrAdd(key,
+                    k => new ChangeFeed<PerformanceDashboardIntradayTopPosition>(
+                        x => x.PnlType + "|" + x.MetricType + "|" + x.Symbol + "|" + x.PortfolioTimestamp, 20000, StartIntradayFeed));
+
+                await foreach (var delta in feed.Subscribe(Epoch, SinceVersion, cancellationToken))
                 {
-                    BusDate = row.BusDate,
-                    Desk = row.Desk,
-                    Sector = row.Sector,
-                    PositionBlock = row.PositionBlock,
-                    Side = row.Side,
-                    Analyst = row.Analyst,
-                    FactorGroup = row.FactorGroup,
-                    Factor = row.Factor,
-                    FullBloombergCode = row.FullBloombergCode,
-                    Pnl = Convert.ToDecimal(row.Pnl),
-                    DisplayOrder = row.DisplayOrder
-                };
-                ReturnValue.Add(dash);
-            }
+                    yield return delta;
+                }
 
-            return ReturnValue.AsEnumerable();
+                RemoveIntradayFeed(key, feed);
+            }
         }
 
-        public static IEnumerable<EntityCollection> GetEntities()
+        private static void PruneIntradayFeeds(TimeSpan IdleTimeout)
         {
-            List<EntityCollection> ReturnValue = new List<EntityCollection>();
-
-            IEnumerable<dynamic> reader = ExecuteStoredProcedureWithResultSet(Startup.HoloceneDatabaseConnectionString, "core.GetEntities", null);
-
-            foreach (dynamic row in reader)
+            foreach (var pair in IntradayTopPositionFeeds)
+            {
+                if (pair.Value.TryRetire(IdleTimeout))
+                {
+                    RemoveIntradayFeed(pair.Key, pair.Value);
+                }
+            }
+        }
+
+        private static void RemoveIntradayFeed(string Key, ChangeFeed<PerformanceDashboardIntradayTopPosition> Feed)
+        {
+            ((ICollection<KeyValuePair<string, ChangeFeed<PerformanceDashboardIntradayTopPosition>>>)IntradayTopPositionFeeds)
+                .Remove(new KeyValuePair<string, ChangeFeed<PerformanceDashboardIntradayTopPosition>>(Key, Feed));
+        }
+
+        private static bool HasIntradaySubscribers()
+        {
+            return IntradaySummaryFeed.SubscriberCount > 0 || IntradayTopPositionFeeds.Values.Any(x => x.SubscriberCount > 0);
+        }
+
+        private static void StartIntradayFeed()
+        {
+            if (Interlocked.CompareExchange(ref IntradayFeedRunning, 1, 0) == 0)
+            {
+                Task.Run(RunIntradayFeed);
+            }
+        }
+
+        private static async Task RunIntradayFeed()
+        {
+            try
+            {
+                while (HasIntradaySubscribers())
+                {
+                    try
+                    {
+                        PublishIntradayFeeds();
+                    }
+                    catch (Exception ex)
+                    {
+                        Logger.Error(ex);
+                    }
+
+                    await Task.Delay(IntradayPollInterval);
+                }
+            }
+            finally
+            {
+                PruneIntradayFeeds(TimeSpan.Zero);
+                Interlocked.Exchange(ref IntradayFeedRunning, 0);
+            }
+
+            if (HasIntradaySubscribers())
+            {
+                StartIntradayFeed();
+            }
+        }
+
+        private static void PublishIntradayFeeds()
+        {
+            PruneIntradayFeeds(IntradayFeedIdleTimeout);
+
+            DateTime? timestamp = GetIntradayStore().LastTimestamp;
+            string token = timestamp.HasValue ? timestamp.Value.ToString("o", CultureInfo.InvariantCulture) : string.Empty;
+
+            if (IntradaySummaryFeed.SubscriberCount > 0 && IntradaySummaryFeed.SourceToken != token)
+            {
+                IntradaySummaryFeed.Publish(LoadPerformanceDashboardSummaryIntraday(), token);
+            }
+
+            foreach (var pair in IntradayTopPositionFeeds)
+            {
+                if (pair.Value.SubscriberCount > 0 && pair.Value.SourceToken != token)
+                {
+                    string[] entity = pair.Key.Split(new[] { '|' }, 2);
+
+                    List<SqlParameter> parameters = new List<SqlParameter>();
+                    parameters.Add(new SqlParameter("@EntityType", entity[0]));
+                    parameters.Add(new SqlParameter("@Entity", entity[1]));
+
+                    pair.Value.Publish(LoadPerformanceDashboardSummaryIntradayTopPositions(parameters), token);
+                }
+            }
+        }
+
+        public static IEnumerable<PerformanceDashboard> GetPerformanceDashboard()
+        {
+            return new List<PerformanceDashboard>(Coalescer.Run("risk.GetPerformanceDashboard",
+                SingleFlightReuseWindow, LoadPerformanceDashboard)).AsEnumerable();
+        }
+
+        private static List<PerformanceDashboard> LoadPerformanceDashboard()
+        {
+            List<PerformanceDashboard> ReturnValue = new List<PerformanceDashboard>();
+
+            IEnumerable<dynamic> reader = ExecuteStoredProcedureWithResultSet(
+                    Startup.HoloceneDatabaseConnectionString,
+                    "risk.GetPerformanceDashboard", null);
+
+            foreach (dynamic row in reader)
+            {
+                var dash = new PerformanceDashboard
+                {
+                    BusDate = row.BusDate,
+                    Desk = row.Desk,
+                    Sector = row.Sector,
+                    PositionBlock = row.PositionBlock,
+                    Side = row.Side,
+                    Analyst = row.Analyst,
+                    FactorGroup = row.FactorGroup,
+                    Factor = row.Factor,
+                    FullBloombergCode = row.FullBloombergCode,
+                    Pnl = Convert.ToDecimal(row.Pnl),
+                    DisplayOrder = row.DisplayOrder
+                };
+                ReturnValue.Add(dash);
+            }
+
+            return ReturnValue;
+        }
+
+        public static IEnumerable<EntityCollection> GetEntities()
+        {
+            List<EntityCollection> ReturnValue = new List<EntityCollection>();
+
+            IEnumerable<dynamic> reader = ExecuteStoredProcedureWithResultSet(Startup.HoloceneDatabaseConnectionString, "core.GetEntities", null);
+
+            foreach (dynamic row in reader)
             {
                 var dash = new EntityCollection
                 {
@@ -1562,18 +2411,7 @@ namespace Portal.Api.Helpers
 
         public static List<DateTime> GetIntradayTimestamps()
         {
-            List<DateTime> ReturnValue = new List<DateTime>();
-
-            IEnumerable<dynamic> reader = 
-                    ExecuteInlineQueryWithResultSet(Startup.HoloceneDatabaseConnectionString,
-                    "select distinct PortfolioTimestamp from core.IntradayPositionTimeSeries (nolock) order by 1");
-
-            foreach (dynamic row in reader)
-            {
-                ReturnValue.Add(row.PortfolioTimestamp);
-            }
-
-            return ReturnValue;
+            return GetIntradayStore().GetTimestamps();
         }
 
         public static IEnumerable<PnlAttribution> GetPnlAttribution(string Symbol)
@@ -1693,55 +2531,203 @@ namespace Portal.Api.Helpers
             return ReturnValue.AsEnumerable();
         }
 
+        private const string HoldingsColumns = "BusinessDate,SecurityCode,FundDescription,LegalEntityDescription,LocationAccountDescription," +
+            "CustodianDescription,HoldingDirection,QuantityStart,QuantityEnd,StartPriceBook,StartPriceLocal,EndPriceBook,EndPriceLocal," +
+            "StartDirectFxRate,EndDirectFxRate,MktValBookStart,MktValBook,MktValLocalStart,MktValLocal,DtdPnlTotal,MtdPnlTotal,YtdPnlTotal," +
+            "NetExposureStart,NetExposure,GrossExposureStart,GrossExposure,LongExposureStart,LongExposure,ShortExposureStart,ShortExposure";
+
+        private const int HoldingsDays = 30;
+        private static readonly TimeSpan HoldingsCloseDelay = TimeSpan.FromHours(8);
+
+        private static readonly TimeSpan HoldingsEmptyRecheck = TimeSpan.FromMinutes(15);
+
+        private static readonly ConcurrentDictionary<DateTime, List<Holding>> HoldingsPartitions = new ConcurrentDictionary<DateTime, List<Holding>>();
+        private static readonly ConcurrentDictionary<DateTime, DateTime> HoldingsEmptyDates = new ConcurrentDictionary<DateTime, DateTime>();
+        private static readonly object HoldingsLock = new object();
+
+        private static Holding ToHolding(dynamic row)
+        {
+            return ToHolding(row, ((DateTime)row.BusinessDate).ToString("yyyy/MM/dd"));
+        }
+
+        private static Holding ToHolding(dynamic row, string BusDate)
+        {
+            var holding = new Holding
+            {
+                BusDate = BusDate,
+                SecurityCode = row.SecurityCode,
+                FundDescription = row.FundDescription,
+                LegalEntityDescription = row.LegalEntityDescription,
+                LocationAccountDescription = row.LocationAccountDescription,
+                CustodianDescription = row.CustodianDescription,
+                Side = row.HoldingDirection,
+                QuantityStart = row.QuantityStart,
+                QuantityEnd = row.QuantityEnd,
+                StartPriceBook = row.StartPriceBook,
+                StartPriceLocal = row.StartPriceLocal,
+                EndPriceBook = row.EndPriceBook,
+                EndPriceLocal = row.EndPriceLocal,
+                StartDirectFxRate = row.StartDirectFxRate,
+                EndDirectFxRate = row.EndDirectFxRate,
+                MktValBookStart = row.MktValBookStart,
+                MktValBook = row.MktValBook,
+                MktValLocalStart = row.MktValLocalStart,
+                MktValLocal = row.MktValLocal,
+                DtdPnlTotal = row.DtdPnlTotal,
+                MtdPnlTotal = row.MtdPnlTotal,
+                YtdPnlTotal = row.YtdPnlTotal,
+                NetExposureStart = row.NetExposureStart,
+                NetExposure = row.NetExposure,
+                GrossExposureStart = row.GrossExposureStart,
+                GrossExposure = row.GrossExposure,
+                LongExposureStart = row.LongExposureStart,
+                LongExposure = row.LongExposure,
+                ShortExposureStart = row.ShortExposureStart,
+                ShortExposure = row.ShortExposure
+            };
+
+            return holding;
+        }
+
         public static IEnumerable<Holding> GetHoldings()
         {
             List<Holding> ReturnValue = new List<Holding>();
 
-            string Query = "select * from Holocene.Holdings (nolock) where BusinessDate between dateadd(dd, -30, convert(date,getdate())) and convert(date,getdate())";
+            DateTime today = DateTime.Today;
+            DateTime from = today.AddDays(-HoldingsDays);
+            DateTime open = (DateTime.Now - HoldingsCloseDelay).Date;
+            List<Holding> partition;
+            DateTime checkedAt;
 
-            IEnumerable<dynamic> reader = ExecuteInlineQueryWithResultSet(Startup.MIKDatabaseConnectionString, Query);
+            foreach (DateTime date in HoldingsPartitions.Keys)
+            {
+                if (date < from)
+                {
+                    HoldingsPartitions.TryRemove(date, out partition);
+                }
+            }
 
-            foreach (dynamic row in reader)
+            foreach (DateTime date in HoldingsEmptyDates.Keys)
             {
-                var holding = new Holding
+                if (date < from)
                 {
-                    BusDate = row.BusinessDate.ToString("yyyy/MM/dd"),
-                    SecurityCode = row.SecurityCode,
-                    FundDescription = row.FundDescription,
-                    LegalEntityDescription = row.LegalEntityDescription,
-                    LocationAccountDescription = row.LocationAccountDescription,
-                    CustodianDescription = row.CustodianDescription,
-                    Side = row.HoldingDirection,
-                    QuantityStart = row.QuantityStart,
-                    QuantityEnd = row.QuantityEnd,
-                    StartPriceBook = row.StartPriceBook,
-                    StartPriceLocal = row.StartPriceLocal,
-                    EndPriceBook = row.EndPriceBook,
-                    EndPriceLocal = row.EndPriceLocal,
-                    StartDirectFxRate = row.StartDirectFxRate,
-                    EndDirectFxRate = row.EndDirectFxRate,
-                    MktValBookStart = row.MktValBookStart,
-                    MktValBook = row.MktValBook,
-                    MktValLocalStart = row.MktValLocalStart,
-                    MktValLocal = row.MktValLocal,
-                    DtdPnlTotal = row.DtdPnlTotal,
-                    MtdPnlTotal = row.MtdPnlTotal,
-                    YtdPnlTotal = row.YtdPnlTotal,
-                    NetExposureStart = row.NetExposureStart,
-                    NetExposure = row.NetExposure,
-                    GrossExposureStart = row.GrossExposureStart,
-                    GrossExposure = row.GrossExposure,
-                    LongExposureStart = row.LongExposureStart,
-                    LongExposure = row.LongExposure,
-                    ShortExposureStart = row.ShortExposureStart,
-                    ShortExposure = row.ShortExposure
-                };
-                ReturnValue.Add(holding);
+                    HoldingsEmptyDates.TryRemove(date, out checkedAt);
+                }
+            }
+
+            // Closed dates that came back empty (weekends, holidays, or a load that had not landed yet) are not
+            // cached; they are re-checked once HoldingsEmptyRecheck has passed so a late load is picked up.
+            Func<DateTime, bool> isMissing = x => !HoldingsPartitions.ContainsKey(x) &&
+                !(HoldingsEmptyDates.TryGetValue(x, out DateTime lastChecked) && DateTime.UtcNow - lastChecked < HoldingsEmptyRecheck);
+
+            if (Enumerable.Range(0, (open - from).Days).Any(i => isMissing(from.AddDays(i))))
+            {
+                lock (HoldingsLock)
+                {
+                    List<DateTime> missing = Enumerable.Range(0, (open - from).Days)
+                        .Select(i => from.AddDays(i))
+                        .Where(isMissing)
+                        .ToList();
+
+                    if (missing.Count > 0)
+                    {
+                        Dictionary<DateTime, List<Holding>> loaded = LoadHoldings(missing);
+                        DateTime loadedAt = DateTime.UtcNow;
+
+                        foreach (DateTime date in missing)
+                        {
+                            if (loaded.TryGetValue(date, out partition) && partition.Count > 0)
+                            {
+                                HoldingsPartitions[date] = partition;
+                                HoldingsEmptyDates.TryRemove(date, out checkedAt);
+                            }
+                            else
+                            {
+                                HoldingsEmptyDates[date] = loadedAt;
+                            }
+                        }
+                    }
+                }
+            }
+
+            for (DateTime date = from; date < open; date = date.AddDays(1))
+            {
+                if (HoldingsPartitions.TryGetValue(date, out partition))
+                {
+                    ReturnValue.AddRange(partition);
+                }
+            }
+
+            foreach (var pair in LoadHoldings(Enumerable.Range(0, (today - open).Days + 1).Select(i => open.AddDays(i))).OrderBy(x => x.Key))
+            {
+                ReturnValue.AddRange(pair.Value);
             }
 
             return ReturnValue.AsEnumerable();
         }
 
+        // Reads only the listed business dates, so re-checking a few empty dates never re-reads the cached ones between them.
+        private static Dictionary<DateTime, List<Holding>> LoadHoldings(IEnumerable<DateTime> Dates)
+        {
+            Dictionary<DateTime, List<Holding>> ReturnValue = new Dictionary<DateTime, List<Holding>>();
+
+            List<SqlParameter> parameters = Dates.Select(x => x.Date).Distinct()
+                .Select((x, i) => new SqlParameter() { ParameterName = "@Date" + i, SqlDbType = SqlDbType.Date, Value = x })
+                .ToList();
+
+            if (parameters.Count == 0)
+            {
+                return ReturnValue;
+            }
+
+            IEnumerable<dynamic> reader = ExecuteInlineQueryWithResultSet(Startup.MIKDatabaseConnectionString,
+                "select " + HoldingsColumns + " from Holocene.Holdings (nolock) where BusinessDate in (" +
+                string.Join(",", parameters.Select(x => x.ParameterName)) + ")",
+                SqlParams: parameters);
+
+            DateTime lastDate = DateTime.MinValue;
+            List<Holding> partition = null;
+            string busDate = null;
+
+            foreach (dynamic row in reader)
+            {
+                DateTime date = ((DateTime)row.BusinessDate).Date;
+
+                if (partition == null || date != lastDate)
+                {
+                    if (!ReturnValue.TryGetValue(date, out partition))
+                    {
+                        partition = new List<Holding>();
+                        ReturnValue.Add(date, partition);
+                    }
+
+                    lastDate = date;
+                    busDate = date.ToString("yyyy/MM/dd");
+                }
+
+                Holding holding = ToHolding(row, busDate);
+                partition.Add(holding);
+            }
+
+            return ReturnValue;
+        }
+
+        public static async IAsyncEnumerable<Holding> GetHoldingsAsync([EnumeratorCancellation] CancellationToken cancellationToken = default)
+        {
+            IEnumerable<Holding> holdings = await Task.Run(() => GetHoldings(), cancellationToken);
+
+            foreach (Holding holding in holdings)
+            {
+                cancellationToken.ThrowIfCancellationRequested();
+                yield return holding;
+            }
+        }
+
+        public static ColumnarResult GetHoldingsColumnar()
+        {
+            return ColumnarResult.From(GetHoldings());
+        }
+
         public static IEnumerable<Position> GetPositions(string Symbol, string Desk)
         {
             List<Position> ReturnValue = new List<Position>();
@@ -2015,7 +3001,24 @@ namespace Portal.Api.Helpers
         {
             int ReturnValue;
 
-            List<SqlParameter> parameters = new List<SqlParameter>() {
+            ReturnValue = ExecuteStoredProcedureWithReturnValue(Startup.HoloceneDatabaseConnectionString,
+                "app.UpsertUserCustomSetting", UserCustomSettingParameters(Username, FieldGroup, FieldName, FieldValue1, FieldValue2, FieldValue3)).Value;
+
+            return ReturnValue;
+        }
+
+        public static async Task<int> UpsertUserCustomSettingAsync(string Username, string FieldGroup, string FieldName, string FieldValue1,
+            string FieldValue2, string FieldValue3, CancellationToken cancellationToken = default)
+        {
+            return (int)await ExecuteScalarAsync(Startup.HoloceneDatabaseConnectionString, CommandType.StoredProcedure,
+                "app.UpsertUserCustomSetting", UserCustomSettingParameters(Username, FieldGroup, FieldName, FieldValue1, FieldValue2, FieldValue3),
+                cancellationToken: cancellationToken);
+        }
+
+        private static List<SqlParameter> UserCustomSettingParameters(string Username, string FieldGroup, string FieldName, string FieldValue1,
+            string FieldValue2, string FieldValue3)
+        {
+            return new List<SqlParameter>() {
                     new SqlParameter() {ParameterName = "@Username", SqlDbType = SqlDbType.NVarChar, Value = Username },
                     new SqlParameter() {ParameterName = "@FieldGroup", SqlDbType = SqlDbType.NVarChar, Value = FieldGroup },
                     new SqlParameter() {ParameterName = "@FieldName", SqlDbType = SqlDbType.NVarChar, Value = FieldName },
@@ -2023,11 +3026,6 @@ namespace Portal.Api.Helpers
                     new SqlParameter() { ParameterName = "@FieldValue2", SqlDbType = SqlDbType.NVarChar, Value = FieldValue2 },
                     new SqlParameter() { ParameterName = "@FieldValue3", SqlDbType = SqlDbType.NVarChar, Value = FieldValue3 }
                 };
-
-            ReturnValue = ExecuteStoredProcedureWithReturnValue(Startup.HoloceneDatabaseConnectionString,
-                "app.UpsertUserCustomSetting", parameters).Value;
-
-            return ReturnValue;
         }
 
         public static IEnumerable<AlphaReturn> GetAlphaReturns(string Desk)
@@ -2126,70 +3124,205 @@ namespace Portal.Api.Helpers
             return ReturnValue.AsEnumerable();
         }
 
-        private static IEnumerable<dynamic> PostgresExecuteStoredProcedureWithResultSet(string DatabaseConnectionString, string RawSql)
+        private static IEnumerable<dynamic> PostgresExecuteStoredProcedureWithResultSet(string DatabaseConnectionString, string RawSql,
+            DatabaseScope Scope = null, CancellationToken cancellationToken = default)
         {
-            using (var connection = new Npgsql.NpgsqlConnection(DatabaseConnectionString))
+            using (var timer = QueryStatistics.Start(QueryStatistics.Fingerprint(RawSql)))
+            using (var lease = OpenPostgresConnection(DatabaseConnectionString, Scope))
             {
-                connection.Open();
+                timer.Opened();
 
-                var command = new Npgsql.NpgsqlCommand(RawSql, connection);
+                var command = lease.CreateCommand(CommandType.Text, RawSql, false, cancellationToken);
 
-                using (var dataReader = command.ExecuteReader())
+                using (var dataReader = ExecuteReader(command))
                 {
-                    var fields = new List<String>();
-
-                    for (var i = 0; i < dataReader.FieldCount; i++)
+                    foreach (var item in ReadRows(dataReader, timer))
                     {
-                        fields.Add(dataReader.GetName(i));
+                        yield return item;
                     }
+                }
 
-                    while (dataReader.Read())
-                    {
-                        var item = new ExpandoObject() as IDictionary<String, Object>;
+                timer.Complete();
+            }
+        }
 
-                        for (var i = 0; i < fields.Count; i++)
-                        {
-                            item.Add(fields[i], dataReader[fields[i]]);
-                        }
+        private static IEnumerable<dynamic> PostgresExecuteStoredProcedureWithResultSet(string DatabaseConnectionString, string RawSql,
+            List<Npgsql.NpgsqlParameter> Parameters, DatabaseScope Scope = null, CancellationToken cancellationToken = default)
+        {
+            using (var timer = QueryStatistics.Start(QueryStatistics.Fingerprint(RawSql)))
+            using (var lease = OpenPostgresConnection(DatabaseConnectionString, Scope))
+            {
+                timer.Opened();
 
+                var command = lease.CreateCommand(CommandType.Text, RawSql, false, cancellationToken);
+                AddParameters(command, Parameters);
+
+                using (var dataReader = ExecuteReader(command, true))
+                {
+                    foreach (var item in ReadRows(dataReader, timer))
+                    {
                         yield return item;
                     }
                 }
+
+                timer.Complete();
             }
         }
 
-        private static object PostgresExecuteStoredProcedureWithReturnValue(string DatabaseConnectionString, string RawSql)
+        private static Npgsql.NpgsqlParameter PostgresParameter(string Name, NpgsqlTypes.NpgsqlDbType Type, object Value)
         {
-            object ReturnValue;
+            return new Npgsql.NpgsqlParameter(Name, Type) { Value = Value ?? DBNull.Value };
+        }
+
+        private static Npgsql.NpgsqlParameter PostgresListParameter(string Name, string List)
+        {
+            return PostgresParameter(Name, NpgsqlTypes.NpgsqlDbType.Array | NpgsqlTypes.NpgsqlDbType.Text, ParseSqlList(List));
+        }
+
+        internal static string[] ParseSqlList(string List)
+        {
+            List<string> ReturnValue = new List<string>();
+
+            if (string.IsNullOrWhiteSpace(List))
+            {
+                return ReturnValue.ToArray();
+            }
+
+            var item = new System.Text.StringBuilder();
+            bool quoted = false;
+
+            for (int i = 0; i < List.Length; i++)
+            {
+                char c = List[i];
+
+                if (c == '\'' && quoted && i + 1 < List.Length && List[i + 1] == '\'')
+                {
+                    item.Append(c);
+                    i++;
+                }
+                else if (c == '\'')
+                {
+                    quoted = !quoted;
+                }
+                else if (c == ',' && !quoted)
+                {
+                    ReturnValue.Add(item.ToString().Trim());
+                    item.Clear();
+                }
+                else
+                {
+                    item.Append(c);
+                }
+            }
+
+            ReturnValue.Add(item.ToString().Trim());
+
+            return ReturnValue.Where(x => x.Length > 0).ToArray();
+        }
+
+        private static async IAsyncEnumerable<dynamic> PostgresExecuteStoredProcedureWithResultSetAsync(string DatabaseConnectionString, string RawSql,
+            [EnumeratorCancellation] CancellationToken cancellationToken = default)
+        {
+            using (var timer = QueryStatistics.Start(QueryStatistics.Fingerprint(RawSql)))
             using (var connection = new Npgsql.NpgsqlConnection(DatabaseConnectionString))
             {
-                connection.Open();
+                await connection.OpenAsync(cancellationToken);
+                timer.Opened();
 
                 var command = new Npgsql.NpgsqlCommand(RawSql, connection);
+                command.CommandTimeout = QueryDeadline.CommandTimeout(command.CommandTimeout);
+
+                using (QueryDeadline.Register(command, cancellationToken))
+                using (var dataReader = await command.ExecuteReaderAsync(cancellationToken))
+                {
+                    await foreach (var item in ReadRowsAsync(dataReader, timer, cancellationToken))
+                    {
+                        yield return item;
+                    }
+                }
+
+                timer.Complete();
+            }
+        }
+
+        private static object PostgresExecuteStoredProcedureWithReturnValue(string DatabaseConnectionString, string RawSql,
+            DatabaseScope Scope = null, CancellationToken cancellationToken = default)
+        {
+            object ReturnValue;
+            using (var timer = QueryStatistics.Start(QueryStatistics.Fingerprint(RawSql)))
+            using (var lease = OpenPostgresConnection(DatabaseConnectionString, Scope))
+            {
+                timer.Opened();
+
+                var command = lease.CreateCommand(CommandType.Text, RawSql, false, cancellationToken);
                 ReturnValue = command.ExecuteScalar();
+                timer.Complete();
             }
 
             return ReturnValue;
         }
 
-        private static bool PostgresExecuteStoredProcedure(string DatabaseConnectionString, string RawSql)
+        private static bool PostgresExecuteStoredProcedure(string DatabaseConnectionString, string RawSql,
+            DatabaseScope Scope = null, CancellationToken cancellationToken = default)
         {
-            using (var connection = new Npgsql.NpgsqlConnection(DatabaseConnectionString))
+            using (var timer = QueryStatistics.Start(QueryStatistics.Fingerprint(RawSql)))
+            using (var lease = OpenPostgresConnection(DatabaseConnectionString, Scope))
             {
-                connection.Open();
+                timer.Opened();
 
-                var command = new Npgsql.NpgsqlCommand(RawSql, connection);
+                var command = lease.CreateCommand(CommandType.Text, RawSql, false, cancellationToken);
                 command.ExecuteNonQuery();
+                timer.Complete();
             }
 
             return true;
         }
 
-        public static IEnumerable<CoverageUniverse> GetCoverageUniverse(string Desk)
+        private static async Task<object> PostgresExecuteScalarAsync(string DatabaseConnectionString, string RawSql,
+            List<Npgsql.NpgsqlParameter> Parameters = null, DatabaseScope Scope = null, CancellationToken cancellationToken = default)
         {
-            List<CoverageUniverse> ReturnValue = new List<CoverageUniverse>();
+            object ReturnValue;
 
-            Desk = (string.IsNullOrEmpty(Desk) ? string.Empty : Desk);
+            using (var timer = QueryStatistics.Start(QueryStatistics.Fingerprint(RawSql)))
+            using (var lease = await OpenPostgresConnectionAsync(DatabaseConnectionString, Scope, cancellationToken))
+            {
+                timer.Opened();
+
+                var command = lease.CreateCommand(CommandType.Text, RawSql, false, cancellationToken);
+                AddParameters(command, Parameters);
+
+                ReturnValue = await command.ExecuteScalarAsync(cancellationToken);
+                timer.Complete();
+            }
+
+            return ReturnValue;
+        }
+
+        private static async Task<int> PostgresExecuteNonQueryAsync(string DatabaseConnectionString, string RawSql,
+            List<Npgsql.NpgsqlParameter> Parameters = null, DatabaseScope Scope = null, CancellationToken cancellationToken = default)
+        {
+            int ReturnValue;
+
+            using (var timer = QueryStatistics.Start(QueryStatistics.Fingerprint(RawSql)))
+            using (var lease = await OpenPostgresConnectionAsync(DatabaseConnectionString, Scope, cancellationToken))
+            {
+                timer.Opened();
+
+                var command = lease.CreateCommand(CommandType.Text, RawSql, false, cancellationToken);
+                AddParameters(command, Parameters);
+
+                ReturnValue = await command.ExecuteNonQueryAsync(cancellationToken);
+                timer.Complete();
+            }
+
+            return ReturnValue;
+        }
+
+        public static IEnumerable<CoverageUniverse> GetCoverageUniverse(string Desk)
+        {
+            List<CoverageUniverse> ReturnValue = new List<CoverageUniverse>();
+
+            Desk = (string.IsNullOrEmpty(Desk) ? string.Empty : Desk);
             List<SqlParameter> parameters = new List<SqlParameter>() {
                     new SqlParameter() {ParameterName = "@Desk", SqlDbType = SqlDbType.NVarChar, Value = Desk }};
 
@@ -2247,14 +3380,25 @@ namespace Portal.Api.Helpers
 
         public static int InsertTweet(string Username, DateTime Timestamp, string Tweet, string Hashtags)
         {
-            List<SqlParameter> parameters = new List<SqlParameter>() {
+            return ExecuteStoredProcedureWithReturnValue(Startup.HoloceneDatabaseConnectionString, "core.InsertTweet",
+                InsertTweetParameters(Username, Timestamp, Tweet, Hashtags)).Value;
+        }
+
+        public static async Task<int> InsertTweetAsync(string Username, DateTime Timestamp, string Tweet, string Hashtags,
+            CancellationToken cancellationToken = default)
+        {
+            return (int)await ExecuteScalarAsync(Startup.HoloceneDatabaseConnectionString, CommandType.StoredProcedure, "core.InsertTweet",
+                InsertTweetParameters(Username, Timestamp, Tweet, Hashtags), cancellationToken: cancellationToken);
+        }
+
+        private static List<SqlParameter> InsertTweetParameters(string Username, DateTime Timestamp, string Tweet, string Hashtags)
+        {
+            return new List<SqlParameter>() {
                     new SqlParameter() {ParameterName = "@Username", SqlDbType = SqlDbType.NVarChar, Value = Username },
                     new SqlParameter() {ParameterName = "@Tweet", SqlDbType = SqlDbType.NVarChar, Value = Tweet },
                     new SqlParameter() {ParameterName = "@Hashtags", SqlDbType = SqlDbType.NVarChar, Value = Hashtags },
                     new SqlParameter() { ParameterName = "@Timestamp", SqlDbType = SqlDbType.DateTime, Value = Timestamp }
                 };
-
-            return ExecuteStoredProcedureWithReturnValue(Startup.HoloceneDatabaseConnectionString, "core.InsertTweet", parameters).Value;
         }
 
         public static int UpsertTweet(int TweetId,
@@ -2283,10 +3427,11 @@ namespace Portal.Api.Helpers
             string RawSql = "select a.barraid,a.date,a.factor,coalesce(b.loading,a.loading) loading" +
                 " from qr.public.usmeds_asset_exp_last a left join public.usmeds_asset_exp_override b on" +
                 " (a.barraid = b.barraid and a.factor = b.factor and a.date between b.start_date and b.end_date)" +
-                " where a.barraid = '" + BarraId + "'";
+                " where a.barraid = @BarraId";
 
             var reader = PostgresExecuteStoredProcedureWithResultSet
-                (Startup.QRDatabaseConnectionString, RawSql);
+                (Startup.QRDatabaseConnectionString, RawSql, new List<Npgsql.NpgsqlParameter>() {
+                    PostgresParameter("BarraId", NpgsqlTypes.NpgsqlDbType.Text, BarraId) });
 
             foreach (dynamic row in reader)
             {
@@ -2303,17 +3448,19 @@ namespace Portal.Api.Helpers
 
             if (ReturnValue.Count() == 0)
             {
-                RawSql = $@"
+                RawSql = @"
                         select 
-                            barraid,'{DateTime.Now.ToString("MM/dd/yyyy")}' date,factor,loading
+                            barraid,@Today date,factor,loading
                         from 
                             qr.public.usmeds_asset_exp_override
                         where 
-                            barraid = '{BarraId}' and
-                            '{DateTime.Now.ToString("MM/dd/yyyy")}' between start_date and end_date";
+                            barraid = @BarraId and
+                            @Today between start_date and end_date";
 
                 var readerOverride = PostgresExecuteStoredProcedureWithResultSet
-                    (Startup.QRDatabaseConnectionString, RawSql);
+                    (Startup.QRDatabaseConnectionString, RawSql, new List<Npgsql.NpgsqlParameter>() {
+                        PostgresParameter("BarraId", NpgsqlTypes.NpgsqlDbType.Text, BarraId),
+                        PostgresParameter("Today", NpgsqlTypes.NpgsqlDbType.Date, DateTime.Today) });
 
                 foreach (dynamic row in readerOverride)
                 {
@@ -2339,11 +3486,12 @@ namespace Portal.Api.Helpers
             string RawSql = "select a.symbol,'' barraid,a.rpt_dt date,b.factor,b.loading" +
                     " from qr.crowding.secinfo a" +
                     " join qr.crowding.loadings b on (a.cusip = b.cusip and a.rpt_dt = b.rpt_dt)" +
-                    " where b.factor = 'OWNL' and a.symbol = '" + Symbol + "' and" +
-                    " a.rpt_dt = (select max(rpt_dt) from qr.crowding.secinfo where symbol = '" + Symbol + "')";
+                    " where b.factor = 'OWNL' and a.symbol = @Symbol and" +
+                    " a.rpt_dt = (select max(rpt_dt) from qr.crowding.secinfo where symbol = @Symbol)";
 
             var reader = PostgresExecuteStoredProcedureWithResultSet
-                (Startup.QRDatabaseConnectionString, RawSql);
+                (Startup.QRDatabaseConnectionString, RawSql, new List<Npgsql.NpgsqlParameter>() {
+                    PostgresParameter("Symbol", NpgsqlTypes.NpgsqlDbType.Text, Symbol) });
 
             foreach (dynamic row in reader)
             {
@@ -2363,16 +3511,52 @@ namespace Portal.Api.Helpers
         }
 
         public static IEnumerable<FactorLoading> GetFactorLoadingsHistory(string Factors, string BarraIds, DateTime StartDate)
+        {
+            string[] factors = ParseSqlList(Factors);
+            string[] barraIds = ParseSqlList(BarraIds);
+            BarraSnapshot snapshot = GetBarraSnapshot();
+
+            try
+            {
+                if (snapshot == null || !snapshot.Covers(StartDate))
+                {
+                    return FactorLoadingHistory.Get(FactorLoadingKeys(barraIds, factors), StartDate, LoadFactorLoadingsHistory).AsEnumerable();
+                }
+
+                string[] covered = barraIds.Where(snapshot.Contains).ToArray();
+
+                List<FactorLoading> ReturnValue = snapshot.GetFactorLoadingsHistory(factors, covered, StartDate);
+                ReturnValue.AddRange(FactorLoadingHistory.Get(FactorLoadingKeys(covered, factors), snapshot.LastDate.AddDays(1), LoadFactorLoadingsHistory));
+                ReturnValue.AddRange(FactorLoadingHistory.Get(FactorLoadingKeys(barraIds.Except(covered), factors), StartDate, LoadFactorLoadingsHistory));
+
+                return ReturnValue.AsEnumerable();
+            }
+            finally
+            {
+                snapshot?.Release();
+            }
+        }
+
+        private static IEnumerable<string> FactorLoadingKeys(IEnumerable<string> BarraIds, string[] Factors)
+        {
+            return BarraIds.SelectMany(barraId => Factors.Select(factor => barraId + "|" + factor));
+        }
+
+        private static List<FactorLoading> LoadFactorLoadingsHistory(string[] Keys, DateTime From, DateTime? Before)
         {
             List<FactorLoading> ReturnValue = new List<FactorLoading>();
 
             string RawSql = "select barraid,date,factor,loading from qr.public.usmeds_asset_exp where " +
-                    " date >= '" + StartDate.ToString("yyyy-MM-dd") + "' and" +
-                    " factor in (" + Factors + ") and" +
-                    " barraid in (" + BarraIds + ")";
+                    " date >= @From and date < coalesce(@Before,'infinity'::date) and" +
+                    " factor = ANY(@Factors) and" +
+                    " barraid = ANY(@BarraIds)";
 
             var reader = PostgresExecuteStoredProcedureWithResultSet
-                (Startup.QRDatabaseConnectionString, RawSql);
+                (Startup.QRDatabaseConnectionString, RawSql, new List<Npgsql.NpgsqlParameter>() {
+                    PostgresParameter("From", NpgsqlTypes.NpgsqlDbType.Date, From),
+                    PostgresParameter("Before", NpgsqlTypes.NpgsqlDbType.Date, Before),
+                    PostgresParameter("Factors", NpgsqlTypes.NpgsqlDbType.Array | NpgsqlTypes.NpgsqlDbType.Text, Keys.Select(x => x.Split('|')[1]).Distinct().ToArray()),
+                    PostgresParameter("BarraIds", NpgsqlTypes.NpgsqlDbType.Array | NpgsqlTypes.NpgsqlDbType.Text, Keys.Select(x => x.Split('|')[0]).Distinct().ToArray()) });
 
             foreach (dynamic row in reader)
             {
@@ -2387,18 +3571,42 @@ namespace Portal.Api.Helpers
                 ReturnValue.Add(loading);
             }
 
-            return ReturnValue.AsEnumerable();
-        }     
+            return ReturnValue;
+        }
 
         public static IEnumerable<FactorReturn> GetFactorReturnsHistory(DateTime StartDate)
+        {
+            BarraSnapshot snapshot = GetBarraSnapshot();
+
+            try
+            {
+                if (snapshot == null || !snapshot.Covers(StartDate))
+                {
+                    return FactorReturnHistory.Get(new[] { "usmeds_fac_ret" }, StartDate, LoadFactorReturnsHistory).AsEnumerable();
+                }
+
+                List<FactorReturn> ReturnValue = snapshot.GetFactorReturnsHistory(StartDate);
+                ReturnValue.AddRange(FactorReturnHistory.Get(new[] { "usmeds_fac_ret" }, snapshot.LastDate.AddDays(1), LoadFactorReturnsHistory));
+
+                return ReturnValue.AsEnumerable();
+            }
+            finally
+            {
+                snapshot?.Release();
+            }
+        }
+
+        private static List<FactorReturn> LoadFactorReturnsHistory(string[] Keys, DateTime From, DateTime? Before)
         {
             List<FactorReturn> ReturnValue = new List<FactorReturn>();
 
             string RawSql = "select factor,dlyreturn,date from qr.public.usmeds_fac_ret" +
-                    " where date >= '" + StartDate.ToString("yyyy-MM-dd") + "'";
+                    " where date >= @From and date < coalesce(@Before,'infinity'::date)";
 
             var reader = PostgresExecuteStoredProcedureWithResultSet
-                (Startup.QRDatabaseConnectionString, RawSql);
+                (Startup.QRDatabaseConnectionString, RawSql, new List<Npgsql.NpgsqlParameter>() {
+                    PostgresParameter("From", NpgsqlTypes.NpgsqlDbType.Date, From),
+                    PostgresParameter("Before", NpgsqlTypes.NpgsqlDbType.Date, Before) });
 
             foreach (dynamic row in reader)
             {
@@ -2412,242 +3620,602 @@ namespace Portal.Api.Helpers
                 ReturnValue.Add(facReturn);
             }
 
-            return ReturnValue.AsEnumerable();
+            return ReturnValue;
         }
 
-        public static IEnumerable<RiskReturn> GetFactorGroupReturnsHistory(DateTime StartDate, string BarraIds, string Factors)
-        {
-            List<RiskReturn> ReturnValue = new List<RiskReturn>();
+        private const int MaxSecuritiesPerQuery = 250;
 
-            string RawSql = $@"
-                    select 
-                        a.barraid,a.date,coalesce(sum(coalesce(c.loading,a.loading) * b.dlyreturn),0) totalreturn 
+        private const string FactorGroupReturnsSql = @"
+                    select a.barraid,a.date,coalesce(sum(coalesce(c.loading,a.loading) * b.dlyreturn),0) totalreturn,0 src
                     from 
                         qr.public.usmeds_asset_exp a
                         left join public.usmeds_asset_exp_override c on (a.barraid = c.barraid and a.factor = c.factor and a.date between c.start_date and c.end_date)
                         join qr.public.usmeds_fac_ret b on (a.factor = b.factor and a.date = b.date)
                     where
-                        a.date >= '{StartDate.ToString("yyyy-MM-dd")}' and 
-                        a.factor in ({Factors}) and
-                        a.barraid = {BarraIds}
+                        a.date >= @StartDate and 
+                        a.factor = ANY(@Factors) and
+                        a.barraid = ANY(@BarraIds)
                     group by a.barraid,a.date 
-                    order by a.barraid,a.date";
-
-            var reader = PostgresExecuteStoredProcedureWithResultSet
-                (Startup.QRDatabaseConnectionString, RawSql);
-
-            foreach (dynamic row in reader)
-            {
-                var facReturn = new RiskReturn
-                {
-                    BusDate = Convert.ToDateTime(row.date),
-                    BarraId = row.barraid,
-                    Return = Convert.ToDecimal(row.totalreturn)
-                };
-
-                ReturnValue.Add(facReturn);
-            }
-
-            RawSql = $@"
-                    select a.barraid,b.date,coalesce(sum(a.loading*b.dlyreturn),0) totalreturn 
+                    union all
+                    select a.barraid,b.date,coalesce(sum(a.loading*b.dlyreturn),0) totalreturn,1 src
                     from 
                         qr.public.usmeds_asset_exp_override a 
                         join qr.public.usmeds_fac_ret b on (a.factor = b.factor and b.date between a.start_date and a.end_date)  
                     where  
-                        b.date >= '{StartDate.ToString("yyyy-MM-dd")}' and 
-                        a.factor in ({Factors}) and 
-                        a.barraid = {BarraIds}
+                        b.date >= @StartDate and 
+                        a.factor = ANY(@Factors) and 
+                        a.barraid = ANY(@BarraIds)
                     group by a.barraid,b.date
-                    order by a.barraid,b.date
-                    ";            
+                    order by barraid,date,src";
 
-            var readerOverride = PostgresExecuteStoredProcedureWithResultSet
-                (Startup.QRDatabaseConnectionString, RawSql);
+        public static IEnumerable<RiskReturn> GetFactorGroupReturnsHistory(DateTime StartDate, string BarraIds, string Factors)
+        {
+            string[] barraIds = ParseSqlList(BarraIds);
+            FactorModel model = GetFactorModel(StartDate, barraIds);
 
-            foreach (dynamic row in readerOverride)
+            if (model != null)
             {
-                var facReturnOverride = new RiskReturn
-                {
-                    BusDate = Convert.ToDateTime(row.date),
-                    BarraId = row.barraid,
-                    Return = Convert.ToDecimal(row.totalreturn)
-                };
-
-                if (ReturnValue.Where(x => x.BusDate == Convert.ToDateTime(row.date)).Count() == 0)
-                {
-                    ReturnValue.Add(facReturnOverride);                                        
-                }                
+                return model.GetFactorGroupReturns(barraIds.OrderBy(x => x, StringComparer.Ordinal), ParseSqlList(Factors), StartDate).AsEnumerable();
             }
 
-            return ReturnValue.AsEnumerable();
+            return LoadFactorGroupReturnsHistory(StartDate, barraIds, Factors).AsEnumerable();
         }
 
-        public static IEnumerable<RiskReturn> GetFactorGroupPlusSpecificReturnsHistory(DateTime StartDate, string BarraIds, string Factors)
+        internal static List<RiskReturn> LoadFactorGroupReturnsHistory(DateTime StartDate, string[] BarraIds, string Factors)
         {
-            List<RiskReturn> ReturnValue = new List<RiskReturn>();
+            var reader = PostgresExecuteStoredProcedureWithResultSet
+                (Startup.QRDatabaseConnectionString, FactorGroupReturnsSql, FactorGroupReturnsParameters(StartDate, BarraIds, Factors));
 
-            string RawSql = "select a.barraid,a.date,coalesce(sum(a.loading*b.dlyreturn),0) + coalesce(max(c.specific_return)/100,0) totalreturn from qr.public.usmeds_asset_exp a " +
-                    " join qr.public.usmeds_fac_ret b on (a.factor = b.factor and a.date = b.date) " +
-                    " left join qr.public.usmed_specific_return c on (a.barraid = c.barraid and a.date = c.date) " +
-                    " where a.date >= '" + StartDate.ToString("yyyy-MM-dd") + "' and" +
-                    " a.factor in (" + Factors + ") and" +
-                    " a.barraid = " + BarraIds + "" +
-                    " group by a.barraid,a.date";
+            return MergeFactorGroupReturns(reader);
+        }
 
-            var reader = PostgresExecuteStoredProcedureWithResultSet
-                (Startup.QRDatabaseConnectionString, RawSql);
+        public static Dictionary<string, List<RiskReturn>> GetFactorGroupReturnsHistory(DateTime StartDate, IEnumerable<string> BarraIds, string Factors)
+        {
+            Dictionary<string, List<RiskReturn>> ReturnValue = new Dictionary<string, List<RiskReturn>>(StringComparer.OrdinalIgnoreCase);
 
-            foreach (dynamic row in reader)
+            string[] barraIds = BarraIds.Distinct(StringComparer.OrdinalIgnoreCase).ToArray();
+            FactorModel model = GetFactorModel(StartDate, barraIds);
+
+            if (model != null)
             {
-                var facReturn = new RiskReturn
+                foreach (RiskReturn facReturn in model.GetFactorGroupReturns(barraIds, ParseSqlList(Factors), StartDate))
                 {
-                    BusDate = Convert.ToDateTime(row.date),
-                    BarraId = row.barraid,
-                    Return = Convert.ToDecimal(row.totalreturn)
-                };
+                    List<RiskReturn> history;
 
-                ReturnValue.Add(facReturn);
+                    if (!ReturnValue.TryGetValue(facReturn.BarraId, out history))
+                    {
+                        history = new List<RiskReturn>();
+                        ReturnValue.Add(facReturn.BarraId, history);
+                    }
+
+                    history.Add(facReturn);
+                }
+
+                return ReturnValue;
             }
 
-            return ReturnValue.AsEnumerable();
+            foreach (string[] chunk in Chunk(barraIds, MaxSecuritiesPerQuery))
+            {
+                var reader = PostgresExecuteStoredProcedureWithResultSet
+                    (Startup.QRDatabaseConnectionString, FactorGroupReturnsSql, FactorGroupReturnsParameters(StartDate, chunk, Factors));
+
+                foreach (RiskReturn facReturn in MergeFactorGroupReturns(reader))
+                {
+                    List<RiskReturn> history;
+
+                    if (!ReturnValue.TryGetValue(facReturn.BarraId, out history))
+                    {
+                        history = new List<RiskReturn>();
+                        ReturnValue.Add(facReturn.BarraId, history);
+                    }
+
+                    history.Add(facReturn);
+                }
+            }
+
+            return ReturnValue;
         }
 
-        public static IEnumerable<RiskReturn> GetSpecificReturnHistory(string BarraIds, DateTime StartDate)
+        private static List<Npgsql.NpgsqlParameter> FactorGroupReturnsParameters(DateTime StartDate, string[] BarraIds, string Factors)
         {
-            List<RiskReturn> ReturnValue = new List<RiskReturn>();
-
-            string RawSql = "select barraid,specific_return/100 specific_return,date from qr.public.usmed_specific_return" +
-                    " where date >= '" + StartDate.ToString("yyyy-MM-dd") + "' and" +
-                    " barraid in (" + BarraIds + ")";
+            return new List<Npgsql.NpgsqlParameter>() {
+                PostgresParameter("StartDate", NpgsqlTypes.NpgsqlDbType.Date, StartDate.Date),
+                PostgresListParameter("Factors", Factors),
+                PostgresParameter("BarraIds", NpgsqlTypes.NpgsqlDbType.Array | NpgsqlTypes.NpgsqlDbType.Text, BarraIds) };
+        }
 
-            var reader = PostgresExecuteStoredProcedureWithResultSet
-                (Startup.QRDatabaseConnectionString, RawSql);
+        private static IEnumerable<string[]> Chunk(IEnumerable<string> Items, int Size)
+        {
+            List<string> chunk = new List<string>(Size);
 
-            foreach (dynamic row in reader)
+            foreach (string item in Items)
             {
-                var specReturn = new RiskReturn
-                {
-                    BusDate = Convert.ToDateTime(row.date),
-                    BarraId = row.barraid,
-                    Return = Convert.ToDecimal(row.specific_return)
-                };
+                chunk.Add(item);
 
-                ReturnValue.Add(specReturn);
+                if (chunk.Count == Size)
+                {
+                    yield return chunk.ToArray();
+                    chunk.Clear();
+                }
             }
 
-            return ReturnValue.AsEnumerable();
+            if (chunk.Count > 0)
+            {
+                yield return chunk.ToArray();
+            }
         }
 
-        public static IEnumerable<FactorReturn> GetFactorReturns()
+        internal static List<RiskReturn> MergeFactorGroupReturns(IEnumerable<dynamic> Rows)
         {
-            List<FactorReturn> ReturnValue = new List<FactorReturn>();
+            List<RiskReturn> ReturnValue = new List<RiskReturn>();
+            var seen = new HashSet<(string, DateTime)>();
 
-            string RawSql = "select ts,factor,ret ret from mkt_data.factor_returns";
+            foreach (dynamic row in Rows)
+            {
+                string barraId = row.barraid;
+                DateTime busDate = Convert.ToDateTime(row.date);
 
-            var reader = PostgresExecuteStoredProcedureWithResultSet
-                (Startup.QRDatabaseConnectionString, RawSql);
+                if (!seen.Add((barraId, busDate)))
+                {
+                    continue;
+                }
 
-            foreach (dynamic row in reader)
-            {
-                TimeSpan ts = row.ts;
-                string ts1 = ts.ToString(@"hh\:mm\:ss");
-                var facReturn = new FactorReturn
+                var facReturn = new RiskReturn
                 {
-                    Timestamp = Convert.ToDateTime(DateTime.Now.ToString("yyyy/MM/dd") + " " + ts1),
-                    Name = row.factor,
-                    Return = Convert.ToDecimal(row.ret)
+                    BusDate = busDate,
+                    BarraId = barraId,
+                    Return = Convert.ToDecimal(row.totalreturn)
                 };
 
                 ReturnValue.Add(facReturn);
             }
 
-            return ReturnValue.AsEnumerable();
+            return ReturnValue;
         }
 
-        public static IEnumerable<FactorVol> GetFactorVol()
+        public static long MaxFactorModelBytes { get; set; } = 1L << 30;
+
+        private static readonly object FactorModelLock = new object();
+        private static FactorModel SharedFactorModel;
+
+        public static FactorModel GetFactorModel(DateTime StartDate, string BarraIds)
         {
-            List<FactorVol> ReturnValue = new List<FactorVol>();
+            return GetFactorModel(StartDate, ParseSqlList(BarraIds));
+        }
 
-            string RawSql = "select factor1 factor,sqrt(covar)/(100*sqrt(252)) vol from public.usmeds_fac_cov_last where factor1 = factor2";
+        internal static FactorModel GetFactorModel(DateTime StartDate, string[] BarraIds)
+        {
+            string[] barraIds = BarraIds.Distinct(StringComparer.OrdinalIgnoreCase).ToArray();
+            FactorModel model = SharedFactorModel;
 
-            var reader = PostgresExecuteStoredProcedureWithResultSet
-                (Startup.QRDatabaseConnectionString, RawSql);
+            if (model != null && model.StartDate <= StartDate.Date && DateTime.UtcNow - model.LoadedAt < ReferenceDataTtl && barraIds.All(model.Contains))
+            {
+                return model;
+            }
 
-            foreach (dynamic row in reader)
+            // The Postgres loads run outside FactorModelLock, coalesced per reload, so callers that only need the
+            // published model are not queued behind them; the lock is taken only to merge and publish.
+            if (model == null || model.StartDate > StartDate.Date || DateTime.UtcNow - model.LoadedAt >= ReferenceDataTtl)
             {
-                var facVol = new FactorVol
+                model = Coalescer.Run("FactorModel|" + StartDate.Date.ToString("yyyy-MM-dd", CultureInfo.InvariantCulture), TimeSpan.Zero, () =>
                 {
-                    Name = row.factor,
-                    Vol = Convert.ToDecimal(row.vol)
-                };
-
-                ReturnValue.Add(facVol);
+                    FactorModel loaded = LoadFactorModel(StartDate);
+                    PublishFactorModel(loaded);
+                    return loaded;
+                });
             }
 
-            return ReturnValue.AsEnumerable();
-        }
-
-        public static IEnumerable<Factor> GetFactors()
-        {
-            List<Factor> ReturnValue = new List<Factor>();
-
-            string RawSql = @"select b.FactorGroup,b.BarraFactorGroup,a.Factor FactorName,a.FactorDisplayName FactorDesc
-            from barra.Factor a join risk.FactorGroupMap(nolock) b on(upper(a.FactorGroup) = upper(b.BarraFactorGroup))";
-            var reader = ExecuteInlineQueryWithResultSet
-                (Startup.HoloceneDatabaseConnectionString, RawSql);
+            string[] missing = barraIds.Where(id => !model.Contains(id)).ToArray();
 
-            foreach (dynamic row in reader)
+            if (model.SizeInBytes + missing.Length * model.AssetBytes > MaxFactorModelBytes)
             {
-                var factor = new Factor
+                model = new FactorModel(model);
+                missing = barraIds;
+
+                if (model.SizeInBytes + missing.Length * model.AssetBytes > MaxFactorModelBytes)
                 {
-                    BarraFactorGroup = row.BarraFactorGroup,
-                    FactorGroup = row.FactorGroup,
-                    FactorName = row.FactorName,
-                    FactorDesc = row.FactorDesc
-                };
+                    return null;
+                }
+            }
 
-                ReturnValue.Add(factor);
+            if (missing.Length == 0)
+            {
+                return model;
             }
 
-            return ReturnValue.AsEnumerable();
-        }
+            FactorModel target = model;
+            string key = string.Join("|", "FactorModelAssets", target.StartDate.Ticks, target.LoadedAt.Ticks,
+                string.Join(",", missing.OrderBy(x => x, StringComparer.OrdinalIgnoreCase)));
 
-        public static IEnumerable<FactorGroup> GetFactorGroups()
-        {
-            List<FactorGroup> ReturnValue = new List<FactorGroup>();
+            return Coalescer.Run(key, TimeSpan.Zero, () =>
+            {
+                FactorModel extension = new FactorModel(target);
+                LoadFactorModelAssets(extension, missing);
 
-            string RawSql = "select FactorGroup,BarraFactorGroup from risk.FactorGroupMap (nolock)";
+                lock (FactorModelLock)
+                {
+                    target.Merge(extension, missing);
+                }
 
-            var reader = ExecuteInlineQueryWithResultSet
-                (Startup.HoloceneDatabaseConnectionString, RawSql);
+                PublishFactorModel(target);
+                return target;
+            });
+        }
 
-            foreach (dynamic row in reader)
+        private static void PublishFactorModel(FactorModel Model)
+        {
+            lock (FactorModelLock)
             {
-                var factor = new FactorGroup
+                // A slower load must not replace a model that was reloaded after it.
+                if (SharedFactorModel == null || SharedFactorModel.LoadedAt <= Model.LoadedAt)
                 {
-                    BarraFactorGroup = row.BarraFactorGroup,
-                    FactorGroupDesc = row.FactorGroup
-                };
-
-                ReturnValue.Add(factor);
+                    SharedFactorModel = Model;
+                }
             }
-
-            return ReturnValue.AsEnumerable();
         }
 
-        public static IEnumerable<Trade> GetTrades()
+        private static FactorModel LoadFactorModel(DateTime StartDate)
         {
-            List<Trade> ReturnValue = new List<Trade>();
+            var returns = PostgresExecuteStoredProcedureWithResultSet
+                (Startup.QRDatabaseConnectionString, "select date,factor,dlyreturn from qr.public.usmeds_fac_ret where date >= @StartDate",
+                new List<Npgsql.NpgsqlParameter>() {
+                    PostgresParameter("StartDate", NpgsqlTypes.NpgsqlDbType.Date, StartDate.Date) }).ToList();
 
-            IEnumerable<dynamic> reader = ExecuteStoredProcedureWithResultSet(Startup.HoloceneDatabaseConnectionString, "core.GetTrades", null);
+            FactorModel ReturnValue = new FactorModel(StartDate,
+                returns.Select(row => Convert.ToDateTime(((dynamic)row).date)),
+                returns.Select(row => (string)((dynamic)row).factor));
 
-            foreach (dynamic row in reader)
+            foreach (dynamic row in returns)
             {
-                var trade = new Trade
-                {
-                    TradeDate = row.TradeDate,
-                    TradeTime = row.ExecutionTime,
-                    SecurityCode = row.SecurityCode,
+                ReturnValue.SetFactorReturn(Convert.ToDateTime(row.date), row.factor, Convert.ToDouble(row.dlyreturn));
+            }
+
+            return ReturnValue;
+        }
+
+        private static void LoadFactorModelAssets(FactorModel Model, string[] BarraIds)
+        {
+            foreach (string[] chunk in Chunk(BarraIds, MaxSecuritiesPerQuery))
+            {
+                LoadFactorModelAssets(Model, Model.StartDate, chunk);
+            }
+        }
+
+        private static void LoadFactorModelAssets(FactorModel Model, DateTime StartDate, string[] BarraIds)
+        {
+            var loadings = PostgresExecuteStoredProcedureWithResultSet
+                (Startup.QRDatabaseConnectionString, "select barraid,date,factor,loading from qr.public.usmeds_asset_exp where date >= @StartDate and barraid = ANY(@BarraIds)",
+                new List<Npgsql.NpgsqlParameter>() {
+                    PostgresParameter("StartDate", NpgsqlTypes.NpgsqlDbType.Date, StartDate.Date),
+                    PostgresParameter("BarraIds", NpgsqlTypes.NpgsqlDbType.Array | NpgsqlTypes.NpgsqlDbType.Text, BarraIds) });
+
+            foreach (dynamic row in loadings)
+            {
+                if (!(row.loading is System.DBNull))
+                {
+                    Model.SetLoading(row.barraid, Convert.ToDateTime(row.date), row.factor, Convert.ToDouble(row.loading));
+                }
+            }
+
+            var overrides = PostgresExecuteStoredProcedureWithResultSet
+                (Startup.QRDatabaseConnectionString, "select barraid,factor,loading,start_date,end_date from qr.public.usmeds_asset_exp_override where end_date >= @StartDate and barraid = ANY(@BarraIds)",
+                new List<Npgsql.NpgsqlParameter>() {
+                    PostgresParameter("StartDate", NpgsqlTypes.NpgsqlDbType.Date, StartDate.Date),
+                    PostgresParameter("BarraIds", NpgsqlTypes.NpgsqlDbType.Array | NpgsqlTypes.NpgsqlDbType.Text, BarraIds) });
+
+            foreach (dynamic row in overrides)
+            {
+                if (!(row.loading is System.DBNull))
+                {
+                    Model.ApplyOverride(row.barraid, row.factor, Convert.ToDouble(row.loading),
+                        Convert.ToDateTime(row.start_date), Convert.ToDateTime(row.end_date));
+                }
+            }
+
+            var specific = PostgresExecuteStoredProcedureWithResultSet
+                (Startup.QRDatabaseConnectionString, "select barraid,date,specific_return/100 specific_return from qr.public.usmed_specific_return where date >= @StartDate and barraid = ANY(@BarraIds)",
+                new List<Npgsql.NpgsqlParameter>() {
+                    PostgresParameter("StartDate", NpgsqlTypes.NpgsqlDbType.Date, StartDate.Date),
+                    PostgresParameter("BarraIds", NpgsqlTypes.NpgsqlDbType.Array | NpgsqlTypes.NpgsqlDbType.Text, BarraIds) });
+
+            foreach (dynamic row in specific)
+            {
+                if (!(row.specific_return is System.DBNull))
+                {
+                    Model.SetSpecificReturn(row.barraid, Convert.ToDateTime(row.date), Convert.ToDouble(row.specific_return));
+                }
+            }
+        }
+
+        public static IEnumerable<RiskReturn> GetFactorGroupPlusSpecificReturnsHistory(DateTime StartDate, string BarraIds, string Factors)
+        {
+            string[] barraIds = ParseSqlList(BarraIds);
+            FactorModel model = GetFactorModel(StartDate, barraIds);
+
+            if (model != null)
+            {
+                return model.GetFactorGroupPlusSpecificReturns(barraIds, ParseSqlList(Factors), StartDate).AsEnumerable();
+            }
+
+            List<RiskReturn> ReturnValue = new List<RiskReturn>();
+
+            string RawSql = "select a.barraid,a.date,coalesce(sum(a.loading*b.dlyreturn),0) + coalesce(max(c.specific_return)/100,0) totalreturn from qr.public.usmeds_asset_exp a " +
+                    " join qr.public.usmeds_fac_ret b on (a.factor = b.factor and a.date = b.date) " +
+                    " left join qr.public.usmed_specific_return c on (a.barraid = c.barraid and a.date = c.date) " +
+                    " where a.date >= @StartDate and" +
+                    " a.factor = ANY(@Factors) and" +
+                    " a.barraid = ANY(@BarraIds)" +
+                    " group by a.barraid,a.date";
+
+            var reader = PostgresExecuteStoredProcedureWithResultSet
+                (Startup.QRDatabaseConnectionString, RawSql, new List<Npgsql.NpgsqlParameter>() {
+                    PostgresParameter("StartDate", NpgsqlTypes.NpgsqlDbType.Date, StartDate.Date),
+                    PostgresListParameter("Factors", Factors),
+                    PostgresListParameter("BarraIds", BarraIds) });
+
+            foreach (dynamic row in reader)
+            {
+                var facReturn = new RiskReturn
+                {
+                    BusDate = Convert.ToDateTime(row.date),
+                    BarraId = row.barraid,
+                    Return = Convert.ToDecimal(row.totalreturn)
+                };
+
+                ReturnValue.Add(facReturn);
+            }
+
+            return ReturnValue.AsEnumerable();
+        }
+
+        public static IEnumerable<RiskReturn> GetSpecificReturnHistory(string BarraIds, DateTime StartDate)
+        {
+            string[] barraIds = ParseSqlList(BarraIds);
+            BarraSnapshot snapshot = GetBarraSnapshot();
+
+            try
+            {
+                if (snapshot == null || !snapshot.Covers(StartDate))
+                {
+                    return SpecificReturnHistory.Get(barraIds, StartDate, LoadSpecificReturnHistory).AsEnumerable();
+                }
+
+                string[] covered = barraIds.Where(snapshot.Contains).ToArray();
+
+                List<RiskReturn> ReturnValue = snapshot.GetSpecificReturnHistory(covered, StartDate);
+                ReturnValue.AddRange(SpecificReturnHistory.Get(covered, snapshot.LastDate.AddDays(1), LoadSpecificReturnHistory));
+                ReturnValue.AddRange(SpecificReturnHistory.Get(barraIds.Except(covered), StartDate, LoadSpecificReturnHistory));
+
+                return ReturnValue.AsEnumerable();
+            }
+            finally
+            {
+                snapshot?.Release();
+            }
+        }
+
+        public static string WriteBarraSnapshot(string Directory, DateTime StartDate)
+        {
+            // Every write gets a new, ordinally increasing name, so a file another process still has mapped is never replaced.
+            string FileName = Path.Combine(Directory, $"barra-{DateTime.UtcNow:yyyyMMddHHmmssfffffff}.snap");
+
+            BarraSnapshot.Write(FileName,
+                PostgresExecuteStoredProcedureWithResultSet(Startup.QRDatabaseConnectionString,
+                    "select date,factor,dlyreturn from qr.public.usmeds_fac_ret where date >= @StartDate",
+                    new List<Npgsql.NpgsqlParameter>() { PostgresParameter("StartDate", NpgsqlTypes.NpgsqlDbType.Date, StartDate.Date) }),
+                PostgresExecuteStoredProcedureWithResultSet(Startup.QRDatabaseConnectionString,
+                    "select barraid,date,factor,loading from qr.public.usmeds_asset_exp where date >= @StartDate order by barraid,date,factor",
+                    new List<Npgsql.NpgsqlParameter>() { PostgresParameter("StartDate", NpgsqlTypes.NpgsqlDbType.Date, StartDate.Date) }),
+                PostgresExecuteStoredProcedureWithResultSet(Startup.QRDatabaseConnectionString,
+                    "select barraid,date,specific_return/100 specific_return from qr.public.usmed_specific_return where date >= @StartDate order by barraid,date",
+                    new List<Npgsql.NpgsqlParameter>() { PostgresParameter("StartDate", NpgsqlTypes.NpgsqlDbType.Date, StartDate.Date) }));
+
+            foreach (string stale in System.IO.Directory.GetFiles(Directory, "barra-*.snap").OrderByDescending(x => x, StringComparer.Ordinal).Skip(2))
+            {
+                try
+                {
+                    File.Delete(stale);
+                }
+                catch (Exception ex)
+                {
+                    Logger.Warn(ex, $"Could not delete Barra snapshot {stale}");
+                }
+            }
+
+            return FileName;
+        }
+
+        // Returns the current snapshot with a reference taken; callers must Release() it when done reading.
+        private static BarraSnapshot GetBarraSnapshot()
+        {
+            string directory = BarraSnapshotDirectory;
+
+            if (string.IsNullOrEmpty(directory))
+            {
+                return null;
+            }
+
+            lock (BarraSnapshotLock)
+            {
+                if (DateTime.UtcNow - BarraSnapshotCheckedAt >= HistoryRefreshInterval)
+                {
+                    BarraSnapshotCheckedAt = DateTime.UtcNow;
+
+                    string latest = System.IO.Directory.Exists(directory)
+                        ? System.IO.Directory.GetFiles(directory, "barra-*.snap").OrderByDescending(x => x, StringComparer.Ordinal).FirstOrDefault()
+                        : null;
+
+                    if (latest != null && (CurrentBarraSnapshot == null || CurrentBarraSnapshot.FileName != latest
+                        || CurrentBarraSnapshot.LastWriteTimeUtc != File.GetLastWriteTimeUtc(latest)))
+                    {
+                        try
+                        {
+                            BarraSnapshot previous = CurrentBarraSnapshot;
+                            CurrentBarraSnapshot = BarraSnapshot.Open(latest);
+
+                            // Drops the cache's reference; the mapping is closed once in-flight readers release theirs.
+                            previous?.Dispose();
+                        }
+                        catch (Exception ex)
+                        {
+                            Logger.Error(ex, $"Could not open Barra snapshot {latest}");
+                        }
+                    }
+                }
+
+                return CurrentBarraSnapshot != null && CurrentBarraSnapshot.Acquire() ? CurrentBarraSnapshot : null;
+            }
+        }
+
+        private static List<RiskReturn> LoadSpecificReturnHistory(string[] Keys, DateTime From, DateTime? Before)
+        {
+            List<RiskReturn> ReturnValue = new List<RiskReturn>();
+
+            string RawSql = "select barraid,specific_return/100 specific_return,date from qr.public.usmed_specific_return" +
+                    " where date >= @From and date < coalesce(@Before,'infinity'::date) and" +
+                    " barraid = ANY(@BarraIds)";
+
+            var reader = PostgresExecuteStoredProcedureWithResultSet
+                (Startup.QRDatabaseConnectionString, RawSql, new List<Npgsql.NpgsqlParameter>() {
+                    PostgresParameter("From", NpgsqlTypes.NpgsqlDbType.Date, From),
+                    PostgresParameter("Before", NpgsqlTypes.NpgsqlDbType.Date, Before),
+                    PostgresParameter("BarraIds", NpgsqlTypes.NpgsqlDbType.Array | NpgsqlTypes.NpgsqlDbType.Text, Keys) });
+
+            foreach (dynamic row in reader)
+            {
+                var specReturn = new RiskReturn
+                {
+                    BusDate = Convert.ToDateTime(row.date),
+                    BarraId = row.barraid,
+                    Return = Convert.ToDecimal(row.specific_return)
+                };
+
+                ReturnValue.Add(specReturn);
+            }
+
+            return ReturnValue;
+        }
+
+        public static IEnumerable<FactorReturn> GetFactorReturns()
+        {
+            List<FactorReturn> ReturnValue = new List<FactorReturn>();
+
+            string RawSql = "select ts,factor,ret ret from mkt_data.factor_returns";
+
+            var reader = PostgresExecuteStoredProcedureWithResultSet
+                (Startup.QRDatabaseConnectionString, RawSql);
+
+            foreach (dynamic row in reader)
+            {
+                TimeSpan ts = row.ts;
+                string ts1 = ts.ToString(@"hh\:mm\:ss");
+                var facReturn = new FactorReturn
+                {
+                    Timestamp = Convert.ToDateTime(DateTime.Now.ToString("yyyy/MM/dd") + " " + ts1),
+                    Name = row.factor,
+                    Return = Convert.ToDecimal(row.ret)
+                };
+
+                ReturnValue.Add(facReturn);
+            }
+
+            return ReturnValue.AsEnumerable();
+        }
+
+        public static IEnumerable<FactorVol> GetFactorVol()
+        {
+            List<FactorVol> ReturnValue = new List<FactorVol>();
+
+            string RawSql = "select factor1 factor,sqrt(covar)/(100*sqrt(252)) vol from public.usmeds_fac_cov_last where factor1 = factor2";
+
+            var reader = PostgresExecuteStoredProcedureWithResultSet
+                (Startup.QRDatabaseConnectionString, RawSql);
+
+            foreach (dynamic row in reader)
+            {
+                var facVol = new FactorVol
+                {
+                    Name = row.factor,
+                    Vol = Convert.ToDecimal(row.vol)
+                };
+
+                ReturnValue.Add(facVol);
+            }
+
+            return ReturnValue.AsEnumerable();
+        }
+
+        public static IEnumerable<Factor> GetFactors()
+        {
+            return new List<Factor>(ReferenceData.GetOrAdd("barra.Factor", ReferenceDataTtl, LoadFactors)).AsEnumerable();
+        }
+
+        private static List<Factor> LoadFactors()
+        {
+            List<Factor> ReturnValue = new List<Factor>();
+
+            string RawSql = @"select b.FactorGroup,b.BarraFactorGroup,a.Factor FactorName,a.FactorDisplayName FactorDesc
+            from barra.Factor a join risk.FactorGroupMap(nolock) b on(upper(a.FactorGroup) = upper(b.BarraFactorGroup))";
+            var reader = ExecuteInlineQueryWithResultSet
+                (Startup.HoloceneDatabaseConnectionString, RawSql);
+
+            foreach (dynamic row in reader)
+            {
+                var factor = new Factor
+                {
+                    BarraFactorGroup = row.BarraFactorGroup,
+                    FactorGroup = row.FactorGroup,
+                    FactorName = row.FactorName,
+                    FactorDesc = row.FactorDesc
+                };
+
+                ReturnValue.Add(factor);
+            }
+
+            return ReturnValue;
+        }
+
+        public static IEnumerable<FactorGroup> GetFactorGroups()
+        {
+            return new List<FactorGroup>(ReferenceData.GetOrAdd("risk.FactorGroupMap", ReferenceDataTtl, LoadFactorGroups)).AsEnumerable();
+        }
+
+        private static List<FactorGroup> LoadFactorGroups()
+        {
+            List<FactorGroup> ReturnValue = new List<FactorGroup>();
+
+            string RawSql = "select FactorGroup,BarraFactorGroup from risk.FactorGroupMap (nolock)";
+
+            var reader = ExecuteInlineQueryWithResultSet
+                (Startup.HoloceneDatabaseConnectionString, RawSql);
+
+            foreach (dynamic row in reader)
+            {
+                var factor = new FactorGroup
+                {
+                    BarraFactorGroup = row.BarraFactorGroup,
+                    FactorGroupDesc = row.FactorGroup
+                };
+
+                ReturnValue.Add(factor);
+            }
+
+            return ReturnValue;
+        }
+
+        public static IEnumerable<Trade> GetTrades()
+        {
+            List<Trade> ReturnValue = new List<Trade>();
+
+            IEnumerable<dynamic> reader = ExecuteStoredProcedureWithResultSet(Startup.HoloceneDatabaseConnectionString, "core.GetTrades", null);
+
+            foreach (dynamic row in reader)
+            {
+                var trade = new Trade
+                {
+                    TradeDate = row.TradeDate,
+                    TradeTime = row.ExecutionTime,
+                    SecurityCode = row.SecurityCode,
                     Symbol = row.Symbol,
                     FullBloombergCode = row.FullBloombergCode,
                     ExecutionBroker = row.ExecutionBroker,
@@ -3038,35 +4606,80 @@ namespace Portal.Api.Helpers
         {
             List<RiskReturn> ReturnValue = new List<RiskReturn>();
 
-            string RawSql = "select * from qr.public.getspecificreturns_portal('" + Symbol + "','" +
-                    BarraId + "','" + StartDate.ToString("yyyy-MM-dd") + "')";
+            string RawSql = "select * from qr.public.getspecificreturns_portal(@Symbol,@BarraId,@StartDate)";
 
             var reader = PostgresExecuteStoredProcedureWithResultSet
-                (Startup.QRDatabaseConnectionString, RawSql);
+                (Startup.QRDatabaseConnectionString, RawSql, new List<Npgsql.NpgsqlParameter>() {
+                    PostgresParameter("Symbol", NpgsqlTypes.NpgsqlDbType.Unknown, Symbol),
+                    PostgresParameter("BarraId", NpgsqlTypes.NpgsqlDbType.Unknown, BarraId),
+                    PostgresParameter("StartDate", NpgsqlTypes.NpgsqlDbType.Unknown, StartDate.ToString("yyyy-MM-dd")) });
 
             foreach (dynamic row in reader)
             {
-                var rtn = new RiskReturn
-                {
-                    Symbol = row.symbol,
-                    BusDate = row.busdate,
-                    BarraId = row.barraid,
-                    SpecificReturn = row.specreturn,
-                    CumulativeSpecificReturn = row.cumulativespecreturn
-                };
-
-                ReturnValue.Add(rtn);
+                ReturnValue.Add(ToIdioReturn(row));
             }
 
             return ReturnValue.AsEnumerable();
         }
 
-        public static string GetBarraId(string Symbol)
+        public static Dictionary<string, List<RiskReturn>> GetIdioReturnsWithOverrides(IEnumerable<KeyValuePair<string, string>> SymbolBarraIds, DateTime StartDate)
         {
-            string ReturnValue = string.Empty;
+            Dictionary<string, List<RiskReturn>> ReturnValue = new Dictionary<string, List<RiskReturn>>(StringComparer.OrdinalIgnoreCase);
 
-            List<SqlParameter> parameters = new List<SqlParameter>();
-            parameters.Add(new SqlParameter("@Symbol", Symbol));
+            string RawSql = @"
+                    select s.ord,r.*
+                    from 
+                        unnest(@Symbols,@BarraIds) with ordinality as s(symbol,barraid,ord)
+                        cross join lateral qr.public.getspecificreturns_portal(s.symbol,s.barraid,@StartDate) r";
+
+            var securities = SymbolBarraIds.Distinct().ToList();
+
+            for (int start = 0; start < securities.Count; start += MaxSecuritiesPerQuery)
+            {
+                var chunk = securities.Skip(start).Take(MaxSecuritiesPerQuery).ToList();
+
+                var reader = PostgresExecuteStoredProcedureWithResultSet
+                    (Startup.QRDatabaseConnectionString, RawSql, new List<Npgsql.NpgsqlParameter>() {
+                        PostgresParameter("Symbols", NpgsqlTypes.NpgsqlDbType.Array | NpgsqlTypes.NpgsqlDbType.Text, chunk.Select(x => x.Key).ToArray()),
+                        PostgresParameter("BarraIds", NpgsqlTypes.NpgsqlDbType.Array | NpgsqlTypes.NpgsqlDbType.Text, chunk.Select(x => x.Value).ToArray()),
+                        PostgresParameter("StartDate", NpgsqlTypes.NpgsqlDbType.Unknown, StartDate.ToString("yyyy-MM-dd")) });
+
+                foreach (dynamic row in reader)
+                {
+                    string symbol = chunk[Convert.ToInt32(row.ord) - 1].Key;
+                    List<RiskReturn> history;
+
+                    if (!ReturnValue.TryGetValue(symbol, out history))
+                    {
+                        history = new List<RiskReturn>();
+                        ReturnValue.Add(symbol, history);
+                    }
+
+                    history.Add(ToIdioReturn(row));
+                }
+            }
+
+            return ReturnValue;
+        }
+
+        private static RiskReturn ToIdioReturn(dynamic row)
+        {
+            return new RiskReturn
+            {
+                Symbol = row.symbol,
+                BusDate = row.busdate,
+                BarraId = row.barraid,
+                SpecificReturn = row.specreturn,
+                CumulativeSpecificReturn = row.cumulativespecreturn
+            };
+        }
+
+        public static string GetBarraId(string Symbol)
+        {
+            string ReturnValue = string.Empty;
+
+            List<SqlParameter> parameters = new List<SqlParameter>();
+            parameters.Add(new SqlParameter("@Symbol", Symbol));
 
             IEnumerable<dynamic> reader = ExecuteStoredProcedureWithResultSet(Startup.HoloceneDatabaseConnectionString,
                 "risk.GetBarraId", parameters);
@@ -3098,6 +4711,7 @@ namespace Portal.Api.Helpers
 
             ReturnValue = (int)ExecuteStoredProcedureWithReturnValue(
                 Startup.HoloceneDatabaseConnectionString, "research.InsertHotIdea", parameters);
+            InvalidateEVDashboard();
 
             return ReturnValue;
         }
@@ -3135,6 +4749,11 @@ namespace Portal.Api.Helpers
         }
 
         public static IEnumerable<IdeaAbstractLongTermView> GetIdeaAbstractLongTermViews()
+        {
+            return new List<IdeaAbstractLongTermView>(ReferenceData.GetOrAdd("research.GetIdeaAbstractLongTermViews", ReferenceDataTtl, LoadIdeaAbstractLongTermViews)).AsEnumerable();
+        }
+
+        private static List<IdeaAbstractLongTermView> LoadIdeaAbstractLongTermViews()
         {
             List<IdeaAbstractLongTermView> ReturnValue = new List<IdeaAbstractLongTermView>();
 
@@ -3155,10 +4774,15 @@ namespace Portal.Api.Helpers
                 ReturnValue.Add(rec);
             }
 
-            return ReturnValue.AsEnumerable();
+            return ReturnValue;
         }
 
         public static IEnumerable<IdeaAbstractShortTermView> GetIdeaAbstractShortTermViews()
+        {
+            return new List<IdeaAbstractShortTermView>(ReferenceData.GetOrAdd("research.GetIdeaAbstractShortTermViews", ReferenceDataTtl, LoadIdeaAbstractShortTermViews)).AsEnumerable();
+        }
+
+        private static List<IdeaAbstractShortTermView> LoadIdeaAbstractShortTermViews()
         {
             List<IdeaAbstractShortTermView> ReturnValue = new List<IdeaAbstractShortTermView>();
 
@@ -3179,7 +4803,7 @@ namespace Portal.Api.Helpers
                 ReturnValue.Add(rec);
             }
 
-            return ReturnValue.AsEnumerable();
+            return ReturnValue;
         }
 
         public static IEnumerable<IdeaAbstract> GetIdeaAbstracts(string Symbol, string Username, string Timestamp)
@@ -3336,14 +4960,12 @@ namespace Portal.Api.Helpers
             return ReturnValue.AsEnumerable();
         }               
 
-        public static int? SubmitEarningsPreview(Preview preview, 
-            List<PreviewMetric> metrics, ExpectedValue ev, ExpectedValue evFTE,
-            string AdditionalNotes, 
+        private const int MaxMetricsPerBatch = 400;
+
+        internal static List<SqlParameter> EarningsPreviewParameters(Preview preview,
+            ExpectedValue ev, ExpectedValue evFTE, string AdditionalNotes,
             string Username, string Filename)
         {
-            //bool ReturnValue = true;
-            int? EarningsPreviewId;
-
             List<SqlParameter> parameters = new List<SqlParameter>() {
                     new SqlParameter() {ParameterName = "@Symbol",
                         SqlDbType = SqlDbType.NVarChar, Value = preview.Symbol },
@@ -3455,35 +5077,160 @@ namespace Portal.Api.Helpers
                 });
             }
 
-            EarningsPreviewId = ExecuteStoredProcedureWithReturnValue(
-                Startup.HoloceneDatabaseConnectionString,
-                "research.SubmitEarningsPreview", parameters);
+            return parameters;
+        }
+
+        internal static List<SqlParameter> EarningsPreviewMetricParameters(PreviewMetric metric)
+        {
+            return new List<SqlParameter>() {
+                    new SqlParameter() {ParameterName = "@EarningsPreviewId",
+                        SqlDbType = SqlDbType.BigInt },
+                    new SqlParameter() {ParameterName = "@KeyMetric",
+                        SqlDbType = SqlDbType.NVarChar, Value = metric.KeyMetric },
+                    new SqlParameter() {ParameterName = "@KeyMetricOther",
+                        SqlDbType = SqlDbType.NVarChar, Value = metric.KeyMetricOther },
+                    new SqlParameter() {ParameterName = "@HoaEst",
+                        SqlDbType = SqlDbType.Decimal, Value = metric.HoaEst },
+                    new SqlParameter() {ParameterName = "@ConsensusEst",
+                        SqlDbType = SqlDbType.Decimal, Value = metric.ConsensusEst } };
+        }
+
+        private static SqlParameter EarningsPreviewMetricTable(IEnumerable<PreviewMetric> metrics)
+        {
+            DataTable table = new DataTable();
+            table.Columns.Add("KeyMetric", typeof(string));
+            table.Columns.Add("KeyMetricOther", typeof(string));
+            table.Columns.Add("HoaEst", typeof(decimal));
+            table.Columns.Add("ConsensusEst", typeof(decimal));
+
+            foreach (PreviewMetric metric in metrics)
+            {
+                table.Rows.Add(
+                    (object)metric.KeyMetric ?? DBNull.Value,
+                    (object)metric.KeyMetricOther ?? DBNull.Value,
+                    (object)metric.HoaEst ?? DBNull.Value,
+                    (object)metric.ConsensusEst ?? DBNull.Value);
+            }
+
+            return new SqlParameter()
+            {
+                ParameterName = "@Metrics",
+                SqlDbType = SqlDbType.Structured,
+                TypeName = "research.EarningsPreviewMetricList",
+                Value = table
+            };
+        }
+
+        public static int? SubmitEarningsPreview(Preview preview, 
+            List<PreviewMetric> metrics, ExpectedValue ev, ExpectedValue evFTE,
+            string AdditionalNotes, 
+            string Username, string Filename, DatabaseScope Scope = null)
+        {
+            int? ReturnValue = SubmitEarningsPreview(Startup.HoloceneDatabaseConnectionString, preview, metrics,
+                ev, evFTE, AdditionalNotes, Username, Filename, Scope);
+
+            InvalidateEVDashboard();
+
+            return ReturnValue;
+        }
+
+        // UseMetricTable sends the metrics as one research.EarningsPreviewMetricList table-valued parameter; the type and
+        // research.SubmitEarningsPreviewMetrics must be deployed before a caller passes it.
+        internal static int? SubmitEarningsPreview(string DatabaseConnectionString, Preview preview,
+            List<PreviewMetric> metrics, ExpectedValue ev, ExpectedValue evFTE,
+            string AdditionalNotes,
+            string Username, string Filename, DatabaseScope Scope = null, bool UseMetricTable = false)
+        {
+            int? EarningsPreviewId = null;
 
-            if (EarningsPreviewId.HasValue)
+            List<SqlParameter> parameters = EarningsPreviewParameters(preview, ev, evFTE, AdditionalNotes, Username, Filename);
+            var bindings = new Dictionary<string, string> { { "@EarningsPreviewId", "@NewEarningsPreviewId" } };
+            int batchSize = UseMetricTable ? Math.Max(metrics.Count, 1) : MaxMetricsPerBatch;
+
+            using (var lease = OpenSqlConnection(DatabaseConnectionString, Scope))
             {
-                foreach (PreviewMetric metric in metrics)
+                SqlTransaction transaction = (SqlTransaction)lease.Transaction;
+                bool ownsTransaction = transaction == null && metrics.Count > batchSize;
+
+                if (ownsTransaction)
+                {
+                    transaction = ((SqlConnection)lease.Connection).BeginTransaction();
+                }
+
+                try
                 {
-                    parameters = new List<SqlParameter>() {
-                            new SqlParameter() {ParameterName = "@EarningsPreviewId",
-                                SqlDbType = SqlDbType.BigInt, Value = EarningsPreviewId.Value },
-                            new SqlParameter() {ParameterName = "@KeyMetric",
-                                SqlDbType = SqlDbType.NVarChar, Value = metric.KeyMetric },
-                            new SqlParameter() {ParameterName = "@KeyMetricOther",
-                                SqlDbType = SqlDbType.NVarChar, Value = metric.KeyMetricOther },
-                            new SqlParameter() {ParameterName = "@HoaEst",
-                                SqlDbType = SqlDbType.Decimal, Value = metric.HoaEst },
-                            new SqlParameter() {ParameterName = "@ConsensusEst",
-                                SqlDbType = SqlDbType.Decimal, Value = metric.ConsensusEst } };
+                    int offset = 0;
+
+                    do
+                    {
+                        var command = (SqlCommand)lease.CreateCommand(CommandType.Text, null);
+                        command.Transaction = transaction;
+
+                        var declarations = new System.Text.StringBuilder();
+                        var statements = new System.Text.StringBuilder();
+
+                        declarations.AppendLine("declare @Preview table (Id bigint);");
+
+                        if (offset == 0)
+                        {
+                            declarations.AppendLine("declare @NewEarningsPreviewId bigint;");
+                            statements.Append("insert into @Preview (Id) ");
+                            AppendStoredProcedureCall(statements, command, "research.SubmitEarningsPreview", parameters, "_p");
+                            AppendCaptureCheck(statements, "research.SubmitEarningsPreview");
+                            statements.AppendLine("set @NewEarningsPreviewId = (select top 1 Id from @Preview);");
+                        }
+                        else
+                        {
+                            declarations.AppendLine("declare @NewEarningsPreviewId bigint = @PreviewId;");
+                            command.Parameters.Add(new SqlParameter() { ParameterName = "@PreviewId", SqlDbType = SqlDbType.BigInt, Value = EarningsPreviewId.Value });
+                        }
+
+                        statements.AppendLine("if @NewEarningsPreviewId is not null");
+                        statements.AppendLine("begin");
+
+                        if (UseMetricTable)
+                        {
+                            command.Parameters.Add(EarningsPreviewMetricTable(metrics));
+                            statements.AppendLine("exec research.SubmitEarningsPreviewMetrics @EarningsPreviewId = @NewEarningsPreviewId, @Metrics = @Metrics;");
+                        }
+                        else
+                        {
+                            for (int i = offset; i < Math.Min(offset + batchSize, metrics.Count); i++)
+                            {
+                                AppendStoredProcedureCall(statements, command, "research.SubmitEarningsPreviewMetric",
+                                    EarningsPreviewMetricParameters(metrics[i]), "_" + i, bindings);
+                            }
+                        }
 
-                    ExecuteStoredProcedure(
-                        Startup.HoloceneDatabaseConnectionString,
-                        "research.SubmitEarningsPreviewMetric",
-                        parameters);
+                        statements.AppendLine("end");
+
+                        command.CommandText = BuildBatch(declarations.ToString(), statements.ToString(),
+                            "select @NewEarningsPreviewId;\n", transaction == null);
+
+                        object result = command.ExecuteScalar();
+
+                        if (result == null || result is DBNull)
+                        {
+                            throw new Exception("Error submitting earnings preview");
+                        }
+
+                        EarningsPreviewId = Convert.ToInt32(result);
+                        offset += batchSize;
+                    }
+                    while (offset < metrics.Count);
+
+                    if (ownsTransaction)
+                    {
+                        transaction.Commit();
+                    }
+                }
+                finally
+                {
+                    if (ownsTransaction)
+                    {
+                        transaction.Dispose();
+                    }
                 }
-            }
-            else
-            {
-                throw new Exception("Error submitting earnings preview");
             }
 
             return EarningsPreviewId;
@@ -3839,7 +5586,7 @@ namespace Portal.Api.Helpers
             return ReturnValue;
         }
 
-        public static List<IdeaEngine> GetIdeaEngineById(Int64 EngineId)
+        public static List<IdeaEngine> GetIdeaEngineById(Int64 EngineId, DatabaseScope Scope = null)
         {
             List<IdeaEngine> ReturnValue = new List<IdeaEngine>();
 
@@ -3852,7 +5599,7 @@ namespace Portal.Api.Helpers
 
             IEnumerable<dynamic> reader = ExecuteStoredProcedureWithResultSet(
                 Startup.HoloceneDatabaseConnectionString,
-                "research.GetIdeaEngineById", parameters);
+                "research.GetIdeaEngineById", parameters, Scope);
 
             foreach (dynamic row in reader)
             {
@@ -3953,7 +5700,7 @@ namespace Portal.Api.Helpers
             return ReturnValue;
         }
 
-        public static IdeaEngine UpdateIdeaEngine(IdeaEngine engine, string AssignedByUsername)
+        public static IdeaEngine UpdateIdeaEngine(IdeaEngine engine, string AssignedByUsername, DatabaseScope Scope = null)
         {
             IdeaEngine ReturnValue = new IdeaEngine();
 
@@ -4037,18 +5784,30 @@ namespace Portal.Api.Helpers
                     engine.IdeaRecommendation));
             }
 
-            Int64? ideaEngineId = ExecuteStoredProcedureWithReturnValue(
-                Startup.HoloceneDatabaseConnectionString,
-                "research.UpdateIdeaEngine2", parameters);
-
-            if (ideaEngineId.HasValue && ideaEngineId.Value != 0)
+            using (var scope = Scope == null ? DatabaseScope.Begin(Startup.HoloceneDatabaseConnectionString) : null)
             {
-                List<IdeaEngine> lstEngine = DatabaseHelper
-                    .GetIdeaEngineById(ideaEngineId.Value).ToList();
-                if (lstEngine.Count != 0)
-                    ReturnValue = lstEngine.First();
+                DatabaseScope current = Scope ?? scope;
+
+                Int64? ideaEngineId = ExecuteStoredProcedureWithReturnValue(
+                    Startup.HoloceneDatabaseConnectionString,
+                    "research.UpdateIdeaEngine2", parameters, current);
+
+                if (ideaEngineId.HasValue && ideaEngineId.Value != 0)
+                {
+                    List<IdeaEngine> lstEngine = DatabaseHelper
+                        .GetIdeaEngineById(ideaEngineId.Value, current).ToList();
+                    if (lstEngine.Count != 0)
+                        ReturnValue = lstEngine.First();
+                }
+
+                if (scope != null)
+                {
+                    scope.Complete();
+                }
             }
 
+            InvalidateEVDashboard();
+
             return ReturnValue;
         }
 
@@ -4121,6 +5880,11 @@ namespace Portal.Api.Helpers
         }
 
         public static List<PreviewReference> GetPreviewReference()
+        {
+            return new List<PreviewReference>(ReferenceData.GetOrAdd("research.EarningsPreviewReference", ReferenceDataTtl, LoadPreviewReference));
+        }
+
+        private static List<PreviewReference> LoadPreviewReference()
         {
             List<PreviewReference> ReturnValue = new List<PreviewReference>();
 
@@ -4237,13 +6001,10 @@ namespace Portal.Api.Helpers
             return ReturnValue;
         }
 
-        public static IEnumerable<AltDataRecord> GetAltDataRecordView(
-            int DataSourceId, int AssetId, int MetricId, int FilterId, int StatId,
+        private static string AltDataRecordViewSql(int DataSourceId, int AssetId, int MetricId, int FilterId, int StatId,
             int PeriodTypeId)
         {
-            List<AltDataRecord> ReturnValue = new List<AltDataRecord>();
-
-            string RawSql = "select * from core_mapping.record_view where" +
+            return "select * from core_mapping.record_view where" +
                     " datasource_id = " + DataSourceId +
                     " and asset_id = " + AssetId +
                     " and metric_id = " + MetricId +
@@ -4251,35 +6012,74 @@ namespace Portal.Api.Helpers
                     " and stat_id = " + StatId +
                     " and period_type_id = " + PeriodTypeId +
                     " order by period_end;";
+        }
+
+        private static AltDataRecord ToAltDataRecord(dynamic row)
+        {
+            var detail = new AltDataRecord
+            {
+                DataSourceId = row.datasource_id,
+                AssetId = row.asset_id,
+                MetricId = row.metric_id,
+                FilterId = row.filter_id,
+                PeriodId = row.period_id,
+                StatId = row.stat_id,
+                PeriodTypeName = row.period_type_name,
+                PeriodStart = Convert.ToDateTime(row.period_start),
+                PeriodEnd = Convert.ToDateTime(row.period_end),
+                StatName = row.stat_name,
+                StatDesc = row.stat_description,
+                Value = row.value,
+                IsActual = Convert.ToBoolean(row.is_actual),
+                UploadTimestamp = Convert.ToDateTime(row.upload_datetime),
+                ModifiedBy = row.modified_by
+            };
+
+            return detail;
+        }
+
+        public static IEnumerable<AltDataRecord> GetAltDataRecordView(
+            int DataSourceId, int AssetId, int MetricId, int FilterId, int StatId,
+            int PeriodTypeId)
+        {
+            List<AltDataRecord> ReturnValue = ReadAltDataRecordView(DataSourceId, AssetId, MetricId, FilterId, StatId, PeriodTypeId).ToList();
+
+            return ReturnValue;
+        }
 
+        private static IEnumerable<AltDataRecord> ReadAltDataRecordView(
+            int DataSourceId, int AssetId, int MetricId, int FilterId, int StatId,
+            int PeriodTypeId)
+        {
             var reader = PostgresExecuteStoredProcedureWithResultSet
-                (Startup.AltDataConnectionString, RawSql);
+                (Startup.AltDataConnectionString, AltDataRecordViewSql(DataSourceId, AssetId, MetricId, FilterId, StatId, PeriodTypeId));
 
             foreach (dynamic row in reader)
             {
-                var detail = new AltDataRecord
-                {
-                    DataSourceId = row.datasource_id,
-                    AssetId = row.asset_id,
-                    MetricId = row.metric_id,
-                    FilterId = row.filter_id,
-                    PeriodId = row.period_id,
-                    StatId = row.stat_id,
-                    PeriodTypeName = row.period_type_name,
-                    PeriodStart = Convert.ToDateTime(row.period_start),
-                    PeriodEnd = Convert.ToDateTime(row.period_end),
-                    StatName = row.stat_name,
-                    StatDesc = row.stat_description,
-                    Value = row.value,
-                    IsActual = Convert.ToBoolean(row.is_actual),
-                    UploadTimestamp = Convert.ToDateTime(row.upload_datetime),
-                    ModifiedBy = row.modified_by
-                };
-
-                ReturnValue.Add(detail);
+                AltDataRecord detail = ToAltDataRecord(row);
+                yield return detail;
             }
+        }
 
-            return ReturnValue;
+        public static ColumnarResult GetAltDataRecordViewColumnar(
+            int DataSourceId, int AssetId, int MetricId, int FilterId, int StatId,
+            int PeriodTypeId)
+        {
+            return ColumnarResult.From(ReadAltDataRecordView(DataSourceId, AssetId, MetricId, FilterId, StatId, PeriodTypeId));
+        }
+
+        public static async IAsyncEnumerable<AltDataRecord> GetAltDataRecordViewAsync(
+            int DataSourceId, int AssetId, int MetricId, int FilterId, int StatId,
+            int PeriodTypeId, [EnumeratorCancellation] CancellationToken cancellationToken = default)
+        {
+            var reader = PostgresExecuteStoredProcedureWithResultSetAsync
+                (Startup.AltDataConnectionString, AltDataRecordViewSql(DataSourceId, AssetId, MetricId, FilterId, StatId, PeriodTypeId), cancellationToken);
+
+            await foreach (dynamic row in reader)
+            {
+                AltDataRecord detail = ToAltDataRecord(row);
+                yield return detail;
+            }
         }
 
         public static IEnumerable<AltDataRecord> GetAltDataRecordView2(
@@ -4288,39 +6088,12 @@ namespace Portal.Api.Helpers
         {
             List<AltDataRecord> ReturnValue = new List<AltDataRecord>();
 
-            string RawSql = "select * from core_mapping.record_view where" +
-                    " datasource_id = " + DataSourceId +
-                    " and asset_id = " + AssetId +
-                    " and metric_id = " + MetricId +
-                    (FilterId == 0 ? "" : " and filter_id = " + FilterId) +
-                    " and stat_id = " + StatId +
-                    " and period_type_id = " + PeriodTypeId +
-                    " order by period_end;";
-
             var reader = PostgresExecuteStoredProcedureWithResultSet
-                (Startup.AltDataConnectionString, RawSql);
+                (Startup.AltDataConnectionString, AltDataRecordViewSql(DataSourceId, AssetId, MetricId, FilterId, StatId, PeriodTypeId));
 
             foreach (dynamic row in reader)
             {
-                var detail = new AltDataRecord
-                {
-                    DataSourceId = row.datasource_id,
-                    AssetId = row.asset_id,
-                    MetricId = row.metric_id,
-                    FilterId = row.filter_id,
-                    PeriodId = row.period_id,
-                    StatId = row.stat_id,
-                    PeriodTypeName = row.period_type_name,
-                    PeriodStart = Convert.ToDateTime(row.period_start),
-                    PeriodEnd = Convert.ToDateTime(row.period_end),
-                    StatName = row.stat_name,
-                    StatDesc = row.stat_description,
-                    Value = row.value,
-                    IsActual = Convert.ToBoolean(row.is_actual),
-                    UploadTimestamp = Convert.ToDateTime(row.upload_datetime),
-                    ModifiedBy = row.modified_by
-                };
-
+                AltDataRecord detail = ToAltDataRecord(row);
                 ReturnValue.Add(detail);
             }
 
@@ -4328,6 +6101,11 @@ namespace Portal.Api.Helpers
         }
 
         public static IEnumerable<AltDataStat> GetAltDataStatView()
+        {
+            return new List<AltDataStat>(ReferenceData.GetOrAdd("core_mapping.stat", ReferenceDataTtl, LoadAltDataStatView)).AsEnumerable();
+        }
+
+        private static List<AltDataStat> LoadAltDataStatView()
         {
             List<AltDataStat> ReturnValue = new List<AltDataStat>();
 
@@ -4398,13 +6176,30 @@ namespace Portal.Api.Helpers
             return ReturnValue.AsEnumerable();
         }
 
+        private const int MaxScenariosPerBatch = 150;
+
         public static Int64 UpdateNestedExpectedValueScenarios(
             ExpectedValue ExpectedValue, 
             List<ExpectedValueScenario> ExpectedValueScenarios, string Username,
             Int64 ParentExpectedValueId,
             string ParentScenarioType)
+        {
+            List<Int64> ExpectedValueScenarioIds;
+
+            return UpdateNestedExpectedValueScenarios(ExpectedValue, ExpectedValueScenarios, Username,
+                ParentExpectedValueId, ParentScenarioType, out ExpectedValueScenarioIds);
+        }
+
+        public static Int64 UpdateNestedExpectedValueScenarios(
+            ExpectedValue ExpectedValue,
+            List<ExpectedValueScenario> ExpectedValueScenarios, string Username,
+            Int64 ParentExpectedValueId,
+            string ParentScenarioType,
+            out List<Int64> ExpectedValueScenarioIds,
+            DatabaseScope Scope = null)
         {
             Int64 ReturnValue = 0;
+            ExpectedValueScenarioIds = new List<Int64>();
 
             List<SqlParameter> parameters = new List<SqlParameter>() {
                     new SqlParameter() {ParameterName = "@ParentExpectedValueId", SqlDbType = SqlDbType.Int, Value = ParentExpectedValueId },
@@ -4426,31 +6221,125 @@ namespace Portal.Api.Helpers
                     new SqlParameter() {ParameterName = "@ExpectedValueId", SqlDbType = SqlDbType.Int, Value = ExpectedValue.ExpectedValueId, Direction = ParameterDirection.InputOutput }
                 };
 
-            ReturnValue = (int)ExecuteStoredProcedureWithReturnValue(
-                Startup.HoloceneDatabaseConnectionString, "research.UpsertNestedExpectedValue", parameters);
-
-            foreach (ExpectedValueScenario expScenario in ExpectedValueScenarios)
-            {
-                List<SqlParameter> parameters1 = new List<SqlParameter>() {
-                        new SqlParameter() {ParameterName = "@ExpectedValueId", SqlDbType = SqlDbType.Int,
-                            Value = ReturnValue },
-                        new SqlParameter() {ParameterName = "@Scenario", SqlDbType = SqlDbType.NVarChar, Value = expScenario.Scenario },
-                        new SqlParameter() {ParameterName = "@Metric", SqlDbType = SqlDbType.Decimal, Value = expScenario.Metric },
-                        new SqlParameter() {ParameterName = "@Multiple", SqlDbType = SqlDbType.Decimal, Value = expScenario.Multiple },
-                        new SqlParameter() {ParameterName = "@Probability", SqlDbType = SqlDbType.Decimal, Value = expScenario.Probability },
-                        new SqlParameter() {ParameterName = "@Price", SqlDbType = SqlDbType.Decimal, Value = expScenario.Price },
-                        new SqlParameter() {ParameterName = "@OverrideCalc", SqlDbType = SqlDbType.Int, Value = expScenario.OverrideCalc },
-                        new SqlParameter() {ParameterName = "@Upside", SqlDbType = SqlDbType.Decimal, Value = expScenario.Upside },
-                        new SqlParameter() {ParameterName = "@Notes", SqlDbType = SqlDbType.NVarChar, Value = expScenario.Notes },
-                        new SqlParameter() {ParameterName = "@Username", SqlDbType = SqlDbType.NVarChar, Value = Username },
-                        new SqlParameter() {ParameterName = "@ExpectedValueScenarioId", SqlDbType = SqlDbType.Int, Value = expScenario.ExpectedValueScenarioId, Direction = ParameterDirection.InputOutput }
-                    };
+            var bindings = new Dictionary<string, string> { { "@ExpectedValueId", "@NewExpectedValueId" } };
 
-                int expectedValueScenarioId = (int)ExecuteStoredProcedureWithReturnValue(
-                    Startup.HoloceneDatabaseConnectionString,
-                    "research.UpsertNestedExpectedValueScenario", parameters1);
+            using (var lease = OpenSqlConnection(Startup.HoloceneDatabaseConnectionString, Scope))
+            {
+                SqlTransaction transaction = (SqlTransaction)lease.Transaction;
+                bool ownsTransaction = transaction == null && ExpectedValueScenarios.Count > MaxScenariosPerBatch;
+
+                if (ownsTransaction)
+                {
+                    transaction = ((SqlConnection)lease.Connection).BeginTransaction();
+                }
+
+                try
+                {
+                    int offset = 0;
+
+                    do
+                    {
+                        var command = (SqlCommand)lease.CreateCommand(CommandType.Text, null);
+                        command.Transaction = transaction;
+
+                        var declarations = new System.Text.StringBuilder();
+                        var statements = new System.Text.StringBuilder();
+
+                        declarations.AppendLine("declare @Parent table (Id bigint);");
+                        declarations.AppendLine("declare @Ids table (Seq int identity(0, 1), Id bigint);");
+
+                        if (offset == 0)
+                        {
+                            declarations.AppendLine("declare @NewExpectedValueId bigint;");
+                            statements.Append("insert into @Parent (Id) ");
+                            AppendStoredProcedureCall(statements, command, "research.UpsertNestedExpectedValue", parameters, "_ev");
+                            AppendCaptureCheck(statements, "research.UpsertNestedExpectedValue");
+                            statements.AppendLine("set @NewExpectedValueId = (select top 1 Id from @Parent);");
+                        }
+                        else
+                        {
+                            declarations.AppendLine("declare @NewExpectedValueId bigint = @ParentId;");
+                            command.Parameters.Add(new SqlParameter() { ParameterName = "@ParentId", SqlDbType = SqlDbType.BigInt, Value = ReturnValue });
+                        }
+
+                        int batchCount = Math.Min(offset + MaxScenariosPerBatch, ExpectedValueScenarios.Count) - offset;
+
+                        for (int i = offset; i < offset + batchCount; i++)
+                        {
+                            ExpectedValueScenario expScenario = ExpectedValueScenarios[i];
+
+                            List<SqlParameter> parameters1 = new List<SqlParameter>() {
+                                    new SqlParameter() {ParameterName = "@ExpectedValueId", SqlDbType = SqlDbType.Int },
+                                    new SqlParameter() {ParameterName = "@Scenario", SqlDbType = SqlDbType.NVarChar, Value = expScenario.Scenario },
+                                    new SqlParameter() {ParameterName = "@Metric", SqlDbType = SqlDbType.Decimal, Value = expScenario.Metric },
+                                    new SqlParameter() {ParameterName = "@Multiple", SqlDbType = SqlDbType.Decimal, Value = expScenario.Multiple },
+                                    new SqlParameter() {ParameterName = "@Probability", SqlDbType = SqlDbType.Decimal, Value = expScenario.Probability },
+                                    new SqlParameter() {ParameterName = "@Price", SqlDbType = SqlDbType.Decimal, Value = expScenario.Price },
+                                    new SqlParameter() {ParameterName = "@OverrideCalc", SqlDbType = SqlDbType.Int, Value = expScenario.OverrideCalc },
+                                    new SqlParameter() {ParameterName = "@Upside", SqlDbType = SqlDbType.Decimal, Value = expScenario.Upside },
+                                    new SqlParameter() {ParameterName = "@Notes", SqlDbType = SqlDbType.NVarChar, Value = expScenario.Notes },
+                                    new SqlParameter() {ParameterName = "@Username", SqlDbType = SqlDbType.NVarChar, Value = Username },
+                                    new SqlParameter() {ParameterName = "@ExpectedValueScenarioId", SqlDbType = SqlDbType.Int, Value = expScenario.ExpectedValueScenarioId, Direction = ParameterDirection.InputOutput }
+                                };
+
+                            statements.Append("insert into @Ids (Id) ");
+                            AppendStoredProcedureCall(statements, command, "research.UpsertNestedExpectedValueScenario", parameters1, "_" + i, bindings);
+                            AppendCaptureCheck(statements, "research.UpsertNestedExpectedValueScenario");
+                        }
+
+                        command.CommandText = BuildBatch(declarations.ToString(), statements.ToString(),
+                            "select @NewExpectedValueId;\nselect Id from @Ids order by Seq;\n", transaction == null);
+
+                        using (var dataReader = command.ExecuteReader())
+                        {
+                            if (dataReader.Read())
+                            {
+                                ReturnValue = Convert.ToInt64(dataReader[0]);
+                            }
+
+                            dataReader.NextResult();
+
+                            int read = 0;
+
+                            while (dataReader.Read())
+                            {
+                                ExpectedValueScenarioIds.Add(Convert.ToInt64(dataReader[0]));
+                                read++;
+                            }
+
+                            // Ids are written back by position, so a short or long batch must not be committed.
+                            if (read != batchCount)
+                            {
+                                throw new InvalidOperationException(
+                                    $"Expected {batchCount} expected value scenario ids from the batch but received {read}");
+                            }
+                        }
+
+                        offset += MaxScenariosPerBatch;
+                    }
+                    while (offset < ExpectedValueScenarios.Count);
+
+                    if (ownsTransaction)
+                    {
+                        transaction.Commit();
+                    }
+                }
+                finally
+                {
+                    if (ownsTransaction)
+                    {
+                        transaction.Dispose();
+                    }
+                }
+            }
+
+            for (int i = 0; i < ExpectedValueScenarios.Count; i++)
+            {
+                ExpectedValueScenarios[i].ExpectedValueScenarioId = Convert.ToInt32(ExpectedValueScenarioIds[i]);
             }
 
+            InvalidateEVDashboard();
+
             return ReturnValue;
         }
 
@@ -4736,8 +6625,23 @@ namespace Portal.Api.Helpers
             return ReturnValue;
         }
 
-        public static void InsertDashViewQuery(Int64 DashViewId, Int64 DashQueryId,
-            int DisplayOrder, bool IsActive)
+        public static async Task<Int64> InsertDashQueryAsync(string QueryName, string QueryDesc,
+            string Query, string Aesthetic, int UserId, CancellationToken cancellationToken = default)
+        {
+            string RawSql = "insert into core_catalog.dash_query (queryname,querydesc,aesthetic,user_id)" +
+                                "values (@QueryName,@QueryDesc,@Aesthetic,@UserId) RETURNING dash_query_id;";
+
+            return Convert.ToInt64(await PostgresExecuteScalarAsync
+                (Startup.AltDataConnectionString, RawSql, new List<Npgsql.NpgsqlParameter>() {
+                    PostgresParameter("QueryName", NpgsqlTypes.NpgsqlDbType.Text, QueryName),
+                    PostgresParameter("QueryDesc", NpgsqlTypes.NpgsqlDbType.Text, QueryDesc),
+                    PostgresParameter("Aesthetic", NpgsqlTypes.NpgsqlDbType.Text, Aesthetic),
+                    PostgresParameter("UserId", NpgsqlTypes.NpgsqlDbType.Integer, UserId) },
+                cancellationToken: cancellationToken));
+        }
+
+        public static void InsertDashViewQuery(Int64 DashViewId, Int64 DashQueryId,
+            int DisplayOrder, bool IsActive)
         {
             string RawSql = "insert into core_catalog.dash_view_query (dash_view_id,dash_query_id,display_order,is_active)" +
                                 "values (" + DashViewId.ToString() + "," + DashQueryId.ToString() + "," + DisplayOrder + ",true" +
@@ -4747,6 +6651,20 @@ namespace Portal.Api.Helpers
                 (Startup.AltDataConnectionString, RawSql));
         }
 
+        public static async Task InsertDashViewQueryAsync(Int64 DashViewId, Int64 DashQueryId,
+            int DisplayOrder, bool IsActive, CancellationToken cancellationToken = default)
+        {
+            string RawSql = "insert into core_catalog.dash_view_query (dash_view_id,dash_query_id,display_order,is_active)" +
+                                "values (@DashViewId,@DashQueryId,@DisplayOrder,true);";
+
+            await PostgresExecuteNonQueryAsync
+                (Startup.AltDataConnectionString, RawSql, new List<Npgsql.NpgsqlParameter>() {
+                    PostgresParameter("DashViewId", NpgsqlTypes.NpgsqlDbType.Bigint, DashViewId),
+                    PostgresParameter("DashQueryId", NpgsqlTypes.NpgsqlDbType.Bigint, DashQueryId),
+                    PostgresParameter("DisplayOrder", NpgsqlTypes.NpgsqlDbType.Integer, DisplayOrder) },
+                cancellationToken: cancellationToken);
+        }
+
         public static Int64 GetDashAssetId(string Topic)
         {
             Int64 ReturnValue = 0;
@@ -4756,7 +6674,7 @@ namespace Portal.Api.Helpers
                             Topic.Trim().ToUpper() + "';";
 
             object temp = ExecuteInlineQueryWithReturnValue(Startup.HoloceneDatabaseConnectionString,
-                RawSql);
+                RawSql, ReadOnly: true);
             if (temp != null)
             {
                 ReturnValue = Convert.ToInt64(temp);
@@ -4770,25 +6688,60 @@ namespace Portal.Api.Helpers
         {
             Int64 ReturnValue = 0;
 
-            List<SqlParameter> parameters = new List<SqlParameter>() {
+            ReturnValue = (long)ExecuteStoredProcedureWithReturnValueO(
+                Startup.HoloceneDatabaseConnectionString,
+                "data.UpsertDashView", DashViewParameters(DashViewId, DashViewName, DashViewDesc, Asset, Username));
+
+            return ReturnValue;
+        }
+
+        public static async Task<Int64> UpsertDashViewAsync(Int64 DashViewId,
+            string DashViewName, string DashViewDesc, string Asset, string Username, CancellationToken cancellationToken = default)
+        {
+            return (long)await ExecuteScalarAsync(
+                Startup.HoloceneDatabaseConnectionString, CommandType.StoredProcedure,
+                "data.UpsertDashView", DashViewParameters(DashViewId, DashViewName, DashViewDesc, Asset, Username),
+                cancellationToken: cancellationToken);
+        }
+
+        private static List<SqlParameter> DashViewParameters(Int64 DashViewId,
+            string DashViewName, string DashViewDesc, string Asset, string Username)
+        {
+            return new List<SqlParameter>() {
                     new SqlParameter() {ParameterName = "@DashViewId", SqlDbType = SqlDbType.NVarChar, Value = DashViewId },
                     new SqlParameter() {ParameterName = "@DashViewName", SqlDbType = SqlDbType.NVarChar, Value = DashViewName },
                     new SqlParameter() {ParameterName = "@DashViewDesc", SqlDbType = SqlDbType.NVarChar, Value = DashViewDesc },
                     new SqlParameter() {ParameterName = "@Asset", SqlDbType = SqlDbType.NVarChar, Value = Asset },
                     new SqlParameter() {ParameterName = "@Username", SqlDbType = SqlDbType.NVarChar, Value = Username }
                 };
+        }
 
-            ReturnValue = (long)ExecuteStoredProcedureWithReturnValueO(
-                Startup.HoloceneDatabaseConnectionString,
-                "data.UpsertDashView", parameters);
+        public static Int64 UpsertDashChart(Int64 DashChartId, string DashChartTitle, string Aesthetic, string Username)
+        {
+            Int64 ReturnValue = 0;
+
+            ReturnValue = Convert.ToInt64(ExecuteInlineQueryWithReturnValue(
+                Startup.HoloceneDatabaseConnectionString, UpsertDashChartSql(DashChartId, DashChartTitle, Aesthetic, Username)));
+
+            ReferenceData.Invalidate("data.DashChart.default_layout");
 
             return ReturnValue;
         }
 
-        public static Int64 UpsertDashChart(Int64 DashChartId, string DashChartTitle, string Aesthetic, string Username)
+        public static async Task<Int64> UpsertDashChartAsync(Int64 DashChartId, string DashChartTitle, string Aesthetic, string Username,
+            CancellationToken cancellationToken = default)
         {
-            Int64 ReturnValue = 0;
+            Int64 ReturnValue = Convert.ToInt64(await ExecuteScalarAsync(
+                Startup.HoloceneDatabaseConnectionString, CommandType.Text, UpsertDashChartSql(DashChartId, DashChartTitle, Aesthetic, Username),
+                cancellationToken: cancellationToken));
+
+            ReferenceData.Invalidate("data.DashChart.default_layout");
 
+            return ReturnValue;
+        }
+
+        private static string UpsertDashChartSql(Int64 DashChartId, string DashChartTitle, string Aesthetic, string Username)
+        {
             string RawSql = string.Empty;
 
             if (DashChartId == 0)
@@ -4808,16 +6761,28 @@ namespace Portal.Api.Helpers
                          ";";
             }
 
-            ReturnValue = Convert.ToInt64(ExecuteInlineQueryWithReturnValue(
-                Startup.HoloceneDatabaseConnectionString, RawSql));
-
-            return ReturnValue;
+            return RawSql;
         }
 
         public static Int64 UpsertDashQuery(DashQuery Query, string Username)
         {
             Int64 ReturnValue = 0;
 
+            ReturnValue = Convert.ToInt64(ExecuteInlineQueryWithReturnValue
+                (Startup.HoloceneDatabaseConnectionString, UpsertDashQuerySql(Query, Username)));
+
+            return ReturnValue;
+        }
+
+        public static async Task<Int64> UpsertDashQueryAsync(DashQuery Query, string Username, CancellationToken cancellationToken = default)
+        {
+            return Convert.ToInt64(await ExecuteScalarAsync
+                (Startup.HoloceneDatabaseConnectionString, CommandType.Text, UpsertDashQuerySql(Query, Username),
+                cancellationToken: cancellationToken));
+        }
+
+        private static string UpsertDashQuerySql(DashQuery Query, string Username)
+        {
             string RawSql = string.Empty;
 
             if (Query.DashQueryId == 0)
@@ -4843,10 +6808,7 @@ namespace Portal.Api.Helpers
                          ";";
             }
 
-            ReturnValue = Convert.ToInt64(ExecuteInlineQueryWithReturnValue
-                (Startup.HoloceneDatabaseConnectionString, RawSql));
-
-            return ReturnValue;
+            return RawSql;
         }
 
         public static Int64 DeleteDashChartQuery(Int64 DashChartId)
@@ -4964,22 +6926,41 @@ namespace Portal.Api.Helpers
 
             if (DashViewId != 0 && DashChartId != 0)
             {
-                List<SqlParameter> parameters = new List<SqlParameter>() {
-                    new SqlParameter() {ParameterName = "@DashViewId", SqlDbType = SqlDbType.BigInt, Value = DashViewId },
-                    new SqlParameter() {ParameterName = "@DashChartId", SqlDbType = SqlDbType.BigInt, Value = DashChartId },
-                    new SqlParameter() {ParameterName = "@DisplayOrder", SqlDbType = SqlDbType.Int, Value = DisplayOrder },
-                    new SqlParameter() {ParameterName = "@Username", SqlDbType = SqlDbType.NVarChar, Value = Username }
-                    };
-
                 ReturnValue = (long)ExecuteStoredProcedureWithReturnValueO(
                     Startup.HoloceneDatabaseConnectionString,
-                    "data.UpsertDashViewChart", parameters);
+                    "data.UpsertDashViewChart", DashViewChartParameters(DashViewId, DashChartId, DisplayOrder, Username));
+            }
+
+            return ReturnValue;
+        }
+
+        public static async Task<Int64> UpsertDashViewChartAsync(Int64 DashViewId, Int64 DashChartId, int DisplayOrder, string Username,
+            CancellationToken cancellationToken = default)
+        {
+            Int64 ReturnValue = 0;
+
+            if (DashViewId != 0 && DashChartId != 0)
+            {
+                ReturnValue = (long)await ExecuteScalarAsync(
+                    Startup.HoloceneDatabaseConnectionString, CommandType.StoredProcedure,
+                    "data.UpsertDashViewChart", DashViewChartParameters(DashViewId, DashChartId, DisplayOrder, Username),
+                    cancellationToken: cancellationToken);
             }
 
             return ReturnValue;
         }
 
-        public static Int64 UpsertDashQueryCache(Int64 DashQueryId, string CacheData)
+        private static List<SqlParameter> DashViewChartParameters(Int64 DashViewId, Int64 DashChartId, int DisplayOrder, string Username)
+        {
+            return new List<SqlParameter>() {
+                    new SqlParameter() {ParameterName = "@DashViewId", SqlDbType = SqlDbType.BigInt, Value = DashViewId },
+                    new SqlParameter() {ParameterName = "@DashChartId", SqlDbType = SqlDbType.BigInt, Value = DashChartId },
+                    new SqlParameter() {ParameterName = "@DisplayOrder", SqlDbType = SqlDbType.Int, Value = DisplayOrder },
+                    new SqlParameter() {ParameterName = "@Username", SqlDbType = SqlDbType.NVarChar, Value = Username }
+                    };
+        }
+
+        public static Int64 UpsertDashQueryCache(Int64 DashQueryId, string CacheData, DatabaseScope Scope = null)
         {
             Int64 ReturnValue = 0;
 
@@ -4987,18 +6968,49 @@ namespace Portal.Api.Helpers
 
             if (DashQueryId != 0)
             {
-                RawSql = "delete from data.DashQueryCache where DashQueryId = " +
-                         DashQueryId + ";";
-                ExecuteInlineQueryWithReturnValue(Startup.HoloceneDatabaseConnectionString, RawSql);
+                using (var scope = Scope == null ? DatabaseScope.Begin(Startup.HoloceneDatabaseConnectionString) : null)
+                {
+                    DatabaseScope current = Scope ?? scope;
+
+                    RawSql = "delete from data.DashQueryCache where DashQueryId = @DashQueryId;";
+                    ExecuteInlineQueryWithReturnValue(Startup.HoloceneDatabaseConnectionString, RawSql,
+                        new List<SqlParameter>() { new SqlParameter("@DashQueryId", DashQueryId) }, current);
 
-                RawSql = "insert into data.DashQueryCache (DashQueryId,CacheData) " +
-                         "values(" + DashQueryId + ",'" + CacheData + "');";
-                ExecuteInlineQueryWithReturnValue(Startup.HoloceneDatabaseConnectionString, RawSql);
+                    RawSql = "insert into data.DashQueryCache (DashQueryId,CacheData) " +
+                             "values(@DashQueryId, @CacheData);";
+                    ExecuteInlineQueryWithReturnValue(Startup.HoloceneDatabaseConnectionString, RawSql,
+                        new List<SqlParameter>() {
+                            new SqlParameter("@DashQueryId", DashQueryId),
+                            new SqlParameter() { ParameterName = "@CacheData", SqlDbType = SqlDbType.NVarChar, Size = -1, Value = (object)CacheData ?? DBNull.Value } },
+                        current);
+
+                    if (scope != null)
+                    {
+                        scope.Complete();
+                    }
+                }
             }
 
             return ReturnValue;
         }
 
+        public static async Task UpsertDashQueryCacheAsync(Int64 DashQueryId, string CacheData, CancellationToken cancellationToken = default)
+        {
+            if (DashQueryId != 0)
+            {
+                string RawSql = "set xact_abort on; begin transaction; " +
+                                "delete from data.DashQueryCache where DashQueryId = @DashQueryId; " +
+                                "insert into data.DashQueryCache (DashQueryId,CacheData) values(@DashQueryId, @CacheData); " +
+                                "commit transaction;";
+
+                await ExecuteNonQueryAsync(Startup.HoloceneDatabaseConnectionString, CommandType.Text, RawSql,
+                    new List<SqlParameter>() {
+                        new SqlParameter("@DashQueryId", DashQueryId),
+                        new SqlParameter() { ParameterName = "@CacheData", SqlDbType = SqlDbType.NVarChar, Size = -1, Value = (object)CacheData ?? DBNull.Value } },
+                    cancellationToken: cancellationToken);
+            }
+        }
+
         public static DashQuery GetDashQuery(Int64 DashQueryId)
         {
             DashQuery ReturnValue = new DashQuery();
@@ -5316,9 +7328,15 @@ namespace Portal.Api.Helpers
             ExecuteStoredProcedure(
                 Startup.HoloceneDatabaseConnectionString,
                 "research.UpdateStressScore", parameters);
+            InvalidateEVDashboard();
         }
 
         public static List<MacroDash> GetMacroDash()
+        {
+            return new List<MacroDash>(ReferenceData.GetOrAdd("data.MacroDash", DashReferenceDataTtl, LoadMacroDash));
+        }
+
+        private static List<MacroDash> LoadMacroDash()
         {
             List<MacroDash> ReturnValue = new List<MacroDash>();
 
@@ -5401,11 +7419,12 @@ namespace Portal.Api.Helpers
         {
             TCA ReturnValue = new TCA();
 
-            string RawSql = "select * from mktdata.ubs_tcost where bbid = '" + Symbol + "' and date(ts) = '" +
-                    BusDate.ToString("yyyy-MM-dd") + "'";
+            string RawSql = "select * from mktdata.ubs_tcost where bbid = @Symbol and date(ts) = @BusDate";
 
             var reader = PostgresExecuteStoredProcedureWithResultSet
-                (Startup.QRReportsDatabaseConnectionString, RawSql);
+                (Startup.QRReportsDatabaseConnectionString, RawSql, new List<Npgsql.NpgsqlParameter>() {
+                    PostgresParameter("Symbol", NpgsqlTypes.NpgsqlDbType.Text, Symbol),
+                    PostgresParameter("BusDate", NpgsqlTypes.NpgsqlDbType.Date, BusDate.Date) });
 
             foreach (dynamic row in reader)
             {
@@ -5515,12 +7534,17 @@ namespace Portal.Api.Helpers
         }
 
         public static string GetDashChartDefaultLayout()
+        {
+            return ReferenceData.GetOrAdd("data.DashChart.default_layout", DashReferenceDataTtl, LoadDashChartDefaultLayout);
+        }
+
+        private static string LoadDashChartDefaultLayout()
         {
             string ReturnValue = string.Empty;
 
             //select * from data.dashchart (nolock) where Title = 'default_layout'
             Object rv = ExecuteInlineQueryWithReturnValue(
-                Startup.HoloceneDatabaseConnectionString, "select aesthetic from data.dashchart (nolock) where Title = 'default_layout'");
+                Startup.HoloceneDatabaseConnectionString, "select aesthetic from data.dashchart (nolock) where Title = 'default_layout'", ReadOnly: true);
 
             if (rv != null)
             {
@@ -5685,4 +7709,4036 @@ namespace Portal.Api.Helpers
             return ReturnValue;
         }
     }
+
+    public sealed class DatabaseScope : IDisposable
+    {
+        private bool Completed;
+
+        private DatabaseScope(string DatabaseConnectionString, DbConnection connection, bool Transactional, IsolationLevel IsolationLevel)
+        {
+            this.DatabaseConnectionString = DatabaseConnectionString;
+            Connection = connection;
+
+            try
+            {
+                Connection.Open();
+
+                if (Transactional)
+                {
+                    Transaction = Connection.BeginTransaction(IsolationLevel);
+                }
+            }
+            catch
+            {
+                Connection.Dispose();
+                throw;
+            }
+        }
+
+        public string DatabaseConnectionString { get; }
+        public DbConnection Connection { get; }
+        public DbTransaction Transaction { get; }
+
+        public static DatabaseScope Begin(string DatabaseConnectionString, bool Transactional = true,
+            IsolationLevel IsolationLevel = IsolationLevel.ReadCommitted)
+        {
+            return new DatabaseScope(DatabaseConnectionString, new SqlConnection(DatabaseConnectionString), Transactional, IsolationLevel);
+        }
+
+        public static DatabaseScope BeginPostgres(string DatabaseConnectionString, bool Transactional = true,
+            IsolationLevel IsolationLevel = IsolationLevel.ReadCommitted)
+        {
+            return new DatabaseScope(DatabaseConnectionString, new Npgsql.NpgsqlConnection(DatabaseConnectionString), Transactional, IsolationLevel);
+        }
+
+        public void Complete()
+        {
+            if (Transaction != null && !Completed)
+            {
+                Transaction.Commit();
+            }
+
+            Completed = true;
+        }
+
+        internal ConnectionLease Lease<TConnection>(string DatabaseConnectionString) where TConnection : DbConnection
+        {
+            if (!(Connection is TConnection) || DatabaseConnectionString != this.DatabaseConnectionString)
+            {
+                throw new InvalidOperationException("DatabaseScope is bound to a different database");
+            }
+
+            return new ConnectionLease(Connection, Transaction, false);
+        }
+
+        public void Dispose()
+        {
+            if (Transaction != null)
+            {
+                Transaction.Dispose();
+            }
+
+            Connection.Dispose();
+        }
+    }
+
+    public sealed class QueryDeadline : IDisposable
+    {
+        private static readonly AsyncLocal<QueryDeadline> Ambient = new AsyncLocal<QueryDeadline>();
+
+        private readonly QueryDeadline Previous;
+        private readonly CancellationTokenSource Source;
+
+        private QueryDeadline(QueryDeadline Previous, CancellationToken cancellationToken, TimeSpan? Timeout)
+        {
+            this.Previous = Previous;
+
+            DateTime? expiresAt = Timeout.HasValue ? DateTime.UtcNow + Timeout.Value : (DateTime?)null;
+
+            if (Previous != null && Previous.ExpiresAt.HasValue && (!expiresAt.HasValue || Previous.ExpiresAt < expiresAt))
+            {
+                expiresAt = Previous.ExpiresAt;
+            }
+
+            ExpiresAt = expiresAt;
+            Source = Previous == null
+                ? CancellationTokenSource.CreateLinkedTokenSource(cancellationToken)
+                : CancellationTokenSource.CreateLinkedTokenSource(cancellationToken, Previous.Token);
+
+            if (ExpiresAt.HasValue)
+            {
+                TimeSpan remaining = ExpiresAt.Value - DateTime.UtcNow;
+                Source.CancelAfter(remaining > TimeSpan.Zero ? remaining : TimeSpan.Zero);
+            }
+        }
+
+        public static QueryDeadline Current
+        {
+            get { return Ambient.Value; }
+        }
+
+        public DateTime? ExpiresAt { get; }
+
+        public CancellationToken Token
+        {
+            get { return Source.Token; }
+        }
+
+        public static QueryDeadline Begin(CancellationToken cancellationToken, TimeSpan? Timeout = null)
+        {
+            var ReturnValue = new QueryDeadline(Ambient.Value, cancellationToken, Timeout);
+            Ambient.Value = ReturnValue;
+
+            return ReturnValue;
+        }
+
+        public static QueryDeadline Begin(TimeSpan Timeout)
+        {
+            return Begin(CancellationToken.None, Timeout);
+        }
+
+        internal static IDisposable Suspend()
+        {
+            var ReturnValue = new Restore(Ambient.Value);
+            Ambient.Value = null;
+
+            return ReturnValue;
+        }
+
+        internal static int CommandTimeout(int Default)
+        {
+            QueryDeadline current = Ambient.Value;
+
+            if (current == null || !current.ExpiresAt.HasValue)
+            {
+                return Default;
+            }
+
+            int remaining = (int)Math.Max(1, Math.Ceiling((current.ExpiresAt.Value - DateTime.UtcNow).TotalSeconds));
+
+            return Default > 0 ? Math.Min(Default, remaining) : remaining;
+        }
+
+        internal static IDisposable Register(DbCommand command, CancellationToken cancellationToken)
+        {
+            QueryDeadline current = Ambient.Value;
+            CancellationToken ambient = current == null ? CancellationToken.None : current.Token;
+
+            cancellationToken.ThrowIfCancellationRequested();
+            ambient.ThrowIfCancellationRequested();
+
+            if (!cancellationToken.CanBeCanceled && !ambient.CanBeCanceled)
+            {
+                return null;
+            }
+
+            return new Registration(
+                cancellationToken.CanBeCanceled ? cancellationToken.Register(command.Cancel) : default,
+                ambient.CanBeCanceled ? ambient.Register(command.Cancel) : default);
+        }
+
+        public void Dispose()
+        {
+            Ambient.Value = Previous;
+            Source.Dispose();
+        }
+
+        private sealed class Restore : IDisposable
+        {
+            private readonly QueryDeadline Previous;
+
+            public Restore(QueryDeadline Previous)
+            {
+                this.Previous = Previous;
+            }
+
+            public void Dispose()
+            {
+                Ambient.Value = Previous;
+            }
+        }
+
+        private sealed class Registration : IDisposable
+        {
+            private readonly CancellationTokenRegistration Caller;
+            private readonly CancellationTokenRegistration Deadline;
+
+            public Registration(CancellationTokenRegistration Caller, CancellationTokenRegistration Deadline)
+            {
+                this.Caller = Caller;
+                this.Deadline = Deadline;
+            }
+
+            public void Dispose()
+            {
+                Caller.Dispose();
+                Deadline.Dispose();
+            }
+        }
+    }
+
+    internal sealed class ConnectionLease : IDisposable
+    {
+        private readonly bool Owned;
+        private List<IDisposable> Registrations;
+
+        public ConnectionLease(DbConnection connection, DbTransaction transaction, bool owned)
+        {
+            Connection = connection;
+            Transaction = transaction;
+            Owned = owned;
+        }
+
+        public DbConnection Connection { get; }
+        public DbTransaction Transaction { get; }
+
+        public DbCommand CreateCommand(CommandType CommandType, string CommandText, bool ApplyTimeout = true,
+            CancellationToken cancellationToken = default)
+        {
+            var command = Connection.CreateCommand();
+
+            command.CommandTimeout = QueryDeadline.CommandTimeout(ApplyTimeout ? Startup.SqlTimeout : command.CommandTimeout);
+            command.CommandType = CommandType;
+            command.CommandText = CommandText;
+            command.Transaction = Transaction;
+
+            IDisposable registration = QueryDeadline.Register(command, cancellationToken);
+
+            if (registration != null)
+            {
+                if (Registrations == null)
+                {
+                    Registrations = new List<IDisposable>();
+                }
+
+                Registrations.Add(registration);
+            }
+
+            return command;
+        }
+
+        public void Dispose()
+        {
+            if (Registrations != null)
+            {
+                foreach (IDisposable registration in Registrations)
+                {
+                    registration.Dispose();
+                }
+            }
+
+            if (Owned)
+            {
+                Connection.Dispose();
+            }
+        }
+    }
+
+    public sealed class ReferenceDataCache
+    {
+        private sealed class Entry
+        {
+            public Entry(Lazy<object> Value, DateTime ExpiresAt)
+            {
+                this.Value = Value;
+                this.ExpiresAt = ExpiresAt;
+                Touch();
+            }
+
+            public Lazy<object> Value { get; }
+            public DateTime ExpiresAt { get; }
+            public int Size { get; set; }
+            public long LastAccess { get; private set; }
+
+            public void Touch()
+            {
+                LastAccess = Stopwatch.GetTimestamp();
+            }
+        }
+
+        private readonly ConcurrentDictionary<string, Entry> Entries = new ConcurrentDictionary<string, Entry>();
+        private readonly ConcurrentDictionary<string, ReferenceDataCacheCounter> Counters = new ConcurrentDictionary<string, ReferenceDataCacheCounter>();
+        private readonly object TrimLock = new object();
+        private readonly int MaxEntries;
+        private readonly int MaxItems;
+
+        private long Evictions;
+        private long Invalidations;
+
+        public ReferenceDataCache(int MaxEntries, int MaxItems)
+        {
+            this.MaxEntries = MaxEntries;
+            this.MaxItems = MaxItems;
+        }
+
+        public T GetOrAdd<T>(string Key, TimeSpan Ttl, Func<T> Load) where T : class
+        {
+            return GetOrAdd(Key, Ttl, Load, null);
+        }
+
+        public T GetOrAdd<T>(string Key, TimeSpan Ttl, Func<T> Load, Func<T, int> SizeOf) where T : class
+        {
+            ReferenceDataCacheCounter counter = Counters.GetOrAdd(Key, k => new ReferenceDataCacheCounter { Key = k });
+            Entry cached;
+
+            if (Entries.TryGetValue(Key, out cached) && cached.ExpiresAt > DateTime.UtcNow && cached.Value.IsValueCreated)
+            {
+                cached.Touch();
+                Interlocked.Increment(ref counter.Hits);
+
+                return (T)cached.Value.Value;
+            }
+
+            while (true)
+            {
+                var candidate = new Entry(new Lazy<object>(() => Load(), LazyThreadSafetyMode.ExecutionAndPublication), DateTime.UtcNow.Add(Ttl));
+                Entry entry = Entries.GetOrAdd(Key, candidate);
+
+                if (entry.ExpiresAt <= DateTime.UtcNow)
+                {
+                    Remove(Key, entry);
+                    continue;
+                }
+
+                object value;
+
+                try
+                {
+                    value = entry.Value.Value;
+                }
+                catch
+                {
+                    Remove(Key, entry);
+                    throw;
+                }
+
+                entry.Touch();
+
+                if (ReferenceEquals(entry, candidate))
+                {
+                    Interlocked.Increment(ref counter.Misses);
+
+                    var collection = value as System.Collections.ICollection;
+                    entry.Size = SizeOf != null ? Math.Max(SizeOf((T)value), 1) : collection == null ? 1 : Math.Max(collection.Count, 1);
+
+                    Trim(Key, entry);
+                }
+                else
+                {
+                    Interlocked.Increment(ref counter.Hits);
+                }
+
+                return (T)value;
+            }
+        }
+
+        public void Invalidate(string Key)
+        {
+            Entry entry;
+
+            if (Entries.TryRemove(Key, out entry))
+            {
+                Interlocked.Increment(ref Invalidations);
+            }
+        }
+
+        public void InvalidateAll()
+        {
+            foreach (string key in Entries.Keys.ToList())
+            {
+                Invalidate(key);
+            }
+        }
+
+        public ReferenceDataCacheStatistics GetStatistics()
+        {
+            List<ReferenceDataCacheCounter> keys = Counters.Values
+                .Select(c => new ReferenceDataCacheCounter { Key = c.Key, Hits = Interlocked.Read(ref c.Hits), Misses = Interlocked.Read(ref c.Misses) })
+                .OrderBy(c => c.Key)
+                .ToList();
+
+            return new ReferenceDataCacheStatistics
+            {
+                Hits = keys.Sum(c => c.Hits),
+                Misses = keys.Sum(c => c.Misses),
+                Evictions = Interlocked.Read(ref Evictions),
+                Invalidations = Interlocked.Read(ref Invalidations),
+                Entries = Entries.Count,
+                Items = Entries.Values.Sum(e => e.Size),
+                Keys = keys
+            };
+        }
+
+        private void Remove(string Key, Entry entry)
+        {
+            ((ICollection<KeyValuePair<string, Entry>>)Entries).Remove(new KeyValuePair<string, Entry>(Key, entry));
+        }
+
+        private void Trim(string Key, Entry Added)
+        {
+            lock (TrimLock)
+            {
+                if (Added.Size > MaxItems)
+                {
+                    Remove(Key, Added);
+                    Interlocked.Increment(ref Evictions);
+                    return;
+                }
+
+                List<KeyValuePair<string, Entry>> entries = Entries.ToList();
+                int count = entries.Count;
+                long items = entries.Sum(e => (long)e.Value.Size);
+
+                foreach (var pair in entries.Where(e => e.Key != Key).OrderBy(e => e.Value.LastAccess))
+                {
+                    if (count <= MaxEntries && items <= MaxItems)
+                    {
+                        break;
+                    }
+
+                    Remove(pair.Key, pair.Value);
+                    Interlocked.Increment(ref Evictions);
+                    count--;
+                    items -= pair.Value.Size;
+                }
+            }
+        }
+    }
+
+    public class ReferenceDataCacheCounter
+    {
+        public string Key { get; set; }
+        public long Hits;
+        public long Misses;
+    }
+
+    public class ReferenceDataCacheStatistics
+    {
+        public long Hits { get; set; }
+        public long Misses { get; set; }
+        public long Evictions { get; set; }
+        public long Invalidations { get; set; }
+        public int Entries { get; set; }
+        public long Items { get; set; }
+        public List<ReferenceDataCacheCounter> Keys { get; set; }
+    }
+
+    public static class QueryStatistics
+    {
+        private const int MaxKeys = 2000;
+        private const string OverflowKey = "(other)";
+
+        private static readonly ConcurrentDictionary<string, QueryStatisticsEntry> Entries = new ConcurrentDictionary<string, QueryStatisticsEntry>();
+        private static readonly System.Text.RegularExpressions.Regex Literals = new System.Text.RegularExpressions.Regex(
+            @"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b", System.Text.RegularExpressions.RegexOptions.Compiled);
+        private static readonly System.Text.RegularExpressions.Regex Whitespace = new System.Text.RegularExpressions.Regex(
+            @"\s+", System.Text.RegularExpressions.RegexOptions.Compiled);
+
+        public static bool Enabled { get; set; } = true;
+
+        public static string Fingerprint(string Sql)
+        {
+            if (string.IsNullOrEmpty(Sql))
+            {
+                return string.Empty;
+            }
+
+            string fingerprint = Whitespace.Replace(Literals.Replace(Sql, "?"), " ").Trim();
+
+            return fingerprint.Length > 200 ? fingerprint.Substring(0, 200) : fingerprint;
+        }
+
+        internal static QueryTimer Start(string Key)
+        {
+            return new QueryTimer(Enabled ? Key : null);
+        }
+
+        internal static void Record(string Key, bool Completed, double OpenMs, double FirstRowMs, double TotalMs, double MappingMs, long Rows)
+        {
+            QueryStatisticsEntry entry;
+
+            if (!Entries.TryGetValue(Key, out entry))
+            {
+                entry = Entries.GetOrAdd(Entries.Count < MaxKeys ? Key : OverflowKey, k => new QueryStatisticsEntry());
+            }
+
+            entry.Record(Completed, OpenMs, FirstRowMs, TotalMs, MappingMs, Rows);
+        }
+
+        public static List<QueryStatisticsSnapshot> GetSnapshot()
+        {
+            return Entries
+                .Select(e => e.Value.Snapshot(e.Key))
+                .OrderByDescending(e => e.Total.Mean * e.Calls)
+                .ToList();
+        }
+
+        public static void Reset()
+        {
+            Entries.Clear();
+        }
+    }
+
+    internal sealed class QueryTimer : IDisposable
+    {
+        private readonly string Key;
+        private readonly long Started;
+        private long OpenedAt;
+        private long FirstRowAt;
+        private long SuspendedAt;
+        private long SuspendedTicks;
+        private long Rows;
+        private bool Completed;
+        private bool Recorded;
+
+        public QueryTimer(string Key)
+        {
+            this.Key = Key;
+            Started = Stopwatch.GetTimestamp();
+        }
+
+        public void Opened()
+        {
+            OpenedAt = Stopwatch.GetTimestamp();
+        }
+
+        public void Row()
+        {
+            long now = Stopwatch.GetTimestamp();
+
+            if (Rows == 0)
+            {
+                FirstRowAt = now;
+            }
+
+            Rows++;
+            SuspendedAt = now;
+        }
+
+        public void Resumed()
+        {
+            SuspendedTicks += Stopwatch.GetTimestamp() - SuspendedAt;
+        }
+
+        public void Complete()
+        {
+            Completed = true;
+        }
+
+        public void Dispose()
+        {
+            if (Recorded || Key == null)
+            {
+                return;
+            }
+
+            Recorded = true;
+
+            long now = Stopwatch.GetTimestamp();
+
+            QueryStatistics.Record(Key, Completed,
+                Milliseconds((OpenedAt == 0 ? now : OpenedAt) - Started),
+                Milliseconds((FirstRowAt == 0 ? now : FirstRowAt) - Started),
+                Milliseconds(now - Started),
+                Milliseconds(SuspendedTicks),
+                Rows);
+        }
+
+        private static double Milliseconds(long Ticks)
+        {
+            return Ticks * 1000.0 / Stopwatch.Frequency;
+        }
+    }
+
+    internal sealed class QueryStatisticsEntry
+    {
+        private static readonly double[] LatencyBounds = { 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000 };
+        private static readonly double[] RowBounds = { 0, 1, 10, 100, 1000, 10000, 100000, 1000000 };
+
+        private readonly Histogram Open = new Histogram(LatencyBounds);
+        private readonly Histogram FirstRow = new Histogram(LatencyBounds);
+        private readonly Histogram Total = new Histogram(LatencyBounds);
+        private readonly Histogram Mapping = new Histogram(LatencyBounds);
+        private readonly Histogram Rows = new Histogram(RowBounds);
+        private long Calls;
+        private long Incomplete;
+
+        public void Record(bool Completed, double OpenMs, double FirstRowMs, double TotalMs, double MappingMs, long RowCount)
+        {
+            Interlocked.Increment(ref Calls);
+
+            if (!Completed)
+            {
+                Interlocked.Increment(ref Incomplete);
+            }
+
+            Open.Record(OpenMs);
+            FirstRow.Record(FirstRowMs);
+            Total.Record(TotalMs);
+            Mapping.Record(MappingMs);
+            Rows.Record(RowCount);
+        }
+
+        public QueryStatisticsSnapshot Snapshot(string Key)
+        {
+            return new QueryStatisticsSnapshot
+            {
+                Key = Key,
+                Calls = Interlocked.Read(ref Calls),
+                Incomplete = Interlocked.Read(ref Incomplete),
+                Open = Open.Snapshot(),
+                FirstRow = FirstRow.Snapshot(),
+                Total = Total.Snapshot(),
+                Mapping = Mapping.Snapshot(),
+                Rows = Rows.Snapshot()
+            };
+        }
+    }
+
+    internal sealed class Histogram
+    {
+        private readonly double[] Bounds;
+        private readonly long[] Counts;
+        private long Count;
+        private double Sum;
+        private double Max;
+
+        public Histogram(double[] Bounds)
+        {
+            this.Bounds = Bounds;
+            Counts = new long[Bounds.Length + 1];
+        }
+
+        public void Record(double Value)
+        {
+            int bucket = Array.BinarySearch(Bounds, Value);
+
+            if (bucket < 0)
+            {
+                bucket = ~bucket;
+            }
+
+            lock (Counts)
+            {
+                Counts[bucket]++;
+                Count++;
+                Sum += Value;
+                Max = Math.Max(Max, Value);
+            }
+        }
+
+        public HistogramSnapshot Snapshot()
+        {
+            lock (Counts)
+            {
+                return new HistogramSnapshot
+                {
+                    Count = Count,
+                    Mean = Count == 0 ? 0 : Sum / Count,
+                    Max = Max,
+                    P50 = Percentile(0.50),
+                    P95 = Percentile(0.95),
+                    P99 = Percentile(0.99),
+                    Buckets = Bounds.Select((b, i) => new KeyValuePair<double, long>(b, Counts[i]))
+                        .Concat(new[] { new KeyValuePair<double, long>(double.PositiveInfinity, Counts[Bounds.Length]) })
+                        .ToList()
+                };
+            }
+        }
+
+        private double Percentile(double Quantile)
+        {
+            if (Count == 0)
+            {
+                return 0;
+            }
+
+            long target = (long)Math.Ceiling(Count * Quantile);
+            long seen = 0;
+
+            for (int i = 0; i < Counts.Length; i++)
+            {
+                seen += Counts[i];
+
+                if (seen >= target)
+                {
+                    return i < Bounds.Length ? Math.Min(Bounds[i], Max) : Max;
+                }
+            }
+
+            return Max;
+        }
+    }
+
+    public class HistogramSnapshot
+    {
+        public long Count { get; set; }
+        public double Mean { get; set; }
+        public double Max { get; set; }
+        public double P50 { get; set; }
+        public double P95 { get; set; }
+        public double P99 { get; set; }
+        public List<KeyValuePair<double, long>> Buckets { get; set; }
+    }
+
+    public class QueryStatisticsSnapshot
+    {
+        public string Key { get; set; }
+        public long Calls { get; set; }
+        public long Incomplete { get; set; }
+        public HistogramSnapshot Open { get; set; }
+        public HistogramSnapshot FirstRow { get; set; }
+        public HistogramSnapshot Total { get; set; }
+        public HistogramSnapshot Mapping { get; set; }
+        public HistogramSnapshot Rows { get; set; }
+    }
+
+    public sealed class ReplayDataSource
+    {
+        private readonly List<KeyValuePair<string, Func<DbDataReader>>> Rules = new List<KeyValuePair<string, Func<DbDataReader>>>();
+        private long RowsServedCount;
+
+        public long RowsServed
+        {
+            get { return Interlocked.Read(ref RowsServedCount); }
+        }
+
+        public ReplayDataSource Add(string CommandText, DataTable Template, int RowCount)
+        {
+            object[][] rows = Template.Rows.Cast<DataRow>().Select(r => r.ItemArray).ToArray();
+
+            Rules.Add(new KeyValuePair<string, Func<DbDataReader>>(CommandText, () => new ReplayDataReader(Template, rows, RowCount, this)));
+
+            return this;
+        }
+
+        internal DbDataReader CreateReader(string CommandText)
+        {
+            foreach (var rule in Rules)
+            {
+                if (CommandText.IndexOf(rule.Key, StringComparison.OrdinalIgnoreCase) >= 0)
+                {
+                    return rule.Value();
+                }
+            }
+
+            throw new InvalidOperationException($"No replay result registered for command: {QueryStatistics.Fingerprint(CommandText)}");
+        }
+
+        internal void Served()
+        {
+            Interlocked.Increment(ref RowsServedCount);
+        }
+
+        public static DataTable Record(DbDataReader dataReader, string Name, int MaxRows = 10000)
+        {
+            DataTable ReturnValue = new DataTable(Name);
+
+            for (int i = 0; i < dataReader.FieldCount; i++)
+            {
+                ReturnValue.Columns.Add(dataReader.GetName(i), dataReader.GetFieldType(i));
+            }
+
+            var values = new object[dataReader.FieldCount];
+
+            while (ReturnValue.Rows.Count < MaxRows && dataReader.Read())
+            {
+                dataReader.GetValues(values);
+                ReturnValue.Rows.Add(values);
+            }
+
+            return ReturnValue;
+        }
+
+        public static void Save(DataTable Template, string Path)
+        {
+            Template.WriteXml(Path, XmlWriteMode.WriteSchema);
+        }
+
+        public static DataTable Load(string Path)
+        {
+            DataTable ReturnValue = new DataTable();
+            ReturnValue.ReadXml(Path);
+
+            return ReturnValue;
+        }
+
+        public static DataTable Synthesize(string Name, IEnumerable<KeyValuePair<string, Type>> Columns, int DistinctRows = 1000, int Seed = 42)
+        {
+            DataTable ReturnValue = new DataTable(Name);
+
+            foreach (var column in Columns)
+            {
+                ReturnValue.Columns.Add(column.Key, column.Value);
+            }
+
+            Random random = new Random(Seed);
+            DateTime date = DateTime.Today;
+
+            for (int i = 0; i < DistinctRows; i++)
+            {
+                var values = new object[ReturnValue.Columns.Count];
+
+                for (int c = 0; c < values.Length; c++)
+                {
+                    Type type = ReturnValue.Columns[c].DataType;
+                    string name = ReturnValue.Columns[c].ColumnName;
+
+                    if (type == typeof(string))
+                        values[c] = name + (i % 500);
+                    else if (type == typeof(DateTime))
+                        values[c] = date.AddDays(-(i % 2500));
+                    else if (type == typeof(bool))
+                        values[c] = i % 7 == 0;
+                    else if (type == typeof(decimal))
+                        values[c] = (decimal)Math.Round(random.NextDouble() * 200000 - 100000, 4);
+                    else if (type == typeof(double) || type == typeof(float))
+                        values[c] = Convert.ChangeType(random.NextDouble() * 2 - 1, type);
+                    else if (type == typeof(int) || type == typeof(long) || type == typeof(short))
+                        values[c] = Convert.ChangeType(i + 1, type);
+                    else
+                        values[c] = DBNull.Value;
+                }
+
+                ReturnValue.Rows.Add(values);
+            }
+
+            return ReturnValue;
+        }
+
+        public static IEnumerable<KeyValuePair<string, Type>> ColumnsOf<T>()
+        {
+            return typeof(T).GetProperties(BindingFlags.Public | BindingFlags.Instance)
+                .Where(p => p.CanWrite && p.GetIndexParameters().Length == 0)
+                .Select(p => new KeyValuePair<string, Type>(p.Name, Nullable.GetUnderlyingType(p.PropertyType) ?? p.PropertyType))
+                .Where(p => p.Value.IsPrimitive || p.Value == typeof(string) || p.Value == typeof(decimal) || p.Value == typeof(DateTime));
+        }
+    }
+
+    internal sealed class ReplayDataReader : DbDataReader
+    {
+        private readonly DataTable Template;
+        private readonly object[][] Rows;
+        private readonly int RowCount;
+        private readonly ReplayDataSource Source;
+        private object[] Current;
+        private int Position = -1;
+        private bool Closed;
+
+        public ReplayDataReader(DataTable Template, object[][] Rows, int RowCount, ReplayDataSource Source)
+        {
+            this.Template = Template;
+            this.Rows = Rows;
+            this.RowCount = Rows.Length == 0 ? 0 : RowCount;
+            this.Source = Source;
+        }
+
+        public override bool Read()
+        {
+            if (Closed || Position + 1 >= RowCount)
+            {
+                Current = null;
+                return false;
+            }
+
+            Position++;
+            Current = Rows[Position % Rows.Length];
+            Source.Served();
+
+            return true;
+        }
+
+        public override bool NextResult()
+        {
+            return false;
+        }
+
+        public override void Close()
+        {
+            Closed = true;
+        }
+
+        public override int Depth => 0;
+        public override int FieldCount => Template.Columns.Count;
+        public override bool HasRows => RowCount > 0;
+        public override bool IsClosed => Closed;
+        public override int RecordsAffected => -1;
+        public override object this[int ordinal] => GetValue(ordinal);
+        public override object this[string name] => GetValue(GetOrdinal(name));
+
+        public override string GetName(int ordinal) => Template.Columns[ordinal].ColumnName;
+        public override int GetOrdinal(string name) => Template.Columns.IndexOf(name);
+        public override Type GetFieldType(int ordinal) => Template.Columns[ordinal].DataType;
+        public override string GetDataTypeName(int ordinal) => GetFieldType(ordinal).Name;
+        public override object GetValue(int ordinal) => Current[ordinal];
+        public override bool IsDBNull(int ordinal) => Current[ordinal] is DBNull;
+
+        public override int GetValues(object[] values)
+        {
+            int count = Math.Min(values.Length, Current.Length);
+            Array.Copy(Current, values, count);
+
+            return count;
+        }
+
+        public override bool GetBoolean(int ordinal) => (bool)Current[ordinal];
+        public override byte GetByte(int ordinal) => (byte)Current[ordinal];
+        public override char GetChar(int ordinal) => (char)Current[ordinal];
+        public override DateTime GetDateTime(int ordinal) => (DateTime)Current[ordinal];
+        public override decimal GetDecimal(int ordinal) => (decimal)Current[ordinal];
+        public override double GetDouble(int ordinal) => (double)Current[ordinal];
+        public override float GetFloat(int ordinal) => (float)Current[ordinal];
+        public override Guid GetGuid(int ordinal) => (Guid)Current[ordinal];
+        public override short GetInt16(int ordinal) => (short)Current[ordinal];
+        public override int GetInt32(int ordinal) => (int)Current[ordinal];
+        public override long GetInt64(int ordinal) => (long)Current[ordinal];
+        public override string GetString(int ordinal) => (string)Current[ordinal];
+
+        public override long GetBytes(int ordinal, long dataOffset, byte[] buffer, int bufferOffset, int length)
+        {
+            throw new NotSupportedException();
+        }
+
+        public override long GetChars(int ordinal, long dataOffset, char[] buffer, int bufferOffset, int length)
+        {
+            throw new NotSupportedException();
+        }
+
+        public override System.Collections.IEnumerator GetEnumerator()
+        {
+            return new DbEnumerator(this);
+        }
+    }
+
+    public sealed class FactorModel
+    {
+        private sealed class Asset
+        {
+            public double[] Loadings;
+            public bool[] Exposed;
+            public double[] RawLoadings;
+            public bool[] RawExposed;
+            public double[] SpecificReturns;
+        }
+
+        private readonly DateTime[] Dates;
+        private readonly Dictionary<DateTime, int> DateIndex;
+        private readonly Dictionary<string, int> FactorIndex;
+        private readonly int Stride;
+        private readonly double[] Returns;
+        private volatile Dictionary<string, Asset> Assets = new Dictionary<string, Asset>(StringComparer.OrdinalIgnoreCase);
+        private volatile HashSet<string> Loaded = new HashSet<string>(StringComparer.OrdinalIgnoreCase);
+
+        internal FactorModel(DateTime StartDate, IEnumerable<DateTime> Dates, IEnumerable<string> Factors)
+        {
+            this.StartDate = StartDate.Date;
+            LoadedAt = DateTime.UtcNow;
+            this.Dates = Dates.Select(x => x.Date).Distinct().OrderBy(x => x).ToArray();
+            DateIndex = this.Dates.Select((d, i) => new KeyValuePair<DateTime, int>(d, i)).ToDictionary(x => x.Key, x => x.Value);
+            FactorIndex = Factors.Distinct(StringComparer.OrdinalIgnoreCase).Select((f, i) => new KeyValuePair<string, int>(f, i))
+                .ToDictionary(x => x.Key, x => x.Value, StringComparer.OrdinalIgnoreCase);
+
+            int width = System.Numerics.Vector<double>.Count;
+            Stride = (FactorIndex.Count + width - 1) / width * width;
+            Returns = new double[this.Dates.Length * Stride];
+        }
+
+        internal FactorModel(FactorModel Source)
+        {
+            StartDate = Source.StartDate;
+            LoadedAt = Source.LoadedAt;
+            Dates = Source.Dates;
+            DateIndex = Source.DateIndex;
+            FactorIndex = Source.FactorIndex;
+            Stride = Source.Stride;
+            Returns = Source.Returns;
+        }
+
+        public DateTime StartDate { get; }
+        public DateTime LoadedAt { get; }
+
+        public long AssetBytes
+        {
+            get { return (long)Returns.Length * (sizeof(double) + sizeof(bool)) + (long)Dates.Length * sizeof(double); }
+        }
+
+        public long SizeInBytes
+        {
+            get { return (long)Returns.Length * sizeof(double) + Assets.Count * AssetBytes; }
+        }
+
+        public int DateCount
+        {
+            get { return Dates.Length; }
+        }
+
+        public int FactorCount
+        {
+            get { return FactorIndex.Count; }
+        }
+
+        public int AssetCount
+        {
+            get { return Assets.Count; }
+        }
+
+        public bool Contains(string BarraId)
+        {
+            return Loaded.Contains(BarraId);
+        }
+
+        internal void Merge(FactorModel Extension, IEnumerable<string> BarraIds)
+        {
+            var assets = new Dictionary<string, Asset>(Assets, StringComparer.OrdinalIgnoreCase);
+            var loaded = new HashSet<string>(Loaded, StringComparer.OrdinalIgnoreCase);
+
+            foreach (var pair in Extension.Assets)
+            {
+                assets[pair.Key] = pair.Value;
+            }
+
+            loaded.UnionWith(BarraIds);
+
+            Assets = assets;
+            Loaded = loaded;
+        }
+
+        internal void SetFactorReturn(DateTime BusDate, string Factor, double Return)
+        {
+            int date, factor;
+
+            if (DateIndex.TryGetValue(BusDate.Date, out date) && FactorIndex.TryGetValue(Factor, out factor))
+            {
+                Returns[date * Stride + factor] = Return;
+            }
+        }
+
+        internal void SetLoading(string BarraId, DateTime BusDate, string Factor, double Loading)
+        {
+            int date, factor;
+
+            if (DateIndex.TryGetValue(BusDate.Date, out date) && FactorIndex.TryGetValue(Factor, out factor))
+            {
+                Asset asset = GetAsset(BarraId);
+                asset.Loadings[date * Stride + factor] = Loading;
+                asset.Exposed[date * Stride + factor] = true;
+            }
+        }
+
+        internal void ApplyOverride(string BarraId, string Factor, double Loading, DateTime StartDate, DateTime EndDate)
+        {
+            int factor;
+
+            if (!FactorIndex.TryGetValue(Factor, out factor))
+            {
+                return;
+            }
+
+            Asset asset = GetAsset(BarraId);
+
+            if (asset.RawLoadings == null)
+            {
+                asset.RawLoadings = (double[])asset.Loadings.Clone();
+                asset.RawExposed = (bool[])asset.Exposed.Clone();
+            }
+
+            for (int date = FirstDate(StartDate); date < Dates.Length && Dates[date] <= EndDate.Date; date++)
+            {
+                asset.Loadings[date * Stride + factor] = Loading;
+                asset.Exposed[date * Stride + factor] = true;
+            }
+        }
+
+        internal void SetSpecificReturn(string BarraId, DateTime BusDate, double Return)
+        {
+            int date;
+
+            if (DateIndex.TryGetValue(BusDate.Date, out date))
+            {
+                GetAsset(BarraId).SpecificReturns[date] = Return;
+            }
+        }
+
+        public List<RiskReturn> GetFactorGroupReturns(IEnumerable<string> BarraIds, IEnumerable<string> Factors, DateTime StartDate)
+        {
+            return Compute(BarraIds, Factors, StartDate, false, true);
+        }
+
+        public List<RiskReturn> GetFactorGroupPlusSpecificReturns(IEnumerable<string> BarraIds, IEnumerable<string> Factors, DateTime StartDate)
+        {
+            return Compute(BarraIds, Factors, StartDate, true, false);
+        }
+
+        public List<RiskReturn> GetTotalReturns(IEnumerable<string> BarraIds, DateTime StartDate)
+        {
+            return Compute(BarraIds, FactorIndex.Keys, StartDate, true, true);
+        }
+
+        public List<FactorReturn> GetPortfolioFactorGroupReturns(IDictionary<string, decimal> Weights, IEnumerable<string> Factors, DateTime StartDate)
+        {
+            List<FactorReturn> ReturnValue = new List<FactorReturn>();
+
+            double[] masked = MaskReturns(Factors);
+            int first = FirstDate(StartDate);
+            double[] totals = new double[Dates.Length];
+            Dictionary<string, Asset> assets = Assets;
+
+            foreach (var weight in Weights)
+            {
+                Asset asset;
+
+                if (!assets.TryGetValue(weight.Key, out asset))
+                {
+                    continue;
+                }
+
+                double w = (double)weight.Value;
+
+                for (int date = first; date < Dates.Length; date++)
+                {
+                    totals[date] += w * Dot(asset.Loadings, masked, date * Stride, Stride);
+                }
+            }
+
+            for (int date = first; date < Dates.Length; date++)
+            {
+                ReturnValue.Add(new FactorReturn
+                {
+                    Timestamp = Dates[date],
+                    Name = "Portfolio",
+                    Return = (decimal)totals[date]
+                });
+            }
+
+            return ReturnValue;
+        }
+
+        private List<RiskReturn> Compute(IEnumerable<string> BarraIds, IEnumerable<string> Factors, DateTime StartDate, bool IncludeSpecific, bool ApplyOverrides)
+        {
+            List<RiskReturn> ReturnValue = new List<RiskReturn>();
+
+            int[] factors = Factors.Where(FactorIndex.ContainsKey).Select(x => FactorIndex[x]).Distinct().ToArray();
+            double[] masked = MaskReturns(Factors);
+            int first = FirstDate(StartDate);
+            Dictionary<string, Asset> assets = Assets;
+
+            foreach (string barraId in BarraIds.Distinct(StringComparer.OrdinalIgnoreCase))
+            {
+                Asset asset;
+
+                if (!assets.TryGetValue(barraId, out asset))
+                {
+                    continue;
+                }
+
+                double[] loadings = ApplyOverrides || asset.RawLoadings == null ? asset.Loadings : asset.RawLoadings;
+                bool[] exposed = ApplyOverrides || asset.RawExposed == null ? asset.Exposed : asset.RawExposed;
+
+                for (int date = first; date < Dates.Length; date++)
+                {
+                    int offset = date * Stride;
+
+                    if (!factors.Any(f => exposed[offset + f]))
+                    {
+                        continue;
+                    }
+
+                    double total = Dot(loadings, masked, offset, Stride);
+
+                    if (IncludeSpecific && !double.IsNaN(asset.SpecificReturns[date]))
+                    {
+                        total += asset.SpecificReturns[date];
+                    }
+
+                    ReturnValue.Add(new RiskReturn
+                    {
+                        BusDate = Dates[date],
+                        BarraId = barraId,
+                        Return = (decimal)total
+                    });
+                }
+            }
+
+            return ReturnValue;
+        }
+
+        private double[] MaskReturns(IEnumerable<string> Factors)
+        {
+            double[] mask = new double[Stride];
+
+            foreach (string factor in Factors)
+            {
+                int index;
+
+                if (FactorIndex.TryGetValue(factor, out index))
+                {
+                    mask[index] = 1;
+                }
+            }
+
+            double[] ReturnValue = new double[Returns.Length];
+            int width = System.Numerics.Vector<double>.Count;
+
+            for (int offset = 0; offset < Returns.Length; offset += Stride)
+            {
+                for (int i = 0; i < Stride; i += width)
+                {
+                    (new System.Numerics.Vector<double>(Returns, offset + i) * new System.Numerics.Vector<double>(mask, i)).CopyTo(ReturnValue, offset + i);
+                }
+            }
+
+            return ReturnValue;
+        }
+
+        private static double Dot(double[] Left, double[] Right, int Offset, int Length)
+        {
+            int width = System.Numerics.Vector<double>.Count;
+            var sum = System.Numerics.Vector<double>.Zero;
+
+            for (int i = 0; i < Length; i += width)
+            {
+                sum += new System.Numerics.Vector<double>(Left, Offset + i) * new System.Numerics.Vector<double>(Right, Offset + i);
+            }
+
+            return System.Numerics.Vector.Dot(sum, System.Numerics.Vector<double>.One);
+        }
+
+        private int FirstDate(DateTime StartDate)
+        {
+            int index = Array.BinarySearch(Dates, StartDate.Date);
+
+            return index < 0 ? ~index : index;
+        }
+
+        private Asset GetAsset(string BarraId)
+        {
+            Asset asset;
+
+            if (!Assets.TryGetValue(BarraId, out asset))
+            {
+                asset = new Asset
+                {
+                    Loadings = new double[Returns.Length],
+                    Exposed = new bool[Returns.Length],
+                    SpecificReturns = Enumerable.Repeat(double.NaN, Dates.Length).ToArray()
+                };
+                Assets.Add(BarraId, asset);
+            }
+
+            return asset;
+        }
+    }
+
+    public sealed class HistoryCache<T>
+    {
+        private sealed class Series
+        {
+            public List<T> Rows = new List<T>();
+            public List<DateTime> Dates = new List<DateTime>();
+            public DateTime CoveredFrom;
+            public DateTime RefreshedAt;
+            public long LastAccess;
+        }
+
+        private readonly Dictionary<string, Series> Entries = new Dictionary<string, Series>(StringComparer.OrdinalIgnoreCase);
+        private readonly object Sync = new object();
+        private readonly Func<T, string> KeyOf;
+        private readonly Func<T, DateTime> DateOf;
+        private readonly int MaxSeries;
+        private readonly int MaxRows;
+        private readonly TimeSpan RefreshInterval;
+        private long Rows;
+        private long Hits;
+        private long Fetches;
+        private long Evictions;
+        private long Invalidations;
+
+        public HistoryCache(Func<T, string> KeyOf, Func<T, DateTime> DateOf, int MaxSeries, int MaxRows, TimeSpan RefreshInterval)
+        {
+            this.KeyOf = KeyOf;
+            this.DateOf = DateOf;
+            this.MaxSeries = MaxSeries;
+            this.MaxRows = MaxRows;
+            this.RefreshInterval = RefreshInterval;
+        }
+
+        public List<T> Get(IEnumerable<string> Keys, DateTime StartDate, Func<string[], DateTime, DateTime?, IEnumerable<T>> Fetch)
+        {
+            string[] keys = Keys.Distinct(StringComparer.OrdinalIgnoreCase).ToArray();
+            StartDate = StartDate.Date;
+
+            var missing = new List<string>();
+            var heads = new Dictionary<DateTime, List<string>>();
+            var tails = new Dictionary<DateTime, List<string>>();
+            DateTime now = DateTime.UtcNow;
+
+            lock (Sync)
+            {
+                foreach (string key in keys)
+                {
+                    Series series;
+
+                    if (!Entries.TryGetValue(key, out series))
+                    {
+                        missing.Add(key);
+                        continue;
+                    }
+
+                    if (series.CoveredFrom > StartDate)
+                    {
+                        Group(heads, series.CoveredFrom, key);
+                    }
+
+                    if (now - series.RefreshedAt > RefreshInterval)
+                    {
+                        Group(tails, series.Dates.Count == 0 ? series.CoveredFrom : series.Dates[series.Dates.Count - 1], key);
+                    }
+
+                    if (series.CoveredFrom <= StartDate && now - series.RefreshedAt <= RefreshInterval)
+                    {
+                        Hits++;
+                    }
+                }
+            }
+
+            if (missing.Count > 0)
+            {
+                Merge(missing, StartDate, null, Fetch(missing.ToArray(), StartDate, null).ToList(), now);
+            }
+
+            foreach (var head in heads)
+            {
+                Merge(head.Value, StartDate, head.Key, Fetch(head.Value.ToArray(), StartDate, head.Key).ToList(), now);
+            }
+
+            foreach (var tail in tails)
+            {
+                Merge(tail.Value, tail.Key, null, Fetch(tail.Value.ToArray(), tail.Key, null).ToList(), now);
+            }
+
+            var found = new Dictionary<string, List<T>>(StringComparer.OrdinalIgnoreCase);
+            var retry = new List<string>();
+
+            lock (Sync)
+            {
+                long access = Stopwatch.GetTimestamp();
+
+                foreach (string key in keys)
+                {
+                    Series series;
+
+                    if (Entries.TryGetValue(key, out series) && series.CoveredFrom <= StartDate)
+                    {
+                        series.LastAccess = access;
+                        found[key] = series.Rows.Skip(IndexOf(series.Dates, StartDate)).ToList();
+                    }
+                    else
+                    {
+                        retry.Add(key);
+                    }
+                }
+
+                Trim(keys);
+            }
+
+            if (retry.Count > 0)
+            {
+                List<T> fetched = Fetch(retry.ToArray(), StartDate, null).ToList();
+                Merge(retry, StartDate, null, fetched, now);
+
+                foreach (var group in fetched.GroupBy(KeyOf, StringComparer.OrdinalIgnoreCase))
+                {
+                    found[group.Key] = group.OrderBy(DateOf).ToList();
+                }
+            }
+
+            List<T> ReturnValue = new List<T>();
+
+            foreach (string key in keys)
+            {
+                List<T> rows;
+
+                if (found.TryGetValue(key, out rows))
+                {
+                    ReturnValue.AddRange(rows);
+                }
+            }
+
+            return ReturnValue;
+        }
+
+        public void Invalidate(string Key)
+        {
+            lock (Sync)
+            {
+                Series series;
+
+                if (Entries.TryGetValue(Key, out series))
+                {
+                    Rows -= series.Rows.Count;
+                    Entries.Remove(Key);
+                    Invalidations++;
+                }
+            }
+        }
+
+        public void InvalidateAll()
+        {
+            lock (Sync)
+            {
+                Invalidations += Entries.Count;
+                Entries.Clear();
+                Rows = 0;
+            }
+        }
+
+        public ReferenceDataCacheStatistics GetStatistics()
+        {
+            lock (Sync)
+            {
+                return new ReferenceDataCacheStatistics
+                {
+                    Hits = Hits,
+                    Misses = Interlocked.Read(ref Fetches),
+                    Evictions = Evictions,
+                    Invalidations = Invalidations,
+                    Entries = Entries.Count,
+                    Items = Rows,
+                    Keys = new List<ReferenceDataCacheCounter>()
+                };
+            }
+        }
+
+        private void Merge(List<string> Keys, DateTime From, DateTime? Before, List<T> Fetched, DateTime RefreshedAt)
+        {
+            Interlocked.Increment(ref Fetches);
+
+            var byKey = Fetched
+                .Where(x => DateOf(x) >= From && (!Before.HasValue || DateOf(x) < Before.Value))
+                .GroupBy(KeyOf, StringComparer.OrdinalIgnoreCase)
+                .ToDictionary(g => g.Key, g => g.OrderBy(DateOf).ToList(), StringComparer.OrdinalIgnoreCase);
+
+            lock (Sync)
+            {
+                foreach (string key in Keys)
+                {
+                    Series series;
+                    List<T> rows;
+
+                    if (!byKey.TryGetValue(key, out rows))
+                    {
+                        rows = new List<T>();
+                    }
+
+                    if (!Entries.TryGetValue(key, out series))
+                    {
+                        if (Before.HasValue)
+                        {
+                            continue;
+                        }
+
+                        series = new Series { CoveredFrom = From, RefreshedAt = RefreshedAt };
+                        Entries.Add(key, series);
+                    }
+                    else if (Before.HasValue && series.CoveredFrom > Before.Value)
+                    {
+                        continue;
+                    }
+
+                    int first = IndexOf(series.Dates, From);
+                    int last = Before.HasValue ? IndexOf(series.Dates, Before.Value) : series.Dates.Count;
+
+                    series.Rows.RemoveRange(first, last - first);
+                    series.Dates.RemoveRange(first, last - first);
+                    series.Rows.InsertRange(first, rows);
+                    series.Dates.InsertRange(first, rows.Select(DateOf));
+                    Rows += rows.Count - (last - first);
+
+                    if (From < series.CoveredFrom)
+                    {
+                        series.CoveredFrom = From;
+                    }
+
+                    if (!Before.HasValue)
+                    {
+                        series.RefreshedAt = RefreshedAt;
+                    }
+                }
+            }
+        }
+
+        private void Trim(string[] Keep)
+        {
+            if (Entries.Count <= MaxSeries && Rows <= MaxRows)
+            {
+                return;
+            }
+
+            var keep = new HashSet<string>(Keep, StringComparer.OrdinalIgnoreCase);
+
+            foreach (var pair in Entries.Where(e => !keep.Contains(e.Key)).OrderBy(e => e.Value.LastAccess).ToList())
+            {
+                if (Entries.Count <= MaxSeries && Rows <= MaxRows)
+                {
+                    break;
+                }
+
+                Entries.Remove(pair.Key);
+                Rows -= pair.Value.Rows.Count;
+                Evictions++;
+            }
+        }
+
+        private static int IndexOf(List<DateTime> Dates, DateTime Date)
+        {
+            int index = Dates.BinarySearch(Date);
+
+            return index < 0 ? ~index : LowerBound(Dates, index);
+        }
+
+        private static int LowerBound(List<DateTime> Dates, int Index)
+        {
+            while (Index > 0 && Dates[Index - 1] == Dates[Index])
+            {
+                Index--;
+            }
+
+            return Index;
+        }
+
+        private static void Group(Dictionary<DateTime, List<string>> Groups, DateTime Date, string Key)
+        {
+            List<string> keys;
+
+            if (!Groups.TryGetValue(Date, out keys))
+            {
+                keys = new List<string>();
+                Groups.Add(Date, keys);
+            }
+
+            keys.Add(Key);
+        }
+    }
+
+    public sealed class BarraSnapshot : IDisposable
+    {
+        private const string Magic = "BARRASN1";
+        private const int Version = 2;
+        private const int HeaderSize = 128;
+        private const int ReturnCellSize = 17;
+        private const int LoadingRowSize = 22;
+        private const int SpecificRowSize = 20;
+
+        private sealed class AssetBlock
+        {
+            public long LoadingStart;
+            public long LoadingCount;
+            public long SpecificStart;
+            public long SpecificCount;
+        }
+
+        private readonly MemoryMappedFile Mapping;
+        private readonly MemoryMappedViewAccessor Accessor;
+        private readonly DateTime[] Dates;
+        private readonly string[] Factors;
+        private readonly Dictionary<string, int> FactorIndex;
+        private readonly Dictionary<string, AssetBlock> Assets;
+        private readonly long ReturnsOffset;
+        private readonly long LoadingRowsOffset;
+        private readonly long SpecificRowsOffset;
+        private int References = 1;
+        private int Disposed;
+
+        private BarraSnapshot(string FileName)
+        {
+            this.FileName = FileName;
+            LastWriteTimeUtc = File.GetLastWriteTimeUtc(FileName);
+            Mapping = MemoryMappedFile.CreateFromFile(FileName, FileMode.Open, null, 0, MemoryMappedFileAccess.Read);
+            Accessor = Mapping.CreateViewAccessor(0, 0, MemoryMappedFileAccess.Read);
+
+            using (var stream = Mapping.CreateViewStream(0, 0, MemoryMappedFileAccess.Read))
+            using (var reader = new BinaryReader(stream, System.Text.Encoding.UTF8))
+            {
+                if (new string(reader.ReadChars(Magic.Length)) != Magic || reader.ReadInt32() != Version)
+                {
+                    throw new InvalidDataException($"{FileName} is not a Barra snapshot");
+                }
+
+                CreatedUtc = new DateTime(reader.ReadInt64(), DateTimeKind.Utc);
+                long datesOffset = reader.ReadInt64();
+                long factorsOffset = reader.ReadInt64();
+                long assetsOffset = reader.ReadInt64();
+                ReturnsOffset = reader.ReadInt64();
+                LoadingRowsOffset = reader.ReadInt64();
+                SpecificRowsOffset = reader.ReadInt64();
+
+                stream.Position = datesOffset;
+                Dates = new DateTime[reader.ReadInt32()];
+
+                for (int i = 0; i < Dates.Length; i++)
+                {
+                    Dates[i] = new DateTime(reader.ReadInt64());
+                }
+
+                stream.Position = factorsOffset;
+                Factors = new string[reader.ReadInt32()];
+
+                for (int i = 0; i < Factors.Length; i++)
+                {
+                    Factors[i] = reader.ReadString();
+                }
+
+                FactorIndex = Factors.Select((f, i) => new KeyValuePair<string, int>(f, i)).ToDictionary(x => x.Key, x => x.Value);
+
+                stream.Position = assetsOffset;
+                int assetCount = reader.ReadInt32();
+                Assets = new Dictionary<string, AssetBlock>(assetCount, StringComparer.OrdinalIgnoreCase);
+
+                for (int i = 0; i < assetCount; i++)
+                {
+                    Assets.Add(reader.ReadString(), new AssetBlock
+                    {
+                        LoadingStart = reader.ReadInt64(),
+                        LoadingCount = reader.ReadInt64(),
+                        SpecificStart = reader.ReadInt64(),
+                        SpecificCount = reader.ReadInt64()
+                    });
+                }
+            }
+        }
+
+        public string FileName { get; }
+        public DateTime LastWriteTimeUtc { get; }
+        public DateTime CreatedUtc { get; }
+
+        public DateTime FirstDate
+        {
+            get { return Dates.Length == 0 ? DateTime.MaxValue : Dates[0]; }
+        }
+
+        public DateTime LastDate
+        {
+            get { return Dates.Length == 0 ? DateTime.MinValue : Dates[Dates.Length - 1]; }
+        }
+
+        public static BarraSnapshot Open(string FileName)
+        {
+            return new BarraSnapshot(FileName);
+        }
+
+        public bool Covers(DateTime StartDate)
+        {
+            return Dates.Length > 0 && StartDate.Date >= FirstDate;
+        }
+
+        public bool Contains(string BarraId)
+        {
+            return Assets.ContainsKey(BarraId);
+        }
+
+        public List<FactorReturn> GetFactorReturnsHistory(DateTime StartDate)
+        {
+            List<FactorReturn> ReturnValue = new List<FactorReturn>();
+
+            for (int date = DateIndex(StartDate); date < Dates.Length; date++)
+            {
+                for (int factor = 0; factor < Factors.Length; factor++)
+                {
+                    long position = ReturnsOffset + ((long)date * Factors.Length + factor) * ReturnCellSize;
+
+                    if (Accessor.ReadByte(position) != 0)
+                    {
+                        ReturnValue.Add(new FactorReturn
+                        {
+                            Timestamp = Dates[date],
+                            Name = Factors[factor],
+                            Return = Accessor.ReadDecimal(position + 1)
+                        });
+                    }
+                }
+            }
+
+            return ReturnValue;
+        }
+
+        public List<FactorLoading> GetFactorLoadingsHistory(IEnumerable<string> FactorNames, IEnumerable<string> BarraIds, DateTime StartDate)
+        {
+            List<FactorLoading> ReturnValue = new List<FactorLoading>();
+
+            var factors = new HashSet<int>(FactorNames.Where(FactorIndex.ContainsKey).Select(x => FactorIndex[x]));
+            int first = DateIndex(StartDate);
+
+            foreach (string barraId in BarraIds.Distinct(StringComparer.OrdinalIgnoreCase))
+            {
+                AssetBlock asset;
+
+                if (!Assets.TryGetValue(barraId, out asset))
+                {
+                    continue;
+                }
+
+                long end = asset.LoadingStart + asset.LoadingCount;
+
+                for (long row = LowerBound(LoadingRowsOffset, LoadingRowSize, asset.LoadingStart, end, first); row < end; row++)
+                {
+                    long position = LoadingRowsOffset + row * LoadingRowSize;
+                    int factor = Accessor.ReadInt16(position + 4);
+
+                    if (factors.Contains(factor))
+                    {
+                        ReturnValue.Add(new FactorLoading
+                        {
+                            BusDate = Dates[Accessor.ReadInt32(position)],
+                            BarraId = barraId,
+                            FactorName = Factors[factor],
+                            Loading = Accessor.ReadDecimal(position + 6)
+                        });
+                    }
+                }
+            }
+
+            return ReturnValue;
+        }
+
+        public List<RiskReturn> GetSpecificReturnHistory(IEnumerable<string> BarraIds, DateTime StartDate)
+        {
+            List<RiskReturn> ReturnValue = new List<RiskReturn>();
+
+            int first = DateIndex(StartDate);
+
+            foreach (string barraId in BarraIds.Distinct(StringComparer.OrdinalIgnoreCase))
+            {
+                AssetBlock asset;
+
+                if (!Assets.TryGetValue(barraId, out asset))
+                {
+                    continue;
+                }
+
+                long end = asset.SpecificStart + asset.SpecificCount;
+
+                for (long row = LowerBound(SpecificRowsOffset, SpecificRowSize, asset.SpecificStart, end, first); row < end; row++)
+                {
+                    long position = SpecificRowsOffset + row * SpecificRowSize;
+
+                    ReturnValue.Add(new RiskReturn
+                    {
+                        BusDate = Dates[Accessor.ReadInt32(position)],
+                        BarraId = barraId,
+                        Return = Accessor.ReadDecimal(position + 4)
+                    });
+                }
+            }
+
+            return ReturnValue;
+        }
+
+        public bool Acquire()
+        {
+            int current;
+
+            do
+            {
+                current = Volatile.Read(ref References);
+
+                if (current == 0)
+                {
+                    return false;
+                }
+            }
+            while (Interlocked.CompareExchange(ref References, current + 1, current) != current);
+
+            return true;
+        }
+
+        public void Release()
+        {
+            if (Interlocked.Decrement(ref References) == 0)
+            {
+                Accessor.Dispose();
+                Mapping.Dispose();
+            }
+        }
+
+        public void Dispose()
+        {
+            if (Interlocked.Exchange(ref Disposed, 1) == 0)
+            {
+                Release();
+            }
+        }
+
+        private int DateIndex(DateTime StartDate)
+        {
+            int index = Array.BinarySearch(Dates, StartDate.Date);
+
+            return index < 0 ? ~index : index;
+        }
+
+        private long LowerBound(long Offset, int RowSize, long Start, long End, int Date)
+        {
+            while (Start < End)
+            {
+                long middle = Start + (End - Start) / 2;
+
+                if (Accessor.ReadInt32(Offset + middle * RowSize) < Date)
+                {
+                    Start = middle + 1;
+                }
+                else
+                {
+                    End = middle;
+                }
+            }
+
+            return Start;
+        }
+
+        public static void Write(string FileName, IEnumerable<dynamic> FactorReturns, IEnumerable<dynamic> Loadings, IEnumerable<dynamic> SpecificReturns)
+        {
+            string temp = FileName + ".tmp";
+
+            var returns = FactorReturns.Select(row => new { Date = (DateTime)Convert.ToDateTime(row.date).Date, Factor = (string)row.factor, Value = (decimal)Convert.ToDecimal(row.dlyreturn) }).ToList();
+            DateTime[] dates = returns.Select(x => x.Date).Distinct().OrderBy(x => x).ToArray();
+            string[] factors = returns.Select(x => x.Factor).Distinct().OrderBy(x => x, StringComparer.Ordinal).ToArray();
+            var dateIndex = dates.Select((d, i) => new KeyValuePair<DateTime, int>(d, i)).ToDictionary(x => x.Key, x => x.Value);
+            var factorIndex = factors.Select((f, i) => new KeyValuePair<string, int>(f, i)).ToDictionary(x => x.Key, x => x.Value);
+            var assets = new Dictionary<string, AssetBlock>(StringComparer.OrdinalIgnoreCase);
+            var assetOrder = new List<string>();
+
+            using (var stream = new FileStream(temp, FileMode.Create, FileAccess.Write, FileShare.None, 1 << 20))
+            using (var writer = new BinaryWriter(stream, System.Text.Encoding.UTF8))
+            {
+                writer.Write(new byte[HeaderSize]);
+
+                long datesOffset = stream.Position;
+                writer.Write(dates.Length);
+
+                foreach (DateTime date in dates)
+                {
+                    writer.Write(date.Ticks);
+                }
+
+                long factorsOffset = stream.Position;
+                writer.Write(factors.Length);
+
+                foreach (string factor in factors)
+                {
+                    writer.Write(factor);
+                }
+
+                // Values are stored as decimals, as read from Postgres, so the snapshot and the SQL fallback return
+                // identical numbers; each return cell carries a presence byte in front of its value.
+                decimal?[] matrix = new decimal?[dates.Length * factors.Length];
+
+                foreach (var row in returns)
+                {
+                    matrix[dateIndex[row.Date] * factors.Length + factorIndex[row.Factor]] = row.Value;
+                }
+
+                long returnsOffset = stream.Position;
+
+                foreach (decimal? value in matrix)
+                {
+                    writer.Write(value.HasValue);
+                    writer.Write(value ?? 0m);
+                }
+
+                long loadingRowsOffset = stream.Position;
+                long rowCount = 0;
+
+                foreach (dynamic row in Loadings)
+                {
+                    int date, factor;
+
+                    if (row.loading is System.DBNull || !dateIndex.TryGetValue((DateTime)Convert.ToDateTime(row.date).Date, out date)
+                        || !factorIndex.TryGetValue((string)row.factor, out factor))
+                    {
+                        continue;
+                    }
+
+                    AssetBlock asset = GetAssetBlock(assets, assetOrder, (string)row.barraid);
+
+                    if (asset.LoadingCount == 0)
+                    {
+                        asset.LoadingStart = rowCount;
+                    }
+
+                    writer.Write(date);
+                    writer.Write((short)factor);
+                    writer.Write((decimal)Convert.ToDecimal(row.loading));
+                    asset.LoadingCount++;
+                    rowCount++;
+                }
+
+                long specificRowsOffset = stream.Position;
+                rowCount = 0;
+
+                foreach (dynamic row in SpecificReturns)
+                {
+                    int date;
+
+                    if (row.specific_return is System.DBNull || !dateIndex.TryGetValue((DateTime)Convert.ToDateTime(row.date).Date, out date))
+                    {
+                        continue;
+                    }
+
+                    AssetBlock asset = GetAssetBlock(assets, assetOrder, (string)row.barraid);
+
+                    if (asset.SpecificCount == 0)
+                    {
+                        asset.SpecificStart = rowCount;
+                    }
+
+                    writer.Write(date);
+                    writer.Write((decimal)Convert.ToDecimal(row.specific_return));
+                    asset.SpecificCount++;
+                    rowCount++;
+                }
+
+                long assetsOffset = stream.Position;
+                writer.Write(assetOrder.Count);
+
+                foreach (string barraId in assetOrder)
+                {
+                    AssetBlock asset = assets[barraId];
+                    writer.Write(barraId);
+                    writer.Write(asset.LoadingStart);
+                    writer.Write(asset.LoadingCount);
+                    writer.Write(asset.SpecificStart);
+                    writer.Write(asset.SpecificCount);
+                }
+
+                stream.Position = 0;
+                writer.Write(Magic.ToCharArray());
+                writer.Write(Version);
+                writer.Write(DateTime.UtcNow.Ticks);
+                writer.Write(datesOffset);
+                writer.Write(factorsOffset);
+                writer.Write(assetsOffset);
+                writer.Write(returnsOffset);
+                writer.Write(loadingRowsOffset);
+                writer.Write(specificRowsOffset);
+            }
+
+            File.Move(temp, FileName);
+        }
+
+        private static AssetBlock GetAssetBlock(Dictionary<string, AssetBlock> Assets, List<string> Order, string BarraId)
+        {
+            AssetBlock asset;
+
+            if (!Assets.TryGetValue(BarraId, out asset))
+            {
+                asset = new AssetBlock();
+                Assets.Add(BarraId, asset);
+                Order.Add(BarraId);
+            }
+
+            return asset;
+        }
+    }
+
+    public class SnapshotDelta<T>
+    {
+        public string Epoch { get; set; }
+        public long Version { get; set; }
+        public bool IsFull { get; set; }
+        public Dictionary<string, T> Upserts { get; set; }
+        public List<string> Removed { get; set; }
+    }
+
+    public sealed class VersionedSnapshot<T> where T : class
+    {
+        private sealed class Change
+        {
+            public long Version;
+            public string Key;
+            public T Row;
+        }
+
+        private static readonly PropertyInfo[] Properties = typeof(T).GetProperties(BindingFlags.Public | BindingFlags.Instance)
+            .Where(p => p.CanRead && p.GetIndexParameters().Length == 0)
+            .ToArray();
+
+        private static Logger Logger = LogManager.GetCurrentClassLogger();
+
+        private readonly object SyncRoot = new object();
+        private readonly Func<T, string> KeyOf;
+        private readonly int MaxChanges;
+        private readonly Queue<Change> Changes = new Queue<Change>();
+
+        private Dictionary<string, T> Rows = new Dictionary<string, T>();
+        private List<T> Ordered = new List<T>();
+        private long OldestVersion;
+
+        public VersionedSnapshot(Func<T, string> KeyOf, int MaxChanges)
+        {
+            this.KeyOf = KeyOf;
+            this.MaxChanges = MaxChanges;
+        }
+
+        public string Epoch { get; } = Guid.NewGuid().ToString("N");
+
+        public long Version { get; private set; }
+
+        public long Apply(IEnumerable<T> Source)
+        {
+            var rows = new Dictionary<string, T>();
+            var ordered = Source.ToList();
+            var duplicates = new HashSet<string>(ordered.GroupBy(KeyOf).Where(g => g.Count() > 1).Select(g => g.Key));
+
+            if (duplicates.Count > 0)
+            {
+                Logger.Warn($"{typeof(T).Name} snapshot has {duplicates.Count} keys shared by several rows; those rows are keyed by content");
+            }
+
+            foreach (T row in ordered)
+            {
+                string key = KeyOf(row);
+
+                // Rows sharing a key are told apart by their content rather than their arrival order, so a reordered
+                // refresh does not show them as changed. Only fully identical rows fall back to a counter.
+                if (duplicates.Contains(key))
+                {
+                    key += "#" + Fingerprint(row);
+
+                    for (int i = 1; rows.ContainsKey(key); i++)
+                    {
+                        key = KeyOf(row) + "#" + Fingerprint(row) + "#" + i;
+                    }
+                }
+
+                rows.Add(key, row);
+            }
+
+            lock (SyncRoot)
+            {
+                long version = Version + 1;
+                var changes = new List<Change>();
+
+                foreach (var pair in rows)
+                {
+                    T current;
+
+                    if (!Rows.TryGetValue(pair.Key, out current) || !Same(current, pair.Value))
+                    {
+                        changes.Add(new Change { Version = version, Key = pair.Key, Row = pair.Value });
+                    }
+                }
+
+                foreach (string key in Rows.Keys)
+                {
+                    if (!rows.ContainsKey(key))
+                    {
+                        changes.Add(new Change { Version = version, Key = key, Row = null });
+                    }
+                }
+
+                if (Version == 0)
+                {
+                    OldestVersion = version;
+                }
+                else if (changes.Count == 0)
+                {
+                    return Version;
+                }
+                else
+                {
+                    foreach (Change change in changes)
+                    {
+                        Changes.Enqueue(change);
+                    }
+
+                    while (Changes.Count > MaxChanges)
+                    {
+                        OldestVersion = Changes.Dequeue().Version;
+                    }
+                }
+
+                Rows = rows;
+                Ordered = ordered;
+                Version = version;
+
+                return Version;
+            }
+        }
+
+        public List<T> GetRows()
+        {
+            lock (SyncRoot)
+            {
+                return new List<T>(Ordered);
+            }
+        }
+
+        public SnapshotDelta<T> GetChanges(string Epoch, long SinceVersion)
+        {
+            lock (SyncRoot)
+            {
+                if (Epoch != this.Epoch || SinceVersion <= 0 || SinceVersion < OldestVersion || SinceVersion > Version)
+                {
+                    return new SnapshotDelta<T>
+                    {
+                        Epoch = this.Epoch,
+                        Version = Version,
+                        IsFull = true,
+                        Upserts = new Dictionary<string, T>(Rows),
+                        Removed = new List<string>()
+                    };
+                }
+
+                var latest = new Dictionary<string, T>();
+
+                foreach (Change change in Changes)
+                {
+                    if (change.Version > SinceVersion)
+                    {
+                        latest[change.Key] = change.Row;
+                    }
+                }
+
+                return new SnapshotDelta<T>
+                {
+                    Epoch = this.Epoch,
+                    Version = Version,
+                    IsFull = false,
+                    Upserts = latest.Where(x => x.Value != null).ToDictionary(x => x.Key, x => x.Value),
+                    Removed = latest.Where(x => x.Value == null).Select(x => x.Key).ToList()
+                };
+            }
+        }
+
+        private static string Fingerprint(T Row)
+        {
+            var ReturnValue = new System.Text.StringBuilder();
+
+            foreach (PropertyInfo property in Properties)
+            {
+                object value = property.GetValue(Row);
+
+                if (value is System.Collections.IEnumerable && !(value is string))
+                {
+                    value = string.Join(",", ((System.Collections.IEnumerable)value).Cast<object>()
+                        .Select(x => Convert.ToString(x, CultureInfo.InvariantCulture)));
+                }
+
+                ReturnValue.Append(Convert.ToString(value, CultureInfo.InvariantCulture)).Append('\u001f');
+            }
+
+            return ReturnValue.ToString();
+        }
+
+        private static bool Same(T Left, T Right)
+        {
+            foreach (PropertyInfo property in Properties)
+            {
+                object left = property.GetValue(Left);
+                object right = property.GetValue(Right);
+
+                if (left is System.Collections.IEnumerable && right is System.Collections.IEnumerable && !(left is string))
+                {
+                    if (!((System.Collections.IEnumerable)left).Cast<object>().SequenceEqual(((System.Collections.IEnumerable)right).Cast<object>()))
+                    {
+                        return false;
+                    }
+                }
+                else if (!Equals(left, right))
+                {
+                    return false;
+                }
+            }
+
+            return true;
+        }
+    }
+
+    public sealed class SingleFlight
+    {
+        private sealed class Flight
+        {
+            public Flight(Func<Flight, Task<object>> Start)
+            {
+                Value = new Lazy<Task<object>>(() => Start(this), LazyThreadSafetyMode.ExecutionAndPublication);
+            }
+
+            public Lazy<Task<object>> Value { get; }
+            public DateTime? CompletedAt { get; set; }
+        }
+
+        private readonly ConcurrentDictionary<string, Flight> Flights = new ConcurrentDictionary<string, Flight>();
+
+        private long Executions;
+        private long Coalesced;
+
+        public long ExecutionCount
+        {
+            get { return Interlocked.Read(ref Executions); }
+        }
+
+        public long CoalescedCount
+        {
+            get { return Interlocked.Read(ref Coalesced); }
+        }
+
+        // The shared load ignores individual callers' deadlines; each caller only waits as long as its own token and
+        // ambient QueryDeadline allow, and an abandoned wait leaves the load running for the remaining callers.
+        public T Run<T>(string Key, TimeSpan ReuseWindow, Func<T> Load, CancellationToken cancellationToken = default) where T : class
+        {
+            Flight created = null;
+            Flight flight = Flights.AddOrUpdate(Key,
+                k => created = NewFlight(Key, ReuseWindow, Load),
+                (k, existing) => existing.CompletedAt.HasValue && DateTime.UtcNow - existing.CompletedAt.Value > ReuseWindow
+                    ? created = NewFlight(Key, ReuseWindow, Load)
+                    : existing);
+
+            if (flight != created)
+            {
+                Interlocked.Increment(ref Coalesced);
+            }
+
+            Task<object> task = flight.Value.Value;
+
+            if (!task.IsCompleted)
+            {
+                QueryDeadline deadline = QueryDeadline.Current;
+
+                using (var linked = deadline == null ? null : CancellationTokenSource.CreateLinkedTokenSource(cancellationToken, deadline.Token))
+                {
+                    try
+                    {
+                        task.Wait(linked?.Token ?? cancellationToken);
+                    }
+                    catch (AggregateException)
+                    {
+                        // Rethrown unwrapped below.
+                    }
+                }
+            }
+
+            return (T)task.GetAwaiter().GetResult();
+        }
+
+        public static string Key(string Procedure, IEnumerable<DbParameter> Parameters)
+        {
+            var ReturnValue = new System.Text.StringBuilder(Procedure);
+
+            if (Parameters != null)
+            {
+                foreach (DbParameter param in Parameters)
+                {
+                    ReturnValue.Append('|').Append(param.ParameterName).Append('=');
+
+                    if (param.Value is DateTime)
+                    {
+                        ReturnValue.Append(((DateTime)param.Value).ToString("o", CultureInfo.InvariantCulture));
+                    }
+                    else
+                    {
+                        ReturnValue.Append(Convert.ToString(param.Value, CultureInfo.InvariantCulture));
+                    }
+                }
+            }
+
+            return ReturnValue.ToString();
+        }
+
+        private Flight NewFlight<T>(string Key, TimeSpan ReuseWindow, Func<T> Load)
+        {
+            return new Flight(flight =>
+            {
+                Task<object> ReturnValue = Task.Run(() =>
+                {
+                    Interlocked.Increment(ref Executions);
+
+                    using (QueryDeadline.Suspend())
+                    {
+                        return (object)Load();
+                    }
+                });
+
+                ReturnValue.ContinueWith(t =>
+                {
+                    flight.CompletedAt = DateTime.UtcNow;
+
+                    if (t.IsFaulted || ReuseWindow <= TimeSpan.Zero)
+                    {
+                        Flights.TryRemove(new KeyValuePair<string, Flight>(Key, flight));
+                    }
+                }, TaskContinuationOptions.ExecuteSynchronously);
+
+                return ReturnValue;
+            });
+        }
+    }
+
+    public sealed class ReplicaRouter
+    {
+        private sealed class Replica
+        {
+            public Replica(string ConnectionString)
+            {
+                this.ConnectionString = ConnectionString;
+            }
+
+            public string ConnectionString { get; }
+            public double LatencyMilliseconds { get; set; }
+            public int Failures { get; set; }
+            public DateTime DownUntil { get; set; }
+        }
+
+        private sealed class SessionRestore : IDisposable
+        {
+            private readonly string Previous;
+
+            public SessionRestore(string Previous)
+            {
+                this.Previous = Previous;
+            }
+
+            public void Dispose()
+            {
+                Session.Value = Previous;
+            }
+        }
+
+        private const int MaxTrackedWriters = 10000;
+
+        private static readonly AsyncLocal<string> Session = new AsyncLocal<string>();
+        private static readonly ThreadLocal<Random> Randoms = new ThreadLocal<Random>(() => new Random(Guid.NewGuid().GetHashCode()));
+
+        private readonly ConcurrentDictionary<string, Replica[]> Pools = new ConcurrentDictionary<string, Replica[]>();
+        private readonly ConcurrentDictionary<string, Replica> ByConnectionString = new ConcurrentDictionary<string, Replica>();
+        private readonly ConcurrentDictionary<string, DateTime> LastWrites = new ConcurrentDictionary<string, DateTime>();
+
+        public TimeSpan StickinessWindow { get; set; } = TimeSpan.FromSeconds(10);
+        public TimeSpan DownTime { get; set; } = TimeSpan.FromSeconds(30);
+
+        public void Configure(string PrimaryConnectionString, IEnumerable<string> ReplicaConnectionStrings)
+        {
+            Replica[] pool = (ReplicaConnectionStrings ?? Enumerable.Empty<string>())
+                .Where(x => !string.IsNullOrWhiteSpace(x))
+                .Select(x => new Replica(new SqlConnectionStringBuilder(x) { ApplicationIntent = ApplicationIntent.ReadOnly }.ConnectionString))
+                .ToArray();
+
+            foreach (Replica replica in pool)
+            {
+                ByConnectionString[replica.ConnectionString] = replica;
+            }
+
+            Pools[PrimaryConnectionString] = pool;
+        }
+
+        // Opt-in read-your-writes: request middleware wraps each request in ForSession (e.g. with the username), and
+        // reads in that session go to the primary for StickinessWindow after one of its writes. Writes made outside a
+        // session are not tracked, so they never pin other users' reads to the primary.
+        public static IDisposable ForSession(string SessionKey)
+        {
+            var ReturnValue = new SessionRestore(Session.Value);
+            Session.Value = SessionKey;
+
+            return ReturnValue;
+        }
+
+        public string Route(string DatabaseConnectionString, bool ReadOnly)
+        {
+            Replica[] pool;
+
+            if (!Pools.TryGetValue(DatabaseConnectionString, out pool) || pool.Length == 0)
+            {
+                return DatabaseConnectionString;
+            }
+
+            string session = Session.Value;
+            string writer = DatabaseConnectionString + "|" + session;
+            DateTime now = DateTime.UtcNow;
+            DateTime lastWrite;
+
+            if (!ReadOnly)
+            {
+                if (string.IsNullOrEmpty(session))
+                {
+                    return DatabaseConnectionString;
+                }
+
+                if (LastWrites.Count > MaxTrackedWriters)
+                {
+                    foreach (var pair in LastWrites)
+                    {
+                        if (now - pair.Value > StickinessWindow)
+                        {
+                            LastWrites.TryRemove(pair.Key, out lastWrite);
+                        }
+                    }
+                }
+
+                LastWrites[writer] = now;
+
+                return DatabaseConnectionString;
+            }
+
+            if (!string.IsNullOrEmpty(session) && LastWrites.TryGetValue(writer, out lastWrite) && now - lastWrite < StickinessWindow)
+            {
+                return DatabaseConnectionString;
+            }
+
+            List<Replica> healthy = pool.Where(x => x.DownUntil <= now).ToList();
+
+            if (healthy.Count == 0)
+            {
+                return DatabaseConnectionString;
+            }
+
+            if (healthy.Count == 1)
+            {
+                return healthy[0].ConnectionString;
+            }
+
+            // Power of two choices: two distinct replicas picked at random, the faster one wins. Random pairs keep every
+            // replica's latency sample fresh instead of always favouring the same neighbour.
+            Random random = Randoms.Value;
+            int first = random.Next(healthy.Count);
+            int second = random.Next(healthy.Count - 1);
+
+            if (second >= first)
+            {
+                second++;
+            }
+
+            return (healthy[first].LatencyMilliseconds <= healthy[second].LatencyMilliseconds ? healthy[first] : healthy[second]).ConnectionString;
+        }
+
+        public void ReportSuccess(string ConnectionString, TimeSpan Elapsed)
+        {
+            Replica replica;
+
+            if (ByConnectionString.TryGetValue(ConnectionString, out replica))
+            {
+                double elapsed = Elapsed.TotalMilliseconds;
+
+                replica.LatencyMilliseconds = replica.LatencyMilliseconds == 0 ? elapsed : replica.LatencyMilliseconds * 0.8 + elapsed * 0.2;
+                replica.Failures = 0;
+            }
+        }
+
+        public void ReportFailure(string ConnectionString)
+        {
+            Replica replica;
+
+            if (ByConnectionString.TryGetValue(ConnectionString, out replica))
+            {
+                replica.Failures++;
+                replica.DownUntil = DateTime.UtcNow + TimeSpan.FromTicks(DownTime.Ticks * Math.Min(replica.Failures, 4));
+            }
+        }
+    }
+
+    public sealed class IntradayTimeSeriesStore
+    {
+        private sealed class Series
+        {
+            public Series(string Desk, string Symbol)
+            {
+                this.Desk = Desk;
+                this.Symbol = Symbol;
+            }
+
+            public string Desk { get; }
+            public string Symbol { get; }
+            public int Count { get; set; }
+            public int[] Timestamps = new int[16];
+            public decimal[] DTD = new decimal[16];
+            public decimal[] IdioPnl = new decimal[16];
+
+            public void Add(int Timestamp, decimal Dtd, decimal Idio)
+            {
+                if (Count == Timestamps.Length)
+                {
+                    Array.Resize(ref Timestamps, Count * 2);
+                    Array.Resize(ref DTD, Count * 2);
+                    Array.Resize(ref IdioPnl, Count * 2);
+                }
+
+                Timestamps[Count] = Timestamp;
+                DTD[Count] = Dtd;
+                IdioPnl[Count] = Idio;
+                Count++;
+            }
+        }
+
+        private readonly object SyncRoot = new object();
+        private readonly List<DateTime> Timestamps = new List<DateTime>();
+        private readonly Dictionary<string, Series> SeriesByKey = new Dictionary<string, Series>(StringComparer.OrdinalIgnoreCase);
+        private readonly Dictionary<string, List<Series>> SeriesBySymbol = new Dictionary<string, List<Series>>(StringComparer.OrdinalIgnoreCase);
+
+        public DateTime? LastTimestamp
+        {
+            get
+            {
+                lock (SyncRoot)
+                {
+                    return Timestamps.Count == 0 ? (DateTime?)null : Timestamps[Timestamps.Count - 1];
+                }
+            }
+        }
+
+        public int SeriesCount
+        {
+            get
+            {
+                lock (SyncRoot)
+                {
+                    return SeriesByKey.Count;
+                }
+            }
+        }
+
+        public void Ingest(IEnumerable<Position> Rows)
+        {
+            lock (SyncRoot)
+            {
+                foreach (var snapshot in Rows.GroupBy(x => Convert.ToDateTime(x.PortfolioTimestamp)).OrderBy(x => x.Key))
+                {
+                    DateTime timestamp = snapshot.Key;
+                    int last = Timestamps.Count - 1;
+
+                    if (last >= 0 && timestamp.Date != Timestamps[last].Date)
+                    {
+                        Clear();
+                        last = -1;
+                    }
+
+                    if (last >= 0 && timestamp < Timestamps[last])
+                    {
+                        continue;
+                    }
+
+                    if (last >= 0 && timestamp == Timestamps[last])
+                    {
+                        foreach (Series series in SeriesByKey.Values)
+                        {
+                            while (series.Count > 0 && series.Timestamps[series.Count - 1] == last)
+                            {
+                                series.Count--;
+                            }
+                        }
+                    }
+                    else
+                    {
+                        Timestamps.Add(timestamp);
+                        last = Timestamps.Count - 1;
+                    }
+
+                    foreach (Position row in snapshot)
+                    {
+                        GetOrAddSeries(row.Desk, row.Symbol).Add(last, Convert.ToDecimal(row.DTD), Convert.ToDecimal(row.IdioPnl));
+                    }
+                }
+            }
+        }
+
+        public List<DateTime> GetTimestamps()
+        {
+            lock (SyncRoot)
+            {
+                return new List<DateTime>(Timestamps);
+            }
+        }
+
+        public List<Position> GetSeries(string Symbol)
+        {
+            List<Position> ReturnValue = new List<Position>();
+
+            lock (SyncRoot)
+            {
+                List<Series> matches;
+                IEnumerable<Series> series = string.IsNullOrEmpty(Symbol)
+                    ? SeriesByKey.Values
+                    : SeriesBySymbol.TryGetValue(Symbol, out matches) ? matches : Enumerable.Empty<Series>();
+
+                foreach (Series item in series)
+                {
+                    for (int i = 0; i < item.Count; i++)
+                    {
+                        ReturnValue.Add(new Position
+                        {
+                            PortfolioTimestamp = Timestamps[item.Timestamps[i]],
+                            Desk = item.Desk,
+                            Symbol = item.Symbol,
+                            DTD = item.DTD[i],
+                            IdioPnl = item.IdioPnl[i]
+                        });
+                    }
+                }
+            }
+
+            return ReturnValue.OrderBy(x => Convert.ToDateTime(x.PortfolioTimestamp)).ToList();
+        }
+
+        public List<Position> GetDeskRollup(string Desk = null)
+        {
+            List<Position> ReturnValue = new List<Position>();
+
+            lock (SyncRoot)
+            {
+                var totals = new Dictionary<string, decimal[]>(StringComparer.OrdinalIgnoreCase);
+
+                foreach (Series series in SeriesByKey.Values)
+                {
+                    if (!string.IsNullOrEmpty(Desk) && !string.Equals(series.Desk, Desk, StringComparison.OrdinalIgnoreCase))
+                    {
+                        continue;
+                    }
+
+                    decimal[] total;
+
+                    if (!totals.TryGetValue(series.Desk ?? string.Empty, out total))
+                    {
+                        total = new decimal[Timestamps.Count * 2];
+                        totals.Add(series.Desk ?? string.Empty, total);
+                    }
+
+                    for (int i = 0; i < series.Count; i++)
+                    {
+                        total[series.Timestamps[i] * 2] += series.DTD[i];
+                        total[series.Timestamps[i] * 2 + 1] += series.IdioPnl[i];
+                    }
+                }
+
+                foreach (var pair in totals.OrderBy(x => x.Key, StringComparer.OrdinalIgnoreCase))
+                {
+                    for (int i = 0; i < Timestamps.Count; i++)
+                    {
+                        ReturnValue.Add(new Position
+                        {
+                            PortfolioTimestamp = Timestamps[i],
+                            Desk = pair.Key,
+                            DTD = pair.Value[i * 2],
+                            IdioPnl = pair.Value[i * 2 + 1]
+                        });
+                    }
+                }
+            }
+
+            return ReturnValue;
+        }
+
+        private Series GetOrAddSeries(string Desk, string Symbol)
+        {
+            string key = Desk + "|" + Symbol;
+            Series ReturnValue;
+
+            if (!SeriesByKey.TryGetValue(key, out ReturnValue))
+            {
+                ReturnValue = new Series(Desk, Symbol);
+                SeriesByKey.Add(key, ReturnValue);
+
+                List<Series> bySymbol;
+
+                if (!SeriesBySymbol.TryGetValue(Symbol ?? string.Empty, out bySymbol))
+                {
+                    bySymbol = new List<Series>();
+                    SeriesBySymbol.Add(Symbol ?? string.Empty, bySymbol);
+                }
+
+                bySymbol.Add(ReturnValue);
+            }
+
+            return ReturnValue;
+        }
+
+        private void Clear()
+        {
+            Timestamps.Clear();
+            SeriesByKey.Clear();
+            SeriesBySymbol.Clear();
+        }
+    }
+
+    public sealed class ChangeFeed<T> where T : class
+    {
+        private readonly VersionedSnapshot<T> Snapshot;
+        private readonly ConcurrentDictionary<Channel<long>, bool> Subscribers = new ConcurrentDictionary<Channel<long>, bool>();
+        private readonly object SyncRoot = new object();
+        private readonly Action Subscribed;
+
+        private DateTime IdleSince = DateTime.UtcNow;
+
+        public ChangeFeed(Func<T, string> KeyOf, int MaxChanges, Action Subscribed = null)
+        {
+            Snapshot = new VersionedSnapshot<T>(KeyOf, MaxChanges);
+            this.Subscribed = Subscribed;
+        }
+
+        public string Epoch
+        {
+            get { return Snapshot.Epoch; }
+        }
+
+        public long Version
+        {
+            get { return Snapshot.Version; }
+        }
+
+        public string SourceToken { get; private set; }
+
+        public bool IsRetired { get; private set; }
+
+        public int SubscriberCount
+        {
+            get { return Subscribers.Count; }
+        }
+
+        public long Publish(IEnumerable<T> Rows, string SourceToken)
+        {
+            long before = Snapshot.Version;
+            long ReturnValue = Snapshot.Apply(Rows);
+
+            this.SourceToken = SourceToken;
+
+            if (ReturnValue != before)
+            {
+                foreach (Channel<long> subscriber in Subscribers.Keys)
+                {
+                    subscriber.Writer.TryWrite(ReturnValue);
+                }
+            }
+
+            return ReturnValue;
+        }
+
+        public bool TryRetire(TimeSpan IdleTimeout)
+        {
+            lock (SyncRoot)
+            {
+                if (!IsRetired && Subscribers.Count == 0 && DateTime.UtcNow - IdleSince >= IdleTimeout)
+                {
+                    IsRetired = true;
+                }
+
+                return IsRetired;
+            }
+        }
+
+        public async IAsyncEnumerable<SnapshotDelta<T>> Subscribe(string Epoch, long SinceVersion,
+            [EnumeratorCancellation] CancellationToken cancellationToken = default)
+        {
+            var channel = Channel.CreateBounded<long>(new BoundedChannelOptions(1) { FullMode = BoundedChannelFullMode.DropOldest });
+            bool registered;
+
+            lock (SyncRoot)
+            {
+                registered = !IsRetired && Subscribers.TryAdd(channel, true);
+            }
+
+            if (!registered)
+            {
+                yield break;
+            }
+
+            try
+            {
+                Subscribed?.Invoke();
+
+                long last = Epoch == Snapshot.Epoch ? SinceVersion : 0;
+
+                if (Snapshot.Version > 0 && Snapshot.Version != last)
+                {
+                    SnapshotDelta<T> delta = Snapshot.GetChanges(Snapshot.Epoch, last);
+                    last = delta.Version;
+
+                    yield return delta;
+                }
+
+                while (await channel.Reader.WaitToReadAsync(cancellationToken))
+                {
+                    long version;
+
+                    while (channel.Reader.TryRead(out version))
+                    {
+                    }
+
+                    SnapshotDelta<T> delta = Snapshot.GetChanges(Snapshot.Epoch, last);
+
+                    if (delta.Version != last)
+                    {
+                        last = delta.Version;
+
+                        yield return delta;
+                    }
+                }
+            }
+            finally
+            {
+                lock (SyncRoot)
+                {
+                    bool removed;
+                    Subscribers.TryRemove(channel, out removed);
+
+                    if (Subscribers.Count == 0)
+                    {
+                        IdleSince = DateTime.UtcNow;
+                    }
+                }
+            }
+        }
+    }
+
+    public class ColumnarColumn
+    {
+        public string Name { get; set; }
+        public string Type { get; set; }
+        public object Values { get; set; }
+        public string[] Dictionary { get; set; }
+    }
+
+    public sealed class ColumnarResult
+    {
+        private static class Accessors<T>
+        {
+            public static readonly PropertyInfo[] Properties = typeof(T).GetProperties(BindingFlags.Public | BindingFlags.Instance)
+                .Where(p => p.CanRead && p.GetIndexParameters().Length == 0)
+                .ToArray();
+
+            public static readonly Func<T, object>[] Getters = Properties.Select(Compile).ToArray();
+
+            private static Func<T, object> Compile(PropertyInfo Property)
+            {
+                var row = Expression.Parameter(typeof(T), "row");
+
+                return Expression.Lambda<Func<T, object>>(Expression.Convert(Expression.Property(row, Property), typeof(object)), row).Compile();
+            }
+        }
+
+        private static readonly System.Text.Json.JsonSerializerOptions JsonOptions = new System.Text.Json.JsonSerializerOptions
+        {
+            PropertyNamingPolicy = System.Text.Json.JsonNamingPolicy.CamelCase
+        };
+
+        public int RowCount { get; set; }
+        public List<ColumnarColumn> Columns { get; set; }
+
+        // Builds the columns in a single pass, so a lazy source such as ReadRows<T> is never held as a row list.
+        public static ColumnarResult From<T>(IEnumerable<T> Rows)
+        {
+            PropertyInfo[] properties = Accessors<T>.Properties;
+            Func<T, object>[] getters = Accessors<T>.Getters;
+            var columns = new ColumnBuilder[properties.Length];
+            int count = 0;
+
+            for (int c = 0; c < properties.Length; c++)
+            {
+                columns[c] = new ColumnBuilder(properties[c].Name,
+                    Nullable.GetUnderlyingType(properties[c].PropertyType) ?? properties[c].PropertyType);
+            }
+
+            foreach (T row in Rows)
+            {
+                for (int c = 0; c < columns.Length; c++)
+                {
+                    columns[c].Add(getters[c](row));
+                }
+
+                count++;
+            }
+
+            return new ColumnarResult { RowCount = count, Columns = columns.Select(x => x.Build(count)).ToList() };
+        }
+
+        private sealed class ColumnBuilder
+        {
+            private readonly string Name;
+            private readonly string Type;
+            private readonly List<double?> Numbers;
+            private readonly List<string> Decimals;
+            private readonly List<long?> Dates;
+            private readonly List<bool?> Bools;
+            private readonly List<int> Codes;
+            private readonly Dictionary<string, int> Dictionary;
+            private readonly List<object> Objects;
+
+            public ColumnBuilder(string Name, Type ColumnType)
+            {
+                this.Name = Name;
+
+                if (ColumnType == typeof(string))
+                {
+                    Type = "string";
+                    Codes = new List<int>();
+                    Dictionary = new Dictionary<string, int>(StringComparer.Ordinal);
+                }
+                else if (ColumnType == typeof(decimal))
+                {
+                    // Money columns keep every digit: sent as invariant strings rather than rounded through double.
+                    Type = "decimal";
+                    Decimals = new List<string>();
+                }
+                else if (ColumnType == typeof(double) || ColumnType == typeof(float) || ColumnType == typeof(int)
+                    || ColumnType == typeof(long) || ColumnType == typeof(short) || ColumnType == typeof(byte))
+                {
+                    Type = "number";
+                    Numbers = new List<double?>();
+                }
+                else if (ColumnType == typeof(DateTime))
+                {
+                    Type = "date";
+                    Dates = new List<long?>();
+                }
+                else if (ColumnType == typeof(bool))
+                {
+                    Type = "bool";
+                    Bools = new List<bool?>();
+                }
+                else
+                {
+                    Type = "object";
+                    Objects = new List<object>();
+                }
+            }
+
+            public void Add(object Value)
+            {
+                switch (Type)
+                {
+                    case "string":
+                        string value = (string)Value;
+                        int code = -1;
+
+                        if (value != null && !Dictionary.TryGetValue(value, out code))
+                        {
+                            code = Dictionary.Count;
+                            Dictionary.Add(value, code);
+                        }
+
+                        Codes.Add(code);
+                        break;
+                    case "decimal":
+                        Decimals.Add(Value == null ? null : ((decimal)Value).ToString(CultureInfo.InvariantCulture));
+                        break;
+                    case "number":
+                        Numbers.Add(Value == null ? (double?)null : Convert.ToDouble(Value, CultureInfo.InvariantCulture));
+                        break;
+                    case "date":
+                        Dates.Add(Value == null ? (long?)null : new DateTimeOffset(DateTime.SpecifyKind((DateTime)Value, DateTimeKind.Utc)).ToUnixTimeMilliseconds());
+                        break;
+                    case "bool":
+                        Bools.Add((bool?)Value);
+                        break;
+                    default:
+                        Objects.Add(Value);
+                        break;
+                }
+            }
+
+            public ColumnarColumn Build(int RowCount)
+            {
+                switch (Type)
+                {
+                    case "string":
+                        if (Dictionary.Count * 2 > RowCount)
+                        {
+                            // Plain strings are only materialized here, from the codes, when the dictionary does not pay off.
+                            string[] lookup = Dictionary.OrderBy(x => x.Value).Select(x => x.Key).ToArray();
+
+                            return new ColumnarColumn { Name = Name, Type = Type, Values = Codes.Select(x => x < 0 ? null : lookup[x]).ToArray() };
+                        }
+
+                        return new ColumnarColumn
+                        {
+                            Name = Name,
+                            Type = Type,
+                            Values = Codes.ToArray(),
+                            Dictionary = Dictionary.OrderBy(x => x.Value).Select(x => x.Key).ToArray()
+                        };
+                    case "number":
+                        return new ColumnarColumn { Name = Name, Type = Type, Values = Numbers.ToArray() };
+                    case "decimal":
+                        return new ColumnarColumn { Name = Name, Type = Type, Values = Decimals.ToArray() };
+                    case "date":
+                        return new ColumnarColumn { Name = Name, Type = Type, Values = Dates.ToArray() };
+                    case "bool":
+                        return new ColumnarColumn { Name = Name, Type = Type, Values = Bools.ToArray() };
+                    default:
+                        return new ColumnarColumn { Name = Name, Type = Type, Values = Objects.ToArray() };
+                }
+            }
+        }
+
+        public async Task WriteJsonAsync(Stream Output, bool Compress = true, CancellationToken cancellationToken = default)
+        {
+            if (Compress)
+            {
+                using (var gzip = new GZipStream(Output, CompressionLevel.Fastest, true))
+                {
+                    await System.Text.Json.JsonSerializer.SerializeAsync(gzip, this, JsonOptions, cancellationToken);
+                }
+            }
+            else
+            {
+                await System.Text.Json.JsonSerializer.SerializeAsync(Output, this, JsonOptions, cancellationToken);
+            }
+        }
+
+        public byte[] ToJson(bool Compress = true)
+        {
+            using (var output = new MemoryStream())
+            {
+                WriteJsonAsync(output, Compress).GetAwaiter().GetResult();
+
+                return output.ToArray();
+            }
+        }
+    }
+
+    public sealed class PnlSnapshot
+    {
+        private readonly Dictionary<string, int> Index;
+
+        public PnlSnapshot(DateTime PortfolioTimestamp, IList<PnlCompare> Rows)
+        {
+            this.PortfolioTimestamp = PortfolioTimestamp;
+
+            Index = new Dictionary<string, int>(Rows.Count, StringComparer.OrdinalIgnoreCase);
+            Desk = new string[Rows.Count];
+            Sector = new string[Rows.Count];
+            PositionBlock = new string[Rows.Count];
+            Symbol = new string[Rows.Count];
+            UnderlyingSymbol = new string[Rows.Count];
+            DTD = new decimal[Rows.Count];
+            MTD = new decimal[Rows.Count];
+            YTD = new decimal[Rows.Count];
+
+            foreach (PnlCompare row in Rows)
+            {
+                string key = KeyOf(row);
+
+                // Rows are never summed: two rows with the same identity would change the comparison's grouping.
+                if (Index.ContainsKey(key))
+                {
+                    throw new InvalidDataException($"PnL snapshot at {PortfolioTimestamp:o} has more than one row for {key}");
+                }
+
+                int slot = Count++;
+                Index.Add(key, slot);
+                Desk[slot] = row.Desk;
+                Sector[slot] = row.Sector;
+                PositionBlock[slot] = row.PositionBlock;
+                Symbol[slot] = row.Symbol;
+                UnderlyingSymbol[slot] = row.UnderlyingSymbol;
+                DTD[slot] = Convert.ToDecimal(row.DTD2);
+                MTD[slot] = Convert.ToDecimal(row.MTD2);
+                YTD[slot] = Convert.ToDecimal(row.YTD2);
+            }
+        }
+
+        public DateTime PortfolioTimestamp { get; }
+        public int Count { get; }
+        public string[] Desk { get; }
+        public string[] Sector { get; }
+        public string[] PositionBlock { get; }
+        public string[] Symbol { get; }
+        public string[] UnderlyingSymbol { get; }
+        public decimal[] DTD { get; }
+        public decimal[] MTD { get; }
+        public decimal[] YTD { get; }
+
+        public static List<PnlCompare> Compare(PnlSnapshot Start, PnlSnapshot End)
+        {
+            int[] aligned = End.AlignTo(Start);
+            bool[] matched = new bool[Start.Count];
+            int unmatched = Start.Count;
+
+            decimal[] dtd1 = Gather(Start.DTD, aligned, matched, ref unmatched);
+            decimal[] mtd1 = Gather(Start.MTD, aligned, null, ref unmatched);
+            decimal[] ytd1 = Gather(Start.YTD, aligned, null, ref unmatched);
+
+            decimal[] deltaDtd = Subtract(End.DTD, dtd1, End.Count);
+            decimal[] deltaMtd = Subtract(End.MTD, mtd1, End.Count);
+            decimal[] deltaYtd = Subtract(End.YTD, ytd1, End.Count);
+
+            List<PnlCompare> ReturnValue = new List<PnlCompare>(End.Count + unmatched);
+
+            for (int i = 0; i < End.Count; i++)
+            {
+                ReturnValue.Add(new PnlCompare
+                {
+                    Timestamp1 = Start.PortfolioTimestamp,
+                    Timestamp2 = End.PortfolioTimestamp,
+                    Desk = End.Desk[i],
+                    Sector = End.Sector[i],
+                    PositionBlock = End.PositionBlock[i],
+                    Symbol = End.Symbol[i],
+                    UnderlyingSymbol = End.UnderlyingSymbol[i],
+                    DTD1 = dtd1[i],
+                    MTD1 = mtd1[i],
+                    YTD1 = ytd1[i],
+                    DTD2 = End.DTD[i],
+                    MTD2 = End.MTD[i],
+                    YTD2 = End.YTD[i],
+                    DeltaDTD = deltaDtd[i],
+                    DeltaMTD = deltaMtd[i],
+                    DeltaYTD = deltaYtd[i]
+                });
+            }
+
+            for (int j = 0; j < Start.Count && unmatched > 0; j++)
+            {
+                if (matched[j])
+                {
+                    continue;
+                }
+
+                ReturnValue.Add(new PnlCompare
+                {
+                    Timestamp1 = Start.PortfolioTimestamp,
+                    Timestamp2 = End.PortfolioTimestamp,
+                    Desk = Start.Desk[j],
+                    Sector = Start.Sector[j],
+                    PositionBlock = Start.PositionBlock[j],
+                    Symbol = Start.Symbol[j],
+                    UnderlyingSymbol = Start.UnderlyingSymbol[j],
+                    DTD1 = Start.DTD[j],
+                    MTD1 = Start.MTD[j],
+                    YTD1 = Start.YTD[j],
+                    DTD2 = 0m,
+                    MTD2 = 0m,
+                    YTD2 = 0m,
+                    DeltaDTD = -Start.DTD[j],
+                    DeltaMTD = -Start.MTD[j],
+                    DeltaYTD = -Start.YTD[j]
+                });
+                unmatched--;
+            }
+
+            return ReturnValue;
+        }
+
+        private int[] AlignTo(PnlSnapshot Other)
+        {
+            int[] ReturnValue = new int[Count];
+
+            foreach (var pair in Index)
+            {
+                int slot;
+                ReturnValue[pair.Value] = Other.Index.TryGetValue(pair.Key, out slot) ? slot : -1;
+            }
+
+            return ReturnValue;
+        }
+
+        private static decimal[] Gather(decimal[] Source, int[] Aligned, bool[] Matched, ref int Unmatched)
+        {
+            decimal[] ReturnValue = new decimal[Aligned.Length];
+
+            for (int i = 0; i < Aligned.Length; i++)
+            {
+                int slot = Aligned[i];
+
+                if (slot < 0)
+                {
+                    continue;
+                }
+
+                ReturnValue[i] = Source[slot];
+
+                if (Matched != null && !Matched[slot])
+                {
+                    Matched[slot] = true;
+                    Unmatched--;
+                }
+            }
+
+            return ReturnValue;
+        }
+
+        private static decimal[] Subtract(decimal[] Left, decimal[] Right, int Count)
+        {
+            decimal[] ReturnValue = new decimal[Count];
+
+            for (int i = 0; i < Count; i++)
+            {
+                ReturnValue[i] = Left[i] - Right[i];
+            }
+
+            return ReturnValue;
+        }
+
+        public static bool SameRows(IList<PnlCompare> Expected, IList<PnlCompare> Actual)
+        {
+            if (Expected.Count != Actual.Count)
+            {
+                return false;
+            }
+
+            var expected = Expected.OrderBy(KeyOf, StringComparer.OrdinalIgnoreCase).ToList();
+            var actual = Actual.OrderBy(KeyOf, StringComparer.OrdinalIgnoreCase).ToList();
+
+            for (int i = 0; i < expected.Count; i++)
+            {
+                PnlCompare a = expected[i];
+                PnlCompare b = actual[i];
+
+                if (!string.Equals(KeyOf(a), KeyOf(b), StringComparison.OrdinalIgnoreCase)
+                    || Convert.ToDecimal(a.DTD1) != Convert.ToDecimal(b.DTD1) || Convert.ToDecimal(a.MTD1) != Convert.ToDecimal(b.MTD1)
+                    || Convert.ToDecimal(a.YTD1) != Convert.ToDecimal(b.YTD1) || Convert.ToDecimal(a.DTD2) != Convert.ToDecimal(b.DTD2)
+                    || Convert.ToDecimal(a.MTD2) != Convert.ToDecimal(b.MTD2) || Convert.ToDecimal(a.YTD2) != Convert.ToDecimal(b.YTD2))
+                {
+                    return false;
+                }
+            }
+
+            return true;
+        }
+
+        private static string KeyOf(PnlCompare Row)
+        {
+            return Row.Desk + "|" + Row.Sector + "|" + Row.PositionBlock + "|" + Row.Symbol + "|" + Row.UnderlyingSymbol;
+        }
+    }
+
+    internal static class RowMaterializer
+    {
+        private static Logger Logger = LogManager.GetCurrentClassLogger();
+
+        private static readonly ConcurrentDictionary<string, Delegate> Materializers = new ConcurrentDictionary<string, Delegate>();
+
+        private static readonly MethodInfo IsDBNullMethod = typeof(DbDataReader).GetMethod(nameof(DbDataReader.IsDBNull), new[] { typeof(int) });
+        private static readonly MethodInfo GetValueMethod = typeof(DbDataReader).GetMethod(nameof(DbDataReader.GetValue), new[] { typeof(int) });
+        private static readonly MethodInfo GetFieldValueMethod = typeof(DbDataReader).GetMethods()
+            .First(m => m.Name == nameof(DbDataReader.GetFieldValue) && m.IsGenericMethodDefinition);
+        private static readonly MethodInfo ChangeTypeMethod = typeof(Convert).GetMethod(nameof(Convert.ChangeType), new[] { typeof(object), typeof(Type), typeof(IFormatProvider) });
+
+        public static int Count
+        {
+            get { return Materializers.Count; }
+        }
+
+        public static Func<DbDataReader, T> GetMaterializer<T>(string Source, DbDataReader dataReader, IDictionary<string, string> ColumnMap) where T : new()
+        {
+            var key = new System.Text.StringBuilder(Source).Append('|').Append(typeof(T).FullName);
+
+            for (var i = 0; i < dataReader.FieldCount; i++)
+            {
+                key.Append('|').Append(dataReader.GetName(i)).Append(':').Append(dataReader.GetFieldType(i)?.Name);
+            }
+
+            if (ColumnMap != null)
+            {
+                foreach (var pair in ColumnMap)
+                {
+                    key.Append('|').Append(pair.Key).Append('>').Append(pair.Value);
+                }
+            }
+
+            return (Func<DbDataReader, T>)Materializers.GetOrAdd(key.ToString(), k => Compile<T>(Source, dataReader, ColumnMap));
+        }
+
+        private static Func<DbDataReader, T> Compile<T>(string Source, DbDataReader dataReader, IDictionary<string, string> ColumnMap) where T : new()
+        {
+            var properties = typeof(T).GetProperties(BindingFlags.Public | BindingFlags.Instance)
+                .Where(p => p.CanWrite && p.GetIndexParameters().Length == 0)
+                .GroupBy(p => p.Name, StringComparer.OrdinalIgnoreCase)
+                .ToDictionary(g => g.Key, g => g.First(), StringComparer.OrdinalIgnoreCase);
+
+            var reader = Expression.Parameter(typeof(DbDataReader), "reader");
+            var target = Expression.Variable(typeof(T), "target");
+            var body = new List<Expression> { Expression.Assign(target, Expression.New(typeof(T))) };
+
+            for (var i = 0; i < dataReader.FieldCount; i++)
+            {
+                string name = dataReader.GetName(i);
+                string mapped;
+
+                if (ColumnMap != null && ColumnMap.TryGetValue(name, out mapped))
+                {
+                    name = mapped;
+                }
+
+                PropertyInfo property;
+
+                if (name == null || !properties.TryGetValue(name, out property))
+                {
+                    continue;
+                }
+
+                Expression value = ReadColumn(reader, i, dataReader.GetFieldType(i), property.PropertyType);
+
+                if (value == null)
+                {
+                    // Logged once per result shape, since the compiled materializer is cached under that key.
+                    Logger.Warn($"{Source}: column {dataReader.GetName(i)} ({dataReader.GetFieldType(i)?.Name ?? "unknown"}) cannot be converted to " +
+                        $"{typeof(T).Name}.{property.Name} ({property.PropertyType.Name}); the property is left at its default");
+                    continue;
+                }
+
+                body.Add(Expression.Assign(
+                    Expression.Property(target, property),
+                    Expression.Condition(
+                        Expression.Call(reader, IsDBNullMethod, Expression.Constant(i)),
+                        Expression.Default(property.PropertyType),
+                        value)));
+            }
+
+            body.Add(target);
+
+            return Expression.Lambda<Func<DbDataReader, T>>(Expression.Block(typeof(T), new[] { target }, body), reader).Compile();
+        }
+
+        private static Expression ReadColumn(ParameterExpression reader, int Ordinal, Type FieldType, Type PropertyType)
+        {
+            Type underlying = Nullable.GetUnderlyingType(PropertyType) ?? PropertyType;
+            var ordinal = Expression.Constant(Ordinal);
+            Expression value;
+
+            if (FieldType == null)
+            {
+                return null;
+            }
+            else if (underlying == FieldType)
+            {
+                value = Expression.Call(reader, GetFieldValueMethod.MakeGenericMethod(FieldType), ordinal);
+            }
+            else if (underlying.IsAssignableFrom(FieldType))
+            {
+                value = Expression.Convert(Expression.Call(reader, GetValueMethod, ordinal), underlying);
+            }
+            else if (!underlying.IsEnum && typeof(IConvertible).IsAssignableFrom(underlying) && typeof(IConvertible).IsAssignableFrom(FieldType))
+            {
+                value = Expression.Convert(
+                    Expression.Call(ChangeTypeMethod,
+                        Expression.Call(reader, GetValueMethod, ordinal),
+                        Expression.Constant(underlying, typeof(Type)),
+                        Expression.Constant(CultureInfo.InvariantCulture, typeof(IFormatProvider))),
+                    underlying);
+            }
+            else
+            {
+                return null;
+            }
+
+            return value.Type == PropertyType ? value : Expression.Convert(value, PropertyType);
+        }
+    }
+
+    public class BenchmarkResult
+    {
+        public string Name { get; set; }
+        public int Rows { get; set; }
+        public int Iterations { get; set; } = 1;
+        public double ElapsedMilliseconds { get; set; }
+        public double P50Milliseconds { get; set; }
+        public double P99Milliseconds { get; set; }
+        public long AllocatedBytes { get; set; }
+        public long PayloadBytes { get; set; }
+
+        public double RowsPerSecond
+        {
+            get { return ElapsedMilliseconds > 0 ? Rows / (ElapsedMilliseconds / 1000.0) : 0; }
+        }
+    }
+
+    public static class DatabaseHelperBenchmarks
+    {
+        private static Logger Logger = LogManager.GetCurrentClassLogger();
+
+        public static List<BenchmarkResult> CompareRowMaterialization(int RowCount = 100000)
+        {
+            List<BenchmarkResult> ReturnValue = new List<BenchmarkResult>();
+
+            DataTable table = CreatePnlCompareTable(RowCount);
+
+            MaterializeDynamic(CreatePnlCompareTable(10));
+            MaterializeTyped(CreatePnlCompareTable(10));
+
+            ReturnValue.Add(Measure("ExpandoObject", () => MaterializeDynamic(table)));
+            ReturnValue.Add(Measure("Typed", () => MaterializeTyped(table)));
+
+            foreach (BenchmarkResult result in ReturnValue)
+            {
+                Logger.Info($"{result.Name}: {result.Rows} rows in {result.ElapsedMilliseconds:N1} ms ({result.RowsPerSecond:N0} rows/s, {result.AllocatedBytes:N0} bytes allocated)");
+            }
+
+            return ReturnValue;
+        }
+
+        // Every submission runs in its own DatabaseScope that is never completed, so nothing written by the benchmark is kept.
+        public static List<BenchmarkResult> CompareEarningsPreviewSubmission(string DatabaseConnectionString,
+            int Submissions = 200, int MetricsPerPreview = 8, int Concurrency = 16, bool IncludeMetricTable = false)
+        {
+            List<BenchmarkResult> ReturnValue = new List<BenchmarkResult>();
+            var options = new ParallelOptions { MaxDegreeOfParallelism = Concurrency };
+
+            ReturnValue.Add(Measure("SubmitEarningsPreview per metric", () =>
+            {
+                Parallel.For(0, Submissions, options, i =>
+                {
+                    using (var scope = DatabaseScope.Begin(DatabaseConnectionString))
+                    {
+                        SubmitEarningsPreviewPerMetric(DatabaseConnectionString, i, MetricsPerPreview, scope);
+                    }
+                });
+                return Submissions;
+            }));
+
+            ReturnValue.Add(Measure("SubmitEarningsPreview batched", () =>
+            {
+                Parallel.For(0, Submissions, options, i =>
+                {
+                    using (var scope = DatabaseScope.Begin(DatabaseConnectionString))
+                    {
+                        DatabaseHelper.SubmitEarningsPreview(DatabaseConnectionString,
+                            CreatePreview(i), CreateMetrics(MetricsPerPreview), new ExpectedValue(), new ExpectedValue(),
+                            string.Empty, "benchmark", string.Empty, scope);
+                    }
+                });
+                return Submissions;
+            }));
+
+            if (IncludeMetricTable)
+            {
+                ReturnValue.Add(Measure("SubmitEarningsPreview metric table", () =>
+                {
+                    Parallel.For(0, Submissions, options, i =>
+                    {
+                        using (var scope = DatabaseScope.Begin(DatabaseConnectionString))
+                        {
+                            DatabaseHelper.SubmitEarningsPreview(DatabaseConnectionString,
+                                CreatePreview(i), CreateMetrics(MetricsPerPreview), new ExpectedValue(), new ExpectedValue(),
+                                string.Empty, "benchmark", string.Empty, scope, UseMetricTable: true);
+                        }
+                    });
+                    return Submissions;
+                }));
+            }
+
+            foreach (BenchmarkResult result in ReturnValue)
+            {
+                Logger.Info($"{result.Name}: {result.Rows} previews in {result.ElapsedMilliseconds:N1} ms ({result.RowsPerSecond:N1} previews/s)");
+            }
+
+            return ReturnValue;
+        }
+
+        public static List<BenchmarkResult> ComparePostgresPlanning(string DatabaseConnectionString, string BarraIds, string Factors, int Iterations = 200)
+        {
+            List<BenchmarkResult> ReturnValue = new List<BenchmarkResult>();
+
+            const string select = "select barraid,date,factor,loading from qr.public.usmeds_asset_exp where ";
+            string literal = select + "date >= '{0}' and factor in (" + Factors + ") and barraid in (" + BarraIds + ")";
+
+            using (var connection = new Npgsql.NpgsqlConnection(DatabaseConnectionString))
+            {
+                connection.Open();
+
+                ReturnValue.Add(Measure("Factor loadings literal SQL", () =>
+                {
+                    for (int i = 0; i < Iterations; i++)
+                    {
+                        using (var command = new Npgsql.NpgsqlCommand(string.Format(literal, StartDate(i).ToString("yyyy-MM-dd")), connection))
+                        {
+                            Drain(command);
+                        }
+                    }
+
+                    return Iterations;
+                }));
+
+                ReturnValue.Add(Measure("Factor loadings prepared", () =>
+                {
+                    using (var command = new Npgsql.NpgsqlCommand(select + "date >= @StartDate and factor = ANY(@Factors) and barraid = ANY(@BarraIds)", connection))
+                    {
+                        command.Parameters.Add(new Npgsql.NpgsqlParameter("StartDate", NpgsqlTypes.NpgsqlDbType.Date));
+                        command.Parameters.Add(new Npgsql.NpgsqlParameter("Factors", NpgsqlTypes.NpgsqlDbType.Array | NpgsqlTypes.NpgsqlDbType.Text) { Value = DatabaseHelper.ParseSqlList(Factors) });
+                        command.Parameters.Add(new Npgsql.NpgsqlParameter("BarraIds", NpgsqlTypes.NpgsqlDbType.Array | NpgsqlTypes.NpgsqlDbType.Text) { Value = DatabaseHelper.ParseSqlList(BarraIds) });
+                        command.Prepare();
+
+                        for (int i = 0; i < Iterations; i++)
+                        {
+                            command.Parameters["StartDate"].Value = StartDate(i);
+                            Drain(command);
+                        }
+                    }
+
+                    return Iterations;
+                }));
+
+                using (var command = new Npgsql.NpgsqlCommand("explain (summary) " + string.Format(literal, StartDate(0).ToString("yyyy-MM-dd")), connection))
+                using (var dataReader = command.ExecuteReader())
+                {
+                    while (dataReader.Read())
+                    {
+                        string line = dataReader.GetString(0).Trim();
+
+                        if (line.StartsWith("Planning Time:"))
+                        {
+                            ReturnValue.Add(new BenchmarkResult
+                            {
+                                Name = "Factor loadings planning per literal query",
+                                Rows = 1,
+                                ElapsedMilliseconds = double.Parse(line.Substring(14).Replace("ms", string.Empty).Trim(), CultureInfo.InvariantCulture)
+                            });
+                        }
+                    }
+                }
+            }
+
+            foreach (BenchmarkResult result in ReturnValue)
+            {
+                Logger.Info($"{result.Name}: {result.Rows} queries in {result.ElapsedMilliseconds:N2} ms ({result.RowsPerSecond:N1} queries/s)");
+            }
+
+            return ReturnValue;
+        }
+
+        private static DateTime StartDate(int Iteration)
+        {
+            return DateTime.Today.AddDays(-30 - Iteration % 30);
+        }
+
+        private static int Drain(DbCommand command)
+        {
+            int count = 0;
+
+            using (var dataReader = command.ExecuteReader())
+            {
+                while (dataReader.Read())
+                {
+                    count++;
+                }
+            }
+
+            return count;
+        }
+
+        private static void SubmitEarningsPreviewPerMetric(string DatabaseConnectionString, int Index, int MetricsPerPreview, DatabaseScope Scope)
+        {
+            int? EarningsPreviewId = DatabaseHelper.ExecuteStoredProcedureWithReturnValue(
+                DatabaseConnectionString, "research.SubmitEarningsPreview",
+                DatabaseHelper.EarningsPreviewParameters(CreatePreview(Index), new ExpectedValue(), new ExpectedValue(),
+                    string.Empty, "benchmark", string.Empty), Scope);
+
+            foreach (PreviewMetric metric in CreateMetrics(MetricsPerPreview))
+            {
+                List<SqlParameter> parameters = DatabaseHelper.EarningsPreviewMetricParameters(metric);
+                parameters[0].Value = EarningsPreviewId.Value;
+
+                DatabaseHelper.ExecuteStoredProcedure(DatabaseConnectionString, "research.SubmitEarningsPreviewMetric", parameters, Scope);
+            }
+        }
+
+        private static Preview CreatePreview(int Index)
+        {
+            return new Preview
+            {
+                Symbol = "BENCH" + Index,
+                Status = "Draft"
+            };
+        }
+
+        private static List<PreviewMetric> CreateMetrics(int Count)
+        {
+            List<PreviewMetric> ReturnValue = new List<PreviewMetric>();
+
+            for (int i = 0; i < Count; i++)
+            {
+                ReturnValue.Add(new PreviewMetric
+                {
+                    KeyMetric = "Metric" + i,
+                    KeyMetricOther = string.Empty,
+                    HoaEst = 100m + i,
+                    ConsensusEst = 99m + i
+                });
+            }
+
+            return ReturnValue;
+        }
+
+        public static List<BenchmarkResult> CompareHotPaths(int[] RowCounts = null, int Iterations = 5)
+        {
+            List<BenchmarkResult> ReturnValue = new List<BenchmarkResult>();
+
+            foreach (int rowCount in RowCounts ?? new[] { 10000, 100000, 1000000 })
+            {
+                ReturnValue.Add(MeasureReplay($"GetEVDashboard ({rowCount:N0})", Iterations,
+                    new ReplayDataSource().Add("research.GetEVDashboard", CreateEVDashboardTemplate(), rowCount),
+                    () => DatabaseHelper.LoadEVDashboard()));
+
+                ReturnValue.Add(MeasureReplay($"GetPnlCompare ({rowCount:N0})", Iterations,
+                    new ReplayDataSource().Add("core.GetPnlCompare", CreatePnlCompareTable(1000), rowCount),
+                    () => DatabaseHelper.GetPnlCompare(null, null, "Total")));
+
+                ReturnValue.Add(MeasureReplay($"GetFactorGroupReturnsHistory ({rowCount:N0})", Iterations,
+                    new ReplayDataSource().Add("usmeds_fac_ret", CreateFactorReturnTemplate(), rowCount),
+                    () => DatabaseHelper.LoadFactorGroupReturnsHistory(DateTime.Today.AddYears(-10), new[] { "BENCH1" }, "'Factor1'")));
+
+                ReturnValue.Add(MeasureReplay($"GetDashViewChartNew ({rowCount:N0})", Iterations,
+                    new ReplayDataSource()
+                        .Add("data.GetDashViewCharts", CreateDashChartTemplate(), Math.Max(1, rowCount / 10))
+                        .Add("[data].DashQueryCache", CreateDashQueryCacheTemplate(), 4)
+                        .Add("data.DashChartQuery", CreateDashChartQueryTemplate(), 4),
+                    () => DatabaseHelper.GetDashViewChartNew(1)));
+            }
+
+            foreach (BenchmarkResult result in ReturnValue)
+            {
+                Logger.Info($"{result.Name}: {result.Rows:N0} rows, p50 {result.P50Milliseconds:N1} ms, p99 {result.P99Milliseconds:N1} ms " +
+                    $"({result.RowsPerSecond:N0} rows/s, {result.AllocatedBytes:N0} bytes allocated per call)");
+            }
+
+            return ReturnValue;
+        }
+
+        public static List<BenchmarkResult> CompareFactorGroupMerge(int Years = 10, int BarraIdCount = 20, double OverrideRatio = 0.1)
+        {
+            List<BenchmarkResult> ReturnValue = new List<BenchmarkResult>();
+
+            DataTable table = CreateFactorGroupHistoryTable(Years, BarraIdCount, OverrideRatio);
+
+            ReturnValue.Add(Measure("Factor group merge linear scan", () =>
+            {
+                List<RiskReturn> merged = new List<RiskReturn>();
+
+                using (DbDataReader dataReader = table.CreateDataReader())
+                {
+                    foreach (dynamic row in DatabaseHelper.ReadRows(dataReader))
+                    {
+                        var facReturn = new RiskReturn
+                        {
+                            BusDate = Convert.ToDateTime(row.date),
+                            BarraId = row.barraid,
+                            Return = Convert.ToDecimal(row.totalreturn)
+                        };
+
+                        if (row.src == 0 || merged.Where(x => x.BarraId == facReturn.BarraId && x.BusDate == facReturn.BusDate).Count() == 0)
+                        {
+                            merged.Add(facReturn);
+                        }
+                    }
+                }
+
+                return merged.Count;
+            }));
+
+            ReturnValue.Add(Measure("Factor group merge keyed", () =>
+            {
+                using (DbDataReader dataReader = table.CreateDataReader())
+                {
+                    return DatabaseHelper.MergeFactorGroupReturns(DatabaseHelper.ReadRows(dataReader)).Count;
+                }
+            }));
+
+            foreach (BenchmarkResult result in ReturnValue)
+            {
+                Logger.Info($"{result.Name}: {result.Rows:N0} returns in {result.ElapsedMilliseconds:N1} ms ({result.RowsPerSecond:N0} rows/s, {result.AllocatedBytes:N0} bytes allocated)");
+            }
+
+            return ReturnValue;
+        }
+
+        public static List<BenchmarkResult> CompareColumnarEncoding(int RowCount = 100000)
+        {
+            List<BenchmarkResult> ReturnValue = new List<BenchmarkResult>();
+            List<PnlCompare> rows;
+            byte[] payload = null;
+
+            using (DbDataReader dataReader = CreatePnlCompareTable(RowCount).CreateDataReader())
+            {
+                rows = DatabaseHelper.ReadRows<PnlCompare>("benchmark.PnlCompare", dataReader, null, null).ToList();
+            }
+
+            BenchmarkResult result = Measure("Row JSON", () =>
+            {
+                payload = System.Text.Json.JsonSerializer.SerializeToUtf8Bytes(rows);
+                return rows.Count;
+            });
+            result.PayloadBytes = payload.Length;
+            ReturnValue.Add(result);
+
+            result = Measure("Columnar JSON", () =>
+            {
+                payload = ColumnarResult.From(rows).ToJson(false);
+                return rows.Count;
+            });
+            result.PayloadBytes = payload.Length;
+            ReturnValue.Add(result);
+
+            result = Measure("Columnar JSON gzip", () =>
+            {
+                payload = ColumnarResult.From(rows).ToJson(true);
+                return rows.Count;
+            });
+            result.PayloadBytes = payload.Length;
+            ReturnValue.Add(result);
+
+            foreach (BenchmarkResult item in ReturnValue)
+            {
+                Logger.Info($"{item.Name}: {item.Rows:N0} rows in {item.ElapsedMilliseconds:N1} ms ({item.PayloadBytes:N0} bytes, {item.AllocatedBytes:N0} bytes allocated)");
+            }
+
+            return ReturnValue;
+        }
+
+        public static List<BenchmarkResult> ComparePnlSnapshotDiff(int RowCount = 100000)
+        {
+            List<BenchmarkResult> ReturnValue = new List<BenchmarkResult>();
+            List<PnlCompare> rows;
+
+            using (DbDataReader dataReader = CreatePnlCompareTable(RowCount).CreateDataReader())
+            {
+                rows = DatabaseHelper.ReadRows<PnlCompare>("benchmark.PnlCompare", dataReader, null, null).ToList();
+            }
+
+            PnlSnapshot start = null;
+            PnlSnapshot end = null;
+            DateTime timestamp = DateTime.Today.AddHours(9);
+
+            ReturnValue.Add(Measure("Snapshot build", () =>
+            {
+                start = new PnlSnapshot(timestamp, rows);
+                end = new PnlSnapshot(timestamp.AddMinutes(30), rows.Skip(RowCount / 100).ToList());
+                return rows.Count;
+            }));
+
+            ReturnValue.Add(Measure("Snapshot diff", () => PnlSnapshot.Compare(start, end).Count));
+
+            foreach (BenchmarkResult result in ReturnValue)
+            {
+                Logger.Info($"{result.Name}: {result.Rows:N0} rows in {result.ElapsedMilliseconds:N1} ms ({result.RowsPerSecond:N0} rows/s, {result.AllocatedBytes:N0} bytes allocated)");
+            }
+
+            return ReturnValue;
+        }
+
+        public static List<BenchmarkResult> CompareFactorModel(DateTime StartDate, string BarraIds, string Factors)
+        {
+            List<BenchmarkResult> ReturnValue = new List<BenchmarkResult>();
+
+            string[] barraIds = DatabaseHelper.ParseSqlList(BarraIds);
+            string[] factors = DatabaseHelper.ParseSqlList(Factors);
+
+            ReturnValue.Add(Measure("Factor group returns per Barra id SQL", () =>
+                barraIds.Sum(id => DatabaseHelper.LoadFactorGroupReturnsHistory(StartDate, new[] { id }, Factors).Count)));
+
+            FactorModel model = null;
+
+            ReturnValue.Add(Measure("FactorModel load", () =>
+            {
+                model = DatabaseHelper.GetFactorModel(StartDate, BarraIds);
+                return model.AssetCount * model.DateCount;
+            }));
+
+            ReturnValue.Add(Measure("FactorModel factor group returns", () => model.GetFactorGroupReturns(barraIds, factors, StartDate).Count));
+
+            foreach (BenchmarkResult result in ReturnValue)
+            {
+                Logger.Info($"{result.Name}: {result.Rows:N0} returns in {result.ElapsedMilliseconds:N1} ms ({result.RowsPerSecond:N0} rows/s, {result.AllocatedBytes:N0} bytes allocated)");
+            }
+
+            return ReturnValue;
+        }
+
+        private static DataTable CreateFactorGroupHistoryTable(int Years, int BarraIdCount, double OverrideRatio)
+        {
+            DataTable table = new DataTable();
+            table.Columns.Add("barraid", typeof(string));
+            table.Columns.Add("date", typeof(DateTime));
+            table.Columns.Add("totalreturn", typeof(decimal));
+            table.Columns.Add("src", typeof(int));
+
+            Random random = new Random(42);
+            DateTime start = DateTime.Today.AddYears(-Years);
+
+            for (int b = 0; b < BarraIdCount; b++)
+            {
+                string barraId = "USA" + b.ToString("D4");
+
+                for (DateTime date = start; date <= DateTime.Today; date = date.AddDays(1))
+                {
+                    if (date.DayOfWeek == DayOfWeek.Saturday || date.DayOfWeek == DayOfWeek.Sunday)
+                    {
+                        continue;
+                    }
+
+                    bool overridden = random.NextDouble() < OverrideRatio;
+
+                    if (random.NextDouble() >= OverrideRatio)
+                    {
+                        table.Rows.Add(barraId, date, (decimal)(random.NextDouble() * 0.04 - 0.02), 0);
+                    }
+
+                    if (overridden)
+                    {
+                        table.Rows.Add(barraId, date, (decimal)(random.NextDouble() * 0.04 - 0.02), 1);
+                    }
+                }
+            }
+
+            return table;
+        }
+
+        private static BenchmarkResult MeasureReplay(string Name, int Iterations, ReplayDataSource Source, Action Run)
+        {
+            List<double> samples = new List<double>();
+            long rows;
+            long allocated;
+
+            using (DatabaseHelper.UseReplay(Source))
+            {
+                Run();
+
+                GC.Collect();
+                GC.WaitForPendingFinalizers();
+                GC.Collect();
+
+                rows = Source.RowsServed;
+                allocated = GC.GetTotalAllocatedBytes(true);
+
+                for (int i = 0; i < Iterations; i++)
+                {
+                    Stopwatch stopwatch = Stopwatch.StartNew();
+                    Run();
+                    samples.Add(stopwatch.Elapsed.TotalMilliseconds);
+                }
+
+                allocated = GC.GetTotalAllocatedBytes(true) - allocated;
+                rows = Source.RowsServed - rows;
+            }
+
+            samples.Sort();
+
+            return new BenchmarkResult
+            {
+                Name = Name,
+                Rows = (int)(rows / Iterations),
+                Iterations = Iterations,
+                ElapsedMilliseconds = samples.Average(),
+                P50Milliseconds = Percentile(samples, 0.50),
+                P99Milliseconds = Percentile(samples, 0.99),
+                AllocatedBytes = allocated / Iterations
+            };
+        }
+
+        private static double Percentile(List<double> Sorted, double Quantile)
+        {
+            int index = (int)Math.Ceiling(Sorted.Count * Quantile) - 1;
+
+            return Sorted[Math.Max(0, Math.Min(Sorted.Count - 1, index))];
+        }
+
+        private static DataTable CreateEVDashboardTemplate()
+        {
+            var columns = ReplayDataSource.ColumnsOf<EVDashboard>()
+                .Select(c => c.Key == "StressScore" ? new KeyValuePair<string, Type>("StressValueCode", c.Value)
+                    : c.Key == "StressScoreTooltip" ? new KeyValuePair<string, Type>("StressValueTooltip", c.Value)
+                    : c)
+                .Concat(new[] { new KeyValuePair<string, Type>("AlertDesc", typeof(string)) });
+
+            return ReplayDataSource.Synthesize("research.GetEVDashboard", columns);
+        }
+
+        private static DataTable CreateFactorReturnTemplate()
+        {
+            return ReplayDataSource.Synthesize("usmeds_fac_ret", new Dictionary<string, Type>
+            {
+                { "barraid", typeof(string) },
+                { "date", typeof(DateTime) },
+                { "totalreturn", typeof(decimal) },
+                { "src", typeof(int) }
+            });
+        }
+
+        private static DataTable CreateDashChartTemplate()
+        {
+            DataTable ReturnValue = ReplayDataSource.Synthesize("data.GetDashViewCharts", new Dictionary<string, Type>
+            {
+                { "DashViewChartId", typeof(long) },
+                { "DashChartId", typeof(long) },
+                { "Title", typeof(string) },
+                { "Aesthetic", typeof(string) },
+                { "DisplayOrder", typeof(int) },
+                { "DisplayWidth", typeof(int) },
+                { "DisplayHeight", typeof(int) },
+                { "ChartUrl", typeof(string) },
+                { "ChartHtml", typeof(string) },
+                { "UpdateMethod", typeof(string) }
+            });
+
+            foreach (DataRow row in ReturnValue.Rows)
+            {
+                row["ChartUrl"] = DBNull.Value;
+                row["ChartHtml"] = DBNull.Value;
+                row["UpdateMethod"] = "1";
+            }
+
+            return ReturnValue;
+        }
+
+        private static DataTable CreateDashChartQueryTemplate()
+        {
+            return ReplayDataSource.Synthesize("data.DashChartQuery", new Dictionary<string, Type>
+            {
+                { "DashChartId", typeof(long) },
+                { "DashQueryId", typeof(long) },
+                { "DashChartQueryId", typeof(long) },
+                { "QueryName", typeof(string) },
+                { "QueryDesc", typeof(string) },
+                { "Query", typeof(string) },
+                { "SpanId", typeof(long) },
+                { "StatId", typeof(long) },
+                { "PeriodTypeId", typeof(long) },
+                { "Aesthetic", typeof(string) },
+                { "AestheticNew", typeof(string) },
+                { "Xfield", typeof(string) },
+                { "Yfield", typeof(string) },
+                { "Name", typeof(string) },
+                { "CustomData", typeof(string) },
+                { "ModifiedOn", typeof(DateTime) }
+            }, 4);
+        }
+
+        private static DataTable CreateDashQueryCacheTemplate()
+        {
+            return ReplayDataSource.Synthesize("data.DashQueryCache", new Dictionary<string, Type>
+            {
+                { "DashQueryId", typeof(long) },
+                { "CacheData", typeof(string) }
+            }, 4);
+        }
+
+        private static BenchmarkResult Measure(string Name, Func<int> Run)
+        {
+            GC.Collect();
+            GC.WaitForPendingFinalizers();
+            GC.Collect();
+
+            long allocated = GC.GetAllocatedBytesForCurrentThread();
+            Stopwatch stopwatch = Stopwatch.StartNew();
+
+            int count = Run();
+
+            stopwatch.Stop();
+
+            return new BenchmarkResult
+            {
+                Name = Name,
+                Rows = count,
+                ElapsedMilliseconds = stopwatch.Elapsed.TotalMilliseconds,
+                AllocatedBytes = GC.GetAllocatedBytesForCurrentThread() - allocated
+            };
+        }
+
+        private static int MaterializeDynamic(DataTable table)
+        {
+            List<PnlCompare> ReturnValue = new List<PnlCompare>();
+
+            using (DbDataReader dataReader = table.CreateDataReader())
+            {
+                foreach (dynamic row in DatabaseHelper.ReadRows(dataReader))
+                {
+                    var dash = new PnlCompare
+                    {
+                        Timestamp1 = (row.Timestamp1 is System.DBNull ? null : row.Timestamp1),
+                        Timestamp2 = (row.Timestamp2 is System.DBNull ? null : row.Timestamp2),
+                        Desk = row.Desk,
+                        Sector = row.Sector,
+                        PositionBlock = row.PositionBlock,
+                        Symbol = row.Symbol,
+                        UnderlyingSymbol = row.UnderlyingSymbol,
+                        DTD1 = row.DTD1,
+                        MTD1 = row.MTD1,
+                        YTD1 = row.YTD1,
+                        DTD2 = row.DTD2,
+                        MTD2 = row.MTD2,
+                        YTD2 = row.YTD2,
+                        DeltaDTD = row.DeltaDTD,
+                        DeltaMTD = row.DeltaMTD,
+                        DeltaYTD = row.DeltaYTD
+                    };
+                    ReturnValue.Add(dash);
+                }
+            }
+
+            return ReturnValue.Count;
+        }
+
+        private static int MaterializeTyped(DataTable table)
+        {
+            using (DbDataReader dataReader = table.CreateDataReader())
+            {
+                return DatabaseHelper.ReadRows<PnlCompare>("benchmark.PnlCompare", dataReader, null, null).ToList().Count;
+            }
+        }
+
+        private static DataTable CreatePnlCompareTable(int RowCount)
+        {
+            DataTable table = new DataTable();
+            table.Columns.Add("Timestamp1", typeof(DateTime));
+            table.Columns.Add("Timestamp2", typeof(DateTime));
+
+            foreach (string column in new[] { "Desk", "Sector", "PositionBlock", "Symbol", "UnderlyingSymbol" })
+            {
+                table.Columns.Add(column, typeof(string));
+            }
+
+            foreach (string column in new[] { "DTD1", "MTD1", "YTD1", "DTD2", "MTD2", "YTD2", "DeltaDTD", "DeltaMTD", "DeltaYTD" })
+            {
+                table.Columns.Add(column, typeof(decimal));
+            }
+
+            Random random = new Random(42);
+            DateTime timestamp = DateTime.Today.AddHours(9);
+
+            for (int i = 0; i < RowCount; i++)
+            {
+                decimal dtd1 = random.Next(-100000, 100000);
+                decimal dtd2 = random.Next(-100000, 100000);
+
+                table.Rows.Add(timestamp, timestamp.AddMinutes(30),
+                    "Desk" + (i % 8), "Sector" + (i % 24), "Block" + (i % 300), "SYM" + i, "UND" + (i % 5000),
+                    dtd1, dtd1 * 3, dtd1 * 12, dtd2, dtd2 * 3, dtd2 * 12, dtd2 - dtd1, (dtd2 - dtd1) * 3, (dtd2 - dtd1) * 12);
+            }
+
+            return table;
+        }
+    }
 }